@@ -22,12 +22,18 @@
 """
 
 import abc
+import base64
+import binascii
+import bisect
+import collections
 import hashlib
 import json
 import os
 import sys
 
 import eventlet
+from eventlet import event
+from eventlet import semaphore
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_service import loopingcall
@@ -36,6 +42,7 @@ from oslo_utils import units
 import six
 
 from cinder.backup import driver
+from cinder import coordination
 from cinder import exception
 from cinder.i18n import _
 from cinder import objects
@@ -52,19 +59,307 @@ chunkedbackup_service_opts = [
                default='zlib',
                choices=['none', 'off', 'no',
                         'zlib', 'gzip',
-                        'bz2', 'bzip2'],
-               help='Compression algorithm (None to disable)'),
+                        'bz2', 'bzip2',
+                        'zstd', 'zstandard',
+                        'lz4'],
+               help='Compression algorithm (None to disable). zstd and lz4 '
+                    'require the zstandard and lz4 python libraries.'),
+    cfg.IntOpt('backup_compression_level',
+               help='Compression level used by the compression algorithm. '
+                    'Its valid range depends on the algorithm: 0-9 for '
+                    'zlib, 1-9 for bz2, 1-22 for zstd and 0-16 for lz4. '
+                    'The default of the algorithm is used when unset.'),
+    cfg.BoolOpt('backup_compression_adaptive',
+                default=False,
+                help='Compress a sample of each chunk before compressing it, '
+                     'and store the chunk uncompressed when the sample does '
+                     'not shrink by at least backup_compression_min_savings '
+                     'percent. This saves CPU on chunks with data that is '
+                     'already compressed or encrypted.'),
+    cfg.IntOpt('backup_compression_min_savings',
+               default=10,
+               min=0,
+               max=99,
+               help='Minimum percentage of its size a chunk must shrink by '
+                    'to be stored compressed when '
+                    'backup_compression_adaptive is enabled.'),
+    cfg.IntOpt('backup_object_writers',
+               default=1,
+               min=1,
+               help='Number of chunks of a single backup that are written '
+                    'to the backup repository concurrently.'),
+    cfg.IntOpt('backup_max_inflight_chunks',
+               default=2,
+               min=1,
+               help='Maximum number of chunks of a single backup that have '
+                    'been read from the volume but are not stored in the '
+                    'backup repository yet. This bounds the memory used by '
+                    'a backup to about this number times the chunk size. '
+                    'It is never lower than backup_object_writers.'),
+    cfg.IntOpt('backup_restore_prefetch_objects',
+               default=1,
+               min=0,
+               help='Number of backup objects that are downloaded and '
+                    'decompressed concurrently during a restore, ahead of '
+                    'the object being written to the volume.'),
+    cfg.IntOpt('backup_restore_fsync_objects',
+               default=8,
+               min=1,
+               help='Number of backup objects written to the volume between '
+                    'flushes of its data to disk during a restore. The '
+                    'volume is always flushed once the restore is '
+                    'complete.'),
+    cfg.BoolOpt('backup_dedup',
+                default=False,
+                help='Keep an index of the content of the objects stored in '
+                     'each backup container, so chunks whose data is '
+                     'already stored in the container are referenced '
+                     'instead of uploaded again. Objects are only deleted '
+                     'once no backup references them. The index is read '
+                     'and rewritten in full by every backup and deletion '
+                     'in the container, so containers holding many backups '
+                     'should be avoided.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(chunkedbackup_service_opts)
 
+# Slices of a chunk compressed to estimate its compressibility when adaptive
+# compression is enabled.
+COMPRESSION_SAMPLES = 4
+COMPRESSION_SAMPLE_BYTES = 64 * units.Ki
+
 
 # Object writer and reader returned by inheriting classes must not have any
 # logging calls, as well as the compression libraries, as eventlet has a bug
 # (https://github.com/eventlet/eventlet/issues/432) that would result in
 # failures.
 
+
+class _ChunkPipeline(object):
+    """Bounded pipeline to store the chunks of a backup concurrently.
+
+    Every submitted chunk is processed in its own greenthread, so hashing and
+    compression (which run in native threads) of one chunk overlap with the
+    upload of others and with the reading of the volume. Writes to the backup
+    repository are limited to ``writers`` at a time, and ``submit`` blocks
+    while there are ``max_inflight`` chunks pending, waiting for the oldest
+    one to complete.
+    """
+
+    def __init__(self, writers, max_inflight):
+        self.writers = semaphore.Semaphore(writers)
+        self.max_inflight = max(writers, max_inflight)
+        self._inflight = collections.deque()
+
+    def submit(self, func, *args, **kwargs):
+        while len(self._inflight) >= self.max_inflight:
+            self._inflight.popleft().wait()
+        self._inflight.append(eventlet.spawn(func, *args, **kwargs))
+
+    def wait(self):
+        """Wait for all pending chunks, raising the first failure."""
+        while self._inflight:
+            self._inflight.popleft().wait()
+
+    def abort(self):
+        """Wait for all pending chunks ignoring their failures."""
+        while self._inflight:
+            try:
+                self._inflight.popleft().wait()
+            except Exception:
+                pass
+
+
+SHA256_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def _sha256_digests(data, block_size):
+    """Return the concatenated sha256 digests of the blocks of data."""
+    view = memoryview(data)
+    return b''.join(hashlib.sha256(view[offset:offset + block_size]).digest()
+                    for offset in range(0, len(view), block_size))
+
+
+def _changed_extents(digests, parent_digests, block_size, length):
+    """Return the (start, end) offsets of blocks whose digests changed.
+
+    Both digest arguments are concatenated sha256 digests of consecutive
+    blocks. Blocks without a parent digest are considered changed.
+    """
+    if digests == parent_digests:
+        return []
+    extents = []
+    extent_off = None
+    for index, pos in enumerate(range(0, len(digests), SHA256_DIGEST_SIZE)):
+        end = pos + SHA256_DIGEST_SIZE
+        if digests[pos:end] != parent_digests[pos:end]:
+            if extent_off is None:
+                # Start of new extent.
+                extent_off = index * block_size
+        elif extent_off is not None:
+            # We've reached the end of extent.
+            extents.append((extent_off, index * block_size))
+            extent_off = None
+    # The last extent extends to the end of data buffer.
+    if extent_off is not None:
+        extents.append((extent_off, length))
+    return extents
+
+
+class _DedupIndex(object):
+    """Content index of the objects stored in a backup container.
+
+    The index is read from the container when a backup starts and is used
+    to find chunks whose data is already stored. New objects and references
+    made by the backup are only merged into the stored index, under a lock,
+    when the backup is finalized.
+
+    The stored index is a single JSON object per container that every
+    backup and delete reads and rewrites in full under the same lock, so
+    its cost grows with the number of objects in the container and the
+    backups and deletes of a container are serialized while they update
+    it. Containers holding many backups should be split, for instance by
+    volume, when dedup is enabled.
+    """
+
+    VERSION = '1.0.0'
+
+    def __init__(self, index=None):
+        index = index or {}
+        self.objects = index.get('objects', {})
+        self.sha256s = index.get('sha256s', {})
+        self.added = {}
+        self.referenced = []
+        # Events of the data being uploaded by chunks of this backup, by
+        # sha256, so chunks with the same data wait instead of uploading it
+        # again.
+        self.pending = {}
+
+    def to_dict(self):
+        return {'version': self.VERSION,
+                'objects': self.objects,
+                'sha256s': self.sha256s}
+
+    def lookup(self, sha256):
+        """Return the name and info of an object holding the given data."""
+        object_name = self.sha256s.get(sha256)
+        if object_name is not None:
+            return object_name, self.objects[object_name]
+        for object_name, info in self.added.items():
+            if info['sha256'] == sha256:
+                return object_name, info
+        return None, None
+
+    def claim(self, sha256):
+        """Find an object holding the given data, or claim its upload.
+
+        Waits for a chunk of this backup that is uploading the same data.
+        Returns the name and info of the object holding the data, or None,
+        None when the caller has to upload it, then call add or abandon.
+        """
+        while True:
+            object_name, info = self.lookup(sha256)
+            if object_name is not None:
+                return object_name, info
+            pending = self.pending.get(sha256)
+            if pending is None:
+                self.pending[sha256] = event.Event()
+                return None, None
+            pending.wait()
+
+    def abandon(self, sha256):
+        """Release the claim of an upload that failed."""
+        self.pending.pop(sha256).send()
+
+    def add(self, object_name, sha256, compression, md5):
+        self.added[object_name] = {'sha256': sha256,
+                                   'compression': compression,
+                                   'md5': md5}
+        self.referenced.append(object_name)
+        pending = self.pending.pop(sha256, None)
+        if pending is not None:
+            pending.send()
+
+    def reference(self, object_name):
+        self.referenced.append(object_name)
+
+    def merge(self, index):
+        """Merge the changes of this backup into the current stored index.
+
+        Returns the names of the referenced objects that no longer exist.
+        """
+        for object_name, info in self.added.items():
+            entry = dict(info, refs=0)
+            index.objects[object_name] = entry
+            index.sha256s.setdefault(info['sha256'], object_name)
+        missing = []
+        for object_name in self.referenced:
+            entry = index.objects.get(object_name)
+            if entry is None:
+                missing.append(object_name)
+            else:
+                entry['refs'] += 1
+        return missing
+
+    def release(self, object_names):
+        """Drop references, returning the objects that are not used anymore.
+
+        Only objects known by the index are considered, so the returned
+        list does not include objects the index never tracked.
+        """
+        unused = []
+        for object_name in object_names:
+            entry = self.objects.get(object_name)
+            if entry is None:
+                continue
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                unused.append(object_name)
+                del self.objects[object_name]
+                if self.sha256s.get(entry['sha256']) == object_name:
+                    del self.sha256s[entry['sha256']]
+        return unused
+
+
+class _ExtentMap(object):
+    """Map of volume extents to the backup objects that hold their data.
+
+    Extents are kept sorted and without overlaps. Adding an extent replaces
+    anything previously mapped in its range, so adding the objects of a chain
+    of backups from the oldest to the newest one leaves, for every offset,
+    the object with the most recent data.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._extents = []
+
+    def add(self, start, end, source):
+        index = bisect.bisect_right(self._starts, start)
+        if index and self._extents[index - 1][1] > start:
+            index -= 1
+        last = index
+        replaced = []
+        while last < len(self._extents) and self._extents[last][0] < end:
+            replaced.append(self._extents[last])
+            last += 1
+        new = []
+        if replaced and replaced[0][0] < start:
+            new.append((replaced[0][0], start, replaced[0][2]))
+        new.append((start, end, source))
+        if replaced and replaced[-1][1] > end:
+            new.append((end, replaced[-1][1], replaced[-1][2]))
+        self._extents[index:last] = new
+        self._starts[index:last] = [extent[0] for extent in new]
+
+    def __iter__(self):
+        return iter(self._extents)
+
+    def __len__(self):
+        return len(self._extents)
+
+
 @six.add_metaclass(abc.ABCMeta)
 class ChunkedBackupDriver(driver.BackupDriver):
     """Abstract chunked backup driver.
@@ -80,6 +375,10 @@ class ChunkedBackupDriver(driver.BackupDriver):
 
     DRIVER_VERSION = '1.0.0'
     DRIVER_VERSION_MAPPING = {'1.0.0': '_restore_v1'}
+    # Version 2.0.0 of the sha256 file stores the digests as a single base64
+    # string instead of a list of hex strings.
+    SHA256FILE_VERSION = '2.0.0'
+    DEDUP_INDEX_FILENAME = 'backup_dedup_index'
 
     def _get_compressor(self, algorithm):
         try:
@@ -91,6 +390,12 @@ class ChunkedBackupDriver(driver.BackupDriver):
             elif algorithm.lower() in ('bz2', 'bzip2'):
                 import bz2 as compressor
                 result = compressor
+            elif algorithm.lower() in ('zstd', 'zstandard'):
+                import zstandard as compressor
+                result = compressor
+            elif algorithm.lower() == 'lz4':
+                import lz4.frame as compressor
+                result = compressor
             else:
                 result = None
             if result:
@@ -118,6 +423,10 @@ class ChunkedBackupDriver(driver.BackupDriver):
         self.backup_compression_algorithm = CONF.backup_compression_algorithm
         self.compressor = \
             self._get_compressor(CONF.backup_compression_algorithm)
+        self.compression_level = CONF.backup_compression_level
+        self.compression_adaptive = CONF.backup_compression_adaptive
+        self.compression_min_savings = CONF.backup_compression_min_savings
+        self.backup_dedup = CONF.backup_dedup
         self.support_force_delete = True
 
         if sys.platform == 'win32' and self.chunk_size_bytes % 4096:
@@ -267,20 +576,21 @@ class ChunkedBackupDriver(driver.BackupDriver):
             writer.write(metadata_json)
         LOG.debug('_write_metadata finished. Metadata: %s.', metadata_json)
 
-    def _write_sha256file(self, backup, volume_id, container, sha256_list):
+    def _write_sha256file(self, backup, volume_id, container, sha256s):
         filename = self._sha256_filename(backup)
         LOG.debug('_write_sha256file started, container name: %(container)s,'
                   ' sha256file filename: %(filename)s.',
                   {'container': container, 'filename': filename})
         sha256file = {}
-        sha256file['version'] = self.DRIVER_VERSION
+        sha256file['version'] = self.SHA256FILE_VERSION
         sha256file['backup_id'] = backup['id']
         sha256file['volume_id'] = volume_id
         sha256file['backup_name'] = backup['display_name']
         sha256file['backup_description'] = backup['display_description']
         sha256file['created_at'] = six.text_type(backup['created_at'])
         sha256file['chunk_size'] = self.sha_block_size_bytes
-        sha256file['sha256s'] = sha256_list
+        sha256file['sha256s'] = base64.b64encode(
+            bytes(sha256s)).decode('ascii')
         sha256file_json = json.dumps(sha256file, sort_keys=True, indent=2)
         if six.PY3:
             sha256file_json = sha256file_json.encode('utf-8')
@@ -316,6 +626,68 @@ class ChunkedBackupDriver(driver.BackupDriver):
         LOG.debug('_read_sha256file finished.')
         return sha256file
 
+    def _get_sha256_digests(self, sha256file):
+        """Return the digests of a sha256 file concatenated in one string."""
+        version = sha256file['version']
+        if version == self.SHA256FILE_VERSION:
+            return base64.b64decode(sha256file['sha256s'])
+        if version == '1.0.0':
+            return b''.join(binascii.unhexlify(sha256)
+                            for sha256 in sha256file['sha256s'])
+        err = _('No support for sha256 file version %s.') % version
+        raise exception.InvalidBackup(reason=err)
+
+    def _has_dedup_index(self, container):
+        filename = self.DEDUP_INDEX_FILENAME
+        return filename in self.get_container_entries(container, filename)
+
+    def _read_dedup_index(self, container):
+        """Read the dedup index of a container, empty if there is none."""
+        if not self._has_dedup_index(container):
+            return _DedupIndex()
+        filename = self.DEDUP_INDEX_FILENAME
+        with self._get_object_reader(container, filename) as reader:
+            index_json = reader.read()
+        if six.PY3:
+            index_json = index_json.decode('utf-8')
+        return _DedupIndex(json.loads(index_json))
+
+    def _write_dedup_index(self, container, dedup_index):
+        index_json = json.dumps(dedup_index.to_dict(), sort_keys=True)
+        if six.PY3:
+            index_json = index_json.encode('utf-8')
+        with self._get_object_writer(container,
+                                     self.DEDUP_INDEX_FILENAME) as writer:
+            writer.write(index_json)
+
+    @coordination.synchronized('backup-dedup-{container}')
+    def _commit_dedup_index(self, container, dedup_index):
+        """Merge the objects added and referenced by a backup."""
+        index = self._read_dedup_index(container)
+        missing = dedup_index.merge(index)
+        if missing:
+            msg = (_('Deduplicated objects %s were deleted during the '
+                     'backup.') % missing)
+            raise exception.BackupOperationError(msg)
+        self._write_dedup_index(container, index)
+        LOG.debug('Dedup index of container %(container)s updated: '
+                  '%(added)d objects added, %(referenced)d references.',
+                  {'container': container,
+                   'added': len(dedup_index.added),
+                   'referenced': len(dedup_index.referenced)})
+
+    @coordination.synchronized('backup-dedup-{container}')
+    def _release_dedup_objects(self, container, object_names):
+        """Drop references from the dedup index of a container.
+
+        Returns the objects that are no longer referenced and the set of
+        objects that the index still tracks.
+        """
+        index = self._read_dedup_index(container)
+        unused = index.release(object_names)
+        self._write_dedup_index(container, index)
+        return unused, set(index.objects)
+
     def _prepare_backup(self, backup):
         """Prepare the backup process and return the backup metadata."""
         volume = self.db.volume_get(self.context, backup.volume_id)
@@ -344,7 +716,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
                   })
         object_meta = {'id': 1, 'list': [], 'prefix': object_prefix,
                        'volume_meta': None}
-        object_sha256 = {'id': 1, 'sha256s': [], 'prefix': object_prefix}
+        object_sha256 = {'id': 1, 'sha256s': bytearray(),
+                         'prefix': object_prefix}
         extra_metadata = self.get_extra_metadata(backup, volume)
         if extra_metadata is not None:
             object_meta['extra_metadata'] = extra_metadata
@@ -352,9 +725,20 @@ class ChunkedBackupDriver(driver.BackupDriver):
         return (object_meta, object_sha256, extra_metadata, container,
                 volume_size_bytes)
 
+    def _create_chunk_pipeline(self):
+        return _ChunkPipeline(CONF.backup_object_writers,
+                              CONF.backup_max_inflight_chunks)
+
     def _backup_chunk(self, backup, container, data, data_offset,
-                      object_meta, extra_metadata):
-        """Backup data chunk based on the object metadata and offset."""
+                      object_meta, extra_metadata, pipeline=None,
+                      dedup_index=None):
+        """Backup data chunk based on the object metadata and offset.
+
+        The object name and its entry in the object list are reserved here,
+        in the order chunks are read, so the metadata is the same regardless
+        of the order in which the chunks complete. Compression and upload are
+        submitted to the pipeline, if one is provided, or done inline.
+        """
         object_prefix = object_meta['prefix']
         object_list = object_meta['list']
 
@@ -364,36 +748,121 @@ class ChunkedBackupDriver(driver.BackupDriver):
         obj[object_name] = {}
         obj[object_name]['offset'] = data_offset
         obj[object_name]['length'] = len(data)
-        LOG.debug('Backing up chunk of data from volume.')
-        algorithm, output_data = self._prepare_output_data(data)
-        obj[object_name]['compression'] = algorithm
-        LOG.debug('About to put_object')
-        with self._get_object_writer(
-                container, object_name, extra_metadata=extra_metadata
-        ) as writer:
-            writer.write(output_data)
-        md5 = hashlib.md5(data).hexdigest()
-        obj[object_name]['md5'] = md5
-        LOG.debug('backup MD5 for %(object_name)s: %(md5)s',
-                  {'object_name': object_name, 'md5': md5})
         object_list.append(obj)
         object_id += 1
         object_meta['list'] = object_list
         object_meta['id'] = object_id
 
+        LOG.debug('Backing up chunk of data from volume.')
+        own_pipeline = pipeline is None
+        if own_pipeline:
+            pipeline = self._create_chunk_pipeline()
+        pipeline.submit(self._store_chunk, container, object_name,
+                        obj[object_name], data, extra_metadata,
+                        pipeline.writers, dedup_index)
+        if own_pipeline:
+            pipeline.wait()
+
         LOG.debug('Calling eventlet.sleep(0)')
         eventlet.sleep(0)
 
+    def _store_chunk(self, container, object_name, object_info, data,
+                     extra_metadata, writers, dedup_index=None):
+        """Compress and write a chunk, filling in its object metadata.
+
+        When a dedup index is provided and it already has an object with the
+        same data, the chunk is not written and the metadata references that
+        object instead. Chunks with the same data as one being written wait
+        for it to complete and reference it.
+        """
+        # Hashing large buffers releases the GIL, so do it in a native thread
+        # like the compression.
+        md5 = eventlet.tpool.execute(hashlib.md5, data).hexdigest()
+        if dedup_index is not None:
+            sha256 = eventlet.tpool.execute(hashlib.sha256, data).hexdigest()
+            ref_name, ref_info = dedup_index.claim(sha256)
+            if ref_name is not None:
+                dedup_index.reference(ref_name)
+                object_info['compression'] = ref_info['compression']
+                object_info['md5'] = ref_info['md5']
+                object_info['dedup_ref'] = ref_name
+                LOG.debug('Chunk %(object_name)s is already stored in '
+                          '%(ref_name)s.',
+                          {'object_name': object_name, 'ref_name': ref_name})
+                return
+
+        try:
+            algorithm, output_data = self._prepare_output_data(data)
+            with writers:
+                LOG.debug('About to put_object')
+                with self._get_object_writer(
+                        container, object_name, extra_metadata=extra_metadata
+                ) as writer:
+                    writer.write(output_data)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if dedup_index is not None:
+                    dedup_index.abandon(sha256)
+        object_info['compression'] = algorithm
+        object_info['md5'] = md5
+        if dedup_index is not None:
+            dedup_index.add(object_name, sha256, algorithm, md5)
+        LOG.debug('backup MD5 for %(object_name)s: %(md5)s',
+                  {'object_name': object_name, 'md5': md5})
+
+    def _compress(self, data):
+        # The compressor is a native thread proxy, so compression doesn't
+        # prevent cooperative greenthread switching.
+        if self.compression_level is None:
+            return self.compressor.compress(data)
+        return self.compressor.compress(data, self.compression_level)
+
+    def _get_compression_sample(self, data):
+        """Return evenly spaced slices of the data to estimate its ratio.
+
+        Returns None when the data is too small for sampling to pay off.
+        """
+        if len(data) <= COMPRESSION_SAMPLES * COMPRESSION_SAMPLE_BYTES:
+            return None
+        view = memoryview(data)
+        step = (len(data) - COMPRESSION_SAMPLE_BYTES) // (
+            COMPRESSION_SAMPLES - 1)
+        return b''.join(view[i * step:i * step + COMPRESSION_SAMPLE_BYTES]
+                        for i in range(COMPRESSION_SAMPLES))
+
+    def _is_compression_effective(self, data_size_bytes, comp_size_bytes):
+        if comp_size_bytes >= data_size_bytes:
+            return False
+        if not self.compression_adaptive:
+            return True
+        savings = data_size_bytes - comp_size_bytes
+        return savings * 100 >= data_size_bytes * self.compression_min_savings
+
     def _prepare_output_data(self, data):
         if self.compressor is None:
             return 'none', data
         data_size_bytes = len(data)
-        # Execute compression in native thread so it doesn't prevent
-        # cooperative greenthread switching.
-        compressed_data = self.compressor.compress(data)
-        comp_size_bytes = len(compressed_data)
         algorithm = CONF.backup_compression_algorithm.lower()
-        if comp_size_bytes >= data_size_bytes:
+        if self.compression_adaptive:
+            sample = self._get_compression_sample(data)
+            if sample is not None:
+                sample_size_bytes = len(sample)
+                comp_size_bytes = len(self._compress(sample))
+                if not self._is_compression_effective(sample_size_bytes,
+                                                      comp_size_bytes):
+                    LOG.debug('Compression of a sample of this chunk was '
+                              'ineffective: sample length: '
+                              '%(sample_size_bytes)d, compressed length: '
+                              '%(comp_size_bytes)d. Using original data for '
+                              'this chunk.',
+                              {'sample_size_bytes': sample_size_bytes,
+                               'comp_size_bytes': comp_size_bytes,
+                               })
+                    return 'none', data
+        compressed_data = self._compress(data)
+        comp_size_bytes = len(compressed_data)
+        if not self._is_compression_effective(data_size_bytes,
+                                              comp_size_bytes):
             LOG.debug('Compression of this chunk was ineffective: '
                       'original length: %(data_size_bytes)d, '
                       'compressed length: %(compressed_size_bytes)d. '
@@ -410,17 +879,22 @@ class ChunkedBackupDriver(driver.BackupDriver):
                    })
         return algorithm, compressed_data
 
-    def _finalize_backup(self, backup, container, object_meta, object_sha256):
+    def _finalize_backup(self, backup, container, object_meta, object_sha256,
+                         dedup_index=None):
         """Write the backup's metadata to the backup repository."""
         object_list = object_meta['list']
         object_id = object_meta['id']
         volume_meta = object_meta['volume_meta']
-        sha256_list = object_sha256['sha256s']
+        sha256s = object_sha256['sha256s']
         extra_metadata = object_meta.get('extra_metadata')
         self._write_sha256file(backup,
                                backup.volume_id,
                                container,
-                               sha256_list)
+                               sha256s)
+        # References are committed before the metadata is written, so a
+        # backup that can be restored never refers to unreferenced objects.
+        if dedup_index is not None:
+            self._commit_dedup_index(container, dedup_index)
         self._write_metadata(backup,
                              backup.volume_id,
                              container,
@@ -489,7 +963,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
             parent_backup = objects.Backup.get_by_id(self.context,
                                                      backup.parent_id)
             parent_backup_shafile = self._read_sha256file(parent_backup)
-            parent_backup_shalist = parent_backup_shafile['sha256s']
+            parent_backup_sha256s = self._get_sha256_digests(
+                parent_backup_shafile)
             if (parent_backup_shafile['chunk_size'] !=
                     self.sha_block_size_bytes):
                 err = (_('Hash block size has changed since the last '
@@ -514,6 +989,9 @@ class ChunkedBackupDriver(driver.BackupDriver):
 
         (object_meta, object_sha256, extra_metadata, container,
          volume_size_bytes) = self._prepare_backup(backup)
+        dedup_index = None
+        if self.backup_dedup:
+            dedup_index = self._read_dedup_index(container)
 
         counter = 0
         total_block_sent_num = 0
@@ -533,96 +1011,83 @@ class ChunkedBackupDriver(driver.BackupDriver):
         if self.enable_progress_timer:
             timer.start(interval=self.backup_timer_interval)
 
-        sha256_list = object_sha256['sha256s']
-        shaindex = 0
+        pipeline = self._create_chunk_pipeline()
+        sha256s = object_sha256['sha256s']
         is_backup_canceled = False
-        while True:
-            # First of all, we check the status of this backup. If it
-            # has been changed to delete or has been deleted, we cancel the
-            # backup process to do forcing delete.
-            backup.refresh()
-            if backup.status in (fields.BackupStatus.DELETING,
-                                 fields.BackupStatus.DELETED):
-                is_backup_canceled = True
-                # To avoid the chunk left when deletion complete, need to
-                # clean up the object of chunk again.
-                self.delete_backup(backup)
-                LOG.debug('Cancel the backup process of %s.', backup.id)
-                break
-            data_offset = volume_file.tell()
-
-            if sys.platform == 'win32':
-                read_bytes = min(self.chunk_size_bytes,
-                                 win32_disk_size - data_offset)
-            else:
-                read_bytes = self.chunk_size_bytes
-            data = volume_file.read(read_bytes)
-
-            if data == b'':
-                break
-
-            # Calculate new shas with the datablock.
-            shalist = []
-            off = 0
-            datalen = len(data)
-            while off < datalen:
-                chunk_start = off
-                chunk_end = chunk_start + self.sha_block_size_bytes
-                if chunk_end > datalen:
-                    chunk_end = datalen
-                chunk = data[chunk_start:chunk_end]
-                sha = hashlib.sha256(chunk).hexdigest()
-                shalist.append(sha)
-                off += self.sha_block_size_bytes
-            sha256_list.extend(shalist)
-
-            # If parent_backup is not None, that means an incremental
-            # backup will be performed.
-            if parent_backup:
-                # Find the extent that needs to be backed up.
-                extent_off = -1
-                for idx, sha in enumerate(shalist):
-                    if sha != parent_backup_shalist[shaindex]:
-                        if extent_off == -1:
-                            # Start of new extent.
-                            extent_off = idx * self.sha_block_size_bytes
-                    else:
-                        if extent_off != -1:
-                            # We've reached the end of extent.
-                            extent_end = idx * self.sha_block_size_bytes
-                            segment = data[extent_off:extent_end]
-                            self._backup_chunk(backup, container, segment,
-                                               data_offset + extent_off,
-                                               object_meta,
-                                               extra_metadata)
-                            extent_off = -1
-                    shaindex += 1
-
-                # The last extent extends to the end of data buffer.
-                if extent_off != -1:
-                    extent_end = datalen
-                    segment = data[extent_off:extent_end]
-                    self._backup_chunk(backup, container, segment,
-                                       data_offset + extent_off,
-                                       object_meta, extra_metadata)
-                    extent_off = -1
-            else:  # Do a full backup.
-                self._backup_chunk(backup, container, data, data_offset,
-                                   object_meta, extra_metadata)
-
-            # Notifications
-            total_block_sent_num += self.data_block_num
-            counter += 1
-            if counter == self.data_block_num:
-                # Send the notification to Ceilometer when the chunk
-                # number reaches the data_block_num.  The backup percentage
-                # is put in the metadata as the extra information.
-                self._send_progress_notification(self.context, backup,
-                                                 object_meta,
-                                                 total_block_sent_num,
-                                                 volume_size_bytes)
-                # Reset the counter
-                counter = 0
+        try:
+            while True:
+                # First of all, we check the status of this backup. If it
+                # has been changed to delete or has been deleted, we cancel the
+                # backup process to do forcing delete.
+                backup.refresh()
+                if backup.status in (fields.BackupStatus.DELETING,
+                                     fields.BackupStatus.DELETED):
+                    is_backup_canceled = True
+                    # To avoid the chunk left when deletion complete, need to
+                    # clean up the object of chunk again, once the chunks
+                    # still in flight are done.
+                    pipeline.abort()
+                    self.delete_backup(backup)
+                    LOG.debug('Cancel the backup process of %s.', backup.id)
+                    break
+                data_offset = volume_file.tell()
+
+                if sys.platform == 'win32':
+                    read_bytes = min(self.chunk_size_bytes,
+                                     win32_disk_size - data_offset)
+                else:
+                    read_bytes = self.chunk_size_bytes
+                data = volume_file.read(read_bytes)
+
+                if data == b'':
+                    break
+
+                # Calculate new shas with the datablock, in a native thread
+                # since hashing releases the GIL.
+                shas = eventlet.tpool.execute(_sha256_digests, data,
+                                              self.sha_block_size_bytes)
+                shaoff = len(sha256s)
+                sha256s += shas
+
+                # If parent_backup is not None, that means an incremental
+                # backup will be performed.
+                if parent_backup:
+                    # Find the extents that need to be backed up, passing
+                    # views of the data to avoid copying it.
+                    parent_shas = parent_backup_sha256s[shaoff:
+                                                        shaoff + len(shas)]
+                    view = memoryview(data)
+                    for extent_off, extent_end in _changed_extents(
+                            shas, parent_shas, self.sha_block_size_bytes,
+                            len(data)):
+                        self._backup_chunk(backup, container,
+                                           view[extent_off:extent_end],
+                                           data_offset + extent_off,
+                                           object_meta, extra_metadata,
+                                           pipeline, dedup_index)
+                else:  # Do a full backup.
+                    self._backup_chunk(backup, container, data, data_offset,
+                                       object_meta, extra_metadata, pipeline,
+                                       dedup_index)
+
+                # Notifications
+                total_block_sent_num += self.data_block_num
+                counter += 1
+                if counter == self.data_block_num:
+                    # Send the notification to Ceilometer when the chunk
+                    # number reaches the data_block_num.  The backup percentage
+                    # is put in the metadata as the extra information.
+                    self._send_progress_notification(self.context, backup,
+                                                     object_meta,
+                                                     total_block_sent_num,
+                                                     volume_size_bytes)
+                    # Reset the counter
+                    counter = 0
+            # Wait for the remaining chunks to be stored.
+            pipeline.wait()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                pipeline.abort()
 
         # Stop the timer.
         timer.stop()
@@ -633,7 +1098,7 @@ class ChunkedBackupDriver(driver.BackupDriver):
         # All the data have been sent, the backup_percent reaches 100.
         self._send_progress_end(self.context, backup, object_meta)
 
-        object_sha256['sha256s'] = sha256_list
+        object_sha256['sha256s'] = sha256s
         if backup_metadata:
             try:
                 self._backup_metadata(backup, object_meta)
@@ -643,18 +1108,18 @@ class ChunkedBackupDriver(driver.BackupDriver):
                     LOG.exception("Backup volume metadata failed.")
                     self.delete_backup(backup)
 
-        self._finalize_backup(backup, container, object_meta, object_sha256)
+        self._finalize_backup(backup, container, object_meta, object_sha256,
+                              dedup_index)
 
-    def _restore_v1(self, backup, volume_id, metadata, volume_file):
-        """Restore a v1 volume backup."""
-        backup_id = backup['id']
-        LOG.debug('v1 volume backup restore of %s started.', backup_id)
-        extra_metadata = metadata.get('extra_metadata')
-        container = backup['container']
+    def _verify_v1_objects(self, backup, metadata):
+        """Check that the objects in the metadata are in the repository."""
         metadata_objects = metadata['objects']
         metadata_object_names = []
-        for obj in metadata_objects:
-            metadata_object_names.extend(obj.keys())
+        for metadata_object in metadata_objects:
+            # Deduplicated chunks are stored in objects of other backups.
+            metadata_object_names.extend(
+                object_name for object_name, obj in metadata_object.items()
+                if 'dedup_ref' not in obj)
         LOG.debug('metadata_object_names = %s.', metadata_object_names)
         prune_list = [self._metadata_filename(backup),
                       self._sha256_filename(backup)]
@@ -666,52 +1131,161 @@ class ChunkedBackupDriver(driver.BackupDriver):
                     'does not match object list stored in metadata.')
             raise exception.InvalidBackup(reason=err)
 
-        for metadata_object in metadata_objects:
+    def _add_v1_extents(self, extent_map, backup, metadata):
+        """Add the objects of a v1 backup to a restore extent map."""
+        extra_metadata = metadata.get('extra_metadata')
+        container = backup['container']
+        for metadata_object in metadata['objects']:
             object_name, obj = list(metadata_object.items())[0]
-            LOG.debug('restoring object. backup: %(backup_id)s, '
-                      'container: %(container)s, object name: '
-                      '%(object_name)s, volume: %(volume_id)s.',
-                      {
-                          'backup_id': backup_id,
-                          'container': container,
-                          'object_name': object_name,
-                          'volume_id': volume_id,
-                      })
-
-            with self._get_object_reader(
-                    container, object_name,
-                    extra_metadata=extra_metadata) as reader:
-                body = reader.read()
-            compression_algorithm = metadata_object[object_name]['compression']
-            decompressor = self._get_compressor(compression_algorithm)
-            volume_file.seek(obj['offset'])
-            if decompressor is not None:
-                LOG.debug('decompressing data using %s algorithm',
-                          compression_algorithm)
-                decompressed = decompressor.decompress(body)
-                volume_file.write(decompressed)
-            else:
-                volume_file.write(body)
+            source = (container, obj.get('dedup_ref', object_name),
+                      obj['offset'], obj['compression'], backup['id'])
+            extent_map.add(obj['offset'], obj['offset'] + obj['length'],
+                           (source, extra_metadata))
+
+    def _read_restore_object(self, source, extra_metadata, volume_id):
+        """Download and decompress an object that is going to be restored."""
+        (container, object_name, object_offset, compression_algorithm,
+         backup_id) = source
+        LOG.debug('restoring object. backup: %(backup_id)s, '
+                  'container: %(container)s, object name: '
+                  '%(object_name)s, volume: %(volume_id)s.',
+                  {
+                      'backup_id': backup_id,
+                      'container': container,
+                      'object_name': object_name,
+                      'volume_id': volume_id,
+                  })
 
-            # force flush every write to avoid long blocking write on close
-            volume_file.flush()
+        with self._get_object_reader(
+                container, object_name,
+                extra_metadata=extra_metadata) as reader:
+            body = reader.read()
+        decompressor = self._get_compressor(compression_algorithm)
+        if decompressor is not None:
+            LOG.debug('decompressing data using %s algorithm',
+                      compression_algorithm)
+            body = decompressor.decompress(body)
+        return body
+
+    @staticmethod
+    def _sync_volume_file(volume_file):
+        # force flush every write to avoid long blocking write on close
+        volume_file.flush()
+
+        # Be tolerant to IO implementations that do not support fileno()
+        try:
+            fileno = volume_file.fileno()
+        except IOError:
+            LOG.info("volume_file does not support fileno() so skipping "
+                     "fsync()")
+        else:
+            os.fsync(fileno)
+
+    def _restore_extents(self, extent_map, volume_id, volume_file):
+        """Write the data of the extents in the map to the volume.
+
+        Every object is read only once and only the parts of it that are
+        still in the map are written, so each byte of the volume is written
+        at most once. Objects are written in the order of their first extent
+        in the map, while the following backup_restore_prefetch_objects
+        objects are downloaded and decompressed concurrently.
+        """
+        object_extents = collections.OrderedDict()
+        extra_metadatas = {}
+        for start, end, (source, extra_metadata) in extent_map:
+            object_extents.setdefault(source, []).append((start, end))
+            extra_metadatas[source] = extra_metadata
+
+        prefetch = CONF.backup_restore_prefetch_objects
+        fsync_objects = CONF.backup_restore_fsync_objects
+        sources = iter(object_extents.items())
+        pending = collections.deque()
+        unsynced = 0
+        try:
+            while True:
+                while len(pending) <= prefetch:
+                    try:
+                        source, extents = next(sources)
+                    except StopIteration:
+                        break
+                    pending.append((source, extents, eventlet.spawn(
+                        self._read_restore_object, source,
+                        extra_metadatas[source], volume_id)))
+                if not pending:
+                    break
+
+                source, extents, reading = pending.popleft()
+                body = reading.wait()
+                object_offset = source[2]
+                for start, end in extents:
+                    volume_file.seek(start)
+                    if (start == object_offset and
+                            end - start == len(body)):
+                        volume_file.write(body)
+                    else:
+                        volume_file.write(body[start - object_offset:
+                                               end - object_offset])
+                body = None
+
+                unsynced += 1
+                if unsynced >= fsync_objects:
+                    self._sync_volume_file(volume_file)
+                    unsynced = 0
+
+                # Restoring a backup to a volume can take some time. Yield so
+                # other threads can run, allowing for among other things the
+                # service status to be updated
+                eventlet.sleep(0)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for pending_object in pending:
+                    try:
+                        pending_object[2].wait()
+                    except Exception:
+                        pass
 
-            # Be tolerant to IO implementations that do not support fileno()
-            try:
-                fileno = volume_file.fileno()
-            except IOError:
-                LOG.info("volume_file does not support fileno() so skipping "
-                         "fsync()")
-            else:
-                os.fsync(fileno)
+        if unsynced:
+            self._sync_volume_file(volume_file)
 
-            # Restoring a backup to a volume can take some time. Yield so other
-            # threads can run, allowing for among other things the service
-            # status to be updated
-            eventlet.sleep(0)
+    def _restore_v1(self, backup, volume_id, metadata, volume_file):
+        """Restore a v1 volume backup."""
+        backup_id = backup['id']
+        LOG.debug('v1 volume backup restore of %s started.', backup_id)
+        self._verify_v1_objects(backup, metadata)
+        extent_map = _ExtentMap()
+        self._add_v1_extents(extent_map, backup, metadata)
+        self._restore_extents(extent_map, volume_id, volume_file)
         LOG.debug('v1 volume backup restore of %s finished.',
                   backup_id)
 
+    def _get_restore_func(self, metadata):
+        metadata_version = metadata['version']
+        LOG.debug('Restoring backup version %s', metadata_version)
+        try:
+            return getattr(self, self.DRIVER_VERSION_MAPPING.get(
+                metadata_version))
+        except TypeError:
+            err = (_('No support to restore backup version %s')
+                   % metadata_version)
+            raise exception.InvalidBackup(reason=err)
+
+    def _restore_merged(self, backup_list, volume_id, volume_file):
+        """Restore a chain of v1 backups in a single pass.
+
+        Instead of restoring the full backup and then every incremental
+        backup on top of it, the objects of all the backups are merged into
+        a single extent map where the newest backup wins, and only the data
+        that survives is read and written.
+        """
+        extent_map = _ExtentMap()
+        for backup1, metadata in reversed(backup_list):
+            self._verify_v1_objects(backup1, metadata)
+            self._add_v1_extents(extent_map, backup1, metadata)
+        LOG.debug('Merged restore of %(count)d backups into %(extents)d '
+                  'extents.',
+                  {'count': len(backup_list), 'extents': len(extent_map)})
+        self._restore_extents(extent_map, volume_id, volume_file)
+
     def restore(self, backup, volume_id, volume_file):
         """Restore the given volume backup from backup repository."""
         backup_id = backup['id']
@@ -727,37 +1301,33 @@ class ChunkedBackupDriver(driver.BackupDriver):
                       'backup_id': backup_id,
                   })
         metadata = self._read_metadata(backup)
-        metadata_version = metadata['version']
-        LOG.debug('Restoring backup version %s', metadata_version)
-        try:
-            restore_func = getattr(self, self.DRIVER_VERSION_MAPPING.get(
-                metadata_version))
-        except TypeError:
-            err = (_('No support to restore backup version %s')
-                   % metadata_version)
-            raise exception.InvalidBackup(reason=err)
+        restore_funcs = [self._get_restore_func(metadata)]
 
-        # Build a list of backups based on parent_id. A full backup
-        # will be the last one in the list.
+        # Build a list of backups, with their metadata, based on parent_id.
+        # A full backup will be the last one in the list.
         backup_list = []
-        backup_list.append(backup)
+        backup_list.append((backup, metadata))
         current_backup = backup
         while current_backup.parent_id:
             prev_backup = objects.Backup.get_by_id(self.context,
                                                    current_backup.parent_id)
-            backup_list.append(prev_backup)
+            prev_metadata = self._read_metadata(prev_backup)
+            restore_funcs.append(self._get_restore_func(prev_metadata))
+            backup_list.append((prev_backup, prev_metadata))
             current_backup = prev_backup
 
-        # Do a full restore first, then layer the incremental backups
-        # on top of it in order.
-        index = len(backup_list) - 1
-        while index >= 0:
-            backup1 = backup_list[index]
-            index = index - 1
-            metadata = self._read_metadata(backup1)
-            restore_func(backup1, volume_id, metadata, volume_file)
-
-            volume_meta = metadata.get('volume_meta', None)
+        if all(func == self._restore_v1 for func in restore_funcs):
+            self._restore_merged(backup_list, volume_id, volume_file)
+        else:
+            # Do a full restore first, then layer the incremental backups
+            # on top of it in order.
+            for index in range(len(backup_list) - 1, -1, -1):
+                backup1, metadata1 = backup_list[index]
+                restore_funcs[index](backup1, volume_id, metadata1,
+                                     volume_file)
+
+        for backup1, metadata1 in reversed(backup_list):
+            volume_meta = metadata1.get('volume_meta', None)
             try:
                 if volume_meta:
                     self.put_metadata(volume_id, volume_meta)
@@ -771,6 +1341,41 @@ class ChunkedBackupDriver(driver.BackupDriver):
         LOG.debug('restore %(backup_id)s to %(volume_id)s finished.',
                   {'backup_id': backup_id, 'volume_id': volume_id})
 
+    def _release_dedup_references(self, backup, object_names):
+        """Release the references of a backup from the dedup index.
+
+        Returns the objects that can be deleted along with the backup: its
+        own objects that no other backup references, plus the objects of
+        other backups that were only kept because of this one.
+        """
+        container = backup['container']
+        try:
+            if not self._has_dedup_index(container):
+                return object_names
+        except Exception:
+            LOG.warning('Error while looking for the dedup index, keeping '
+                        'the objects of backup %s.', backup['id'])
+            return []
+
+        # Only backups whose metadata was written hold references.
+        referenced = []
+        try:
+            metadata = self._read_metadata(backup)
+        except Exception:
+            LOG.debug('No metadata for backup %s, it holds no references.',
+                      backup['id'])
+        else:
+            for metadata_object in metadata['objects']:
+                object_name, obj = list(metadata_object.items())[0]
+                referenced.append(obj.get('dedup_ref', object_name))
+
+        unused, tracked = self._release_dedup_objects(container, referenced)
+        deletable = [object_name for object_name in object_names
+                     if object_name not in tracked]
+        deletable.extend(object_name for object_name in unused
+                         if object_name not in deletable)
+        return deletable
+
     def delete_backup(self, backup):
         """Delete the given backup."""
         container = backup['container']
@@ -789,6 +1394,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
                 LOG.warning('Error while listing objects, continuing'
                             ' with delete.')
 
+            object_names = self._release_dedup_references(backup,
+                                                          object_names)
             for object_name in object_names:
                 self.delete_object(container, object_name)
                 LOG.debug('deleted object: %(object_name)s'
@@ -17,6 +17,7 @@
 LVM class for performing LVM operations.
 """
 
+import functools
 import math
 import os
 import re
@@ -24,7 +25,9 @@ import re
 from os_brick import executor
 from oslo_concurrency import processutils as putils
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import excutils
+from oslo_utils import timeutils
 from six import moves
 
 from cinder import exception
@@ -33,6 +36,24 @@ from cinder import utils
 
 LOG = logging.getLogger(__name__)
 
+# Fields of the LVs of the VG kept in the LV metadata cache.
+LV_CACHE_FIELDS = ('vg_name', 'lv_name', 'lv_size', 'lv_attr', 'origin')
+
+
+def invalidates_lv_cache(f):
+    """Decorator dropping the LV metadata cache once the LVM call is done.
+
+    The cache is dropped whether or not the wrapped call succeeded, since a
+    failed LVM command may still have changed the VG metadata.
+    """
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            self._invalidate_lv_cache()
+    return wrapper
+
 
 class LVM(executor.Executor):
     """LVM object to enable various LVM related operations."""
@@ -42,7 +63,7 @@ class LVM(executor.Executor):
     def __init__(self, vg_name, root_helper, create_vg=False,
                  physical_volumes=None, lvm_type='default',
                  executor=putils.execute, lvm_conf=None,
-                 suppress_fd_warn=False):
+                 suppress_fd_warn=False, lv_cache_ttl=5):
 
         """Initialize the LVM object.
 
@@ -57,6 +78,8 @@ class LVM(executor.Executor):
         :param lvm_type: VG and Volume type (default, or thin)
         :param executor: Execute method to use, None uses common/processutils
         :param suppress_fd_warn: Add suppress FD Warn to LVM env
+        :param lv_cache_ttl: Seconds the LV metadata of the VG is served
+                             from cache, 0 queries LVM on every lookup
 
         """
         super(LVM, self).__init__(execute=executor, root_helper=root_helper)
@@ -71,7 +94,12 @@ class LVM(executor.Executor):
         self.vg_thin_pool_free_space = 0.0
         self._supports_snapshot_lv_activation = None
         self._supports_lvchange_ignoreskipactivation = None
+        self._supports_lvs_json_report = None
         self.vg_provisioned_capacity = 0.0
+        self._lv_cache_ttl = lv_cache_ttl
+        self._lv_cache = None
+        self._lv_cache_time = None
+        self._lv_cache_generation = 0
 
         if lvm_type not in ['default', 'thin']:
             raise exception.Invalid('lvm_type must be "default" or "thin"')
@@ -258,6 +286,21 @@ class LVM(executor.Executor):
 
         return self._supports_lvchange_ignoreskipactivation
 
+    @property
+    def supports_lvs_json_report(self):
+        """Property indicating whether lvs can report in JSON format.
+
+        Check for LVM version >= 2.02.158, which added --reportformat.
+        """
+
+        if self._supports_lvs_json_report is not None:
+            return self._supports_lvs_json_report
+
+        self._supports_lvs_json_report = (
+            self.get_lvm_version(self._root_helper) >= (2, 2, 158))
+
+        return self._supports_lvs_json_report
+
     @staticmethod
     def supports_pvs_ignoreskippedcluster(root_helper):
         """Property indicating whether pvs supports --ignoreskippedcluster
@@ -324,17 +367,76 @@ class LVM(executor.Executor):
                                 self.vg_name,
                                 lv_name)
 
+    def _invalidate_lv_cache(self):
+        self._lv_cache = None
+        self._lv_cache_generation += 1
+
+    def _query_lvs(self):
+        """Gather the metadata of all the LVs of the VG with a single lvs.
+
+        :returns: Dictionary of LV metadata dictionaries keyed by LV name
+
+        """
+        cmd = LVM.LVM_CMD_PREFIX + ['lvs', '--unit=g', '--nosuffix',
+                                    '-o', ','.join(LV_CACHE_FIELDS)]
+        if self.supports_lvs_json_report:
+            cmd += ['--reportformat', 'json']
+        else:
+            cmd += ['--noheadings', '--separator', '|']
+        cmd.append(self.vg_name)
+
+        (out, _err) = self._execute(*cmd,
+                                    root_helper=self._root_helper,
+                                    run_as_root=True)
+
+        if self.supports_lvs_json_report:
+            rows = [lv for report in jsonutils.loads(out)['report']
+                    for lv in report.get('lv', [])]
+        else:
+            rows = [dict(zip(LV_CACHE_FIELDS, line.strip().split('|')))
+                    for line in out.splitlines() if line.strip()]
+
+        return {row['lv_name']: {'vg': row['vg_name'],
+                                 'name': row['lv_name'],
+                                 'size': row['lv_size'],
+                                 'attr': row['lv_attr'],
+                                 'origin': row.get('origin') or None}
+                for row in rows}
+
+    def _get_lv_metadata(self, name):
+        """Get the cached metadata of an LV of the VG.
+
+        The metadata of all the LVs of the VG is refreshed at once when it
+        is older than the cache TTL or was invalidated by a change made
+        through this object.
+
+        :param name: Name of the LV
+        :returns: dict with the vg, name, size, attr and origin of the LV,
+                  None if it does not exist
+
+        """
+        now = timeutils.now()
+        if (self._lv_cache is None or
+                now - self._lv_cache_time >= self._lv_cache_ttl):
+            generation = self._lv_cache_generation
+            lvs = self._query_lvs()
+            # Don't publish a listing that raced with a change to the VG.
+            if generation != self._lv_cache_generation:
+                return lvs.get(name)
+            self._lv_cache = lvs
+            self._lv_cache_time = now
+        return self._lv_cache.get(name)
+
     def get_volume(self, name):
         """Get reference object of volume specified by name.
 
         :returns: dict representation of Logical Volume if exists
 
         """
-        ref_list = self.get_volumes(name)
-        for r in ref_list:
-            if r['name'] == name:
-                return r
-        return None
+        lv = self._get_lv_metadata(name)
+        if lv is None:
+            return None
+        return {'vg': lv['vg'], 'name': lv['name'], 'size': lv['size']}
 
     @staticmethod
     def get_all_physical_volumes(root_helper, vg_name=None):
@@ -489,6 +591,7 @@ class LVM(executor.Executor):
         # leave 5% free for metadata
         return "%sg" % (self.vg_free_space * 0.95)
 
+    @invalidates_lv_cache
     def create_thin_pool(self, name=None, size_str=None):
         """Creates a thin provisioning pool for this VG.
 
@@ -530,6 +633,7 @@ class LVM(executor.Executor):
         self.vg_thin_pool = name
         return size_str
 
+    @invalidates_lv_cache
     def create_volume(self, name, size_str, lv_type='default', mirror_count=0):
         """Creates a logical volume on the object's VG.
 
@@ -572,6 +676,7 @@ class LVM(executor.Executor):
             raise
 
     @utils.retry(putils.ProcessExecutionError)
+    @invalidates_lv_cache
     def create_lv_snapshot(self, name, source_lv_name, lv_type='default'):
         """Creates a snapshot of a logical volume.
 
@@ -610,17 +715,10 @@ class LVM(executor.Executor):
         return '_' + name
 
     def _lv_is_active(self, name):
-        cmd = LVM.LVM_CMD_PREFIX + ['lvdisplay', '--noheading', '-C', '-o',
-                                    'Attr', '%s/%s' % (self.vg_name, name)]
-        out, _err = self._execute(*cmd,
-                                  root_helper=self._root_helper,
-                                  run_as_root=True)
-        if out:
-            out = out.strip()
-            if (out[4] == 'a'):
-                return True
-        return False
+        lv = self._get_lv_metadata(name)
+        return bool(lv) and lv['attr'][4] == 'a'
 
+    @invalidates_lv_cache
     def deactivate_lv(self, name):
         lv_path = self.vg_name + '/' + self._mangle_lv_name(name)
         cmd = ['lvchange', '-a', 'n']
@@ -645,6 +743,7 @@ class LVM(executor.Executor):
     def _wait_for_volume_deactivation(self, name):
         LOG.debug("Checking to see if volume %s has been deactivated.",
                   name)
+        self._invalidate_lv_cache()
         if self._lv_is_active(name):
             LOG.debug("Volume %s is still active.", name)
             raise exception.VolumeNotDeactivated(name=name)
@@ -652,6 +751,7 @@ class LVM(executor.Executor):
             LOG.debug("Volume %s has been deactivated.", name)
 
     @utils.retry(putils.ProcessExecutionError, retries=5, backoff_rate=2)
+    @invalidates_lv_cache
     def activate_lv(self, name, is_snapshot=False, permanent=False):
         """Ensure that logical volume/snapshot logical volume is activated.
 
@@ -696,6 +796,7 @@ class LVM(executor.Executor):
             raise
 
     @utils.retry(putils.ProcessExecutionError)
+    @invalidates_lv_cache
     def delete(self, name):
         """Delete logical volume or snapshot.
 
@@ -742,6 +843,7 @@ class LVM(executor.Executor):
             LOG.debug('Successfully deleted volume: %s after '
                       'udev settle.', name)
 
+    @invalidates_lv_cache
     def revert(self, snapshot_name):
         """Revert an LV to snapshot.
 
@@ -760,55 +862,45 @@ class LVM(executor.Executor):
             raise
 
     def lv_has_snapshot(self, name):
-        cmd = LVM.LVM_CMD_PREFIX + ['lvdisplay', '--noheading', '-C', '-o',
-                                    'Attr', '%s/%s' % (self.vg_name, name)]
-        out, _err = self._execute(*cmd,
-                                  root_helper=self._root_helper,
-                                  run_as_root=True)
-        if out:
-            out = out.strip()
-            if (out[0] == 'o') or (out[0] == 'O'):
-                return True
-        return False
+        lv = self._get_lv_metadata(name)
+        return bool(lv) and lv['attr'][0] in ('o', 'O')
 
     def lv_is_snapshot(self, name):
         """Return True if LV is a snapshot, False otherwise."""
-        cmd = LVM.LVM_CMD_PREFIX + ['lvdisplay', '--noheading', '-C', '-o',
-                                    'Attr', '%s/%s' % (self.vg_name, name)]
-        out, _err = self._execute(*cmd,
-                                  root_helper=self._root_helper,
-                                  run_as_root=True)
-        out = out.strip()
-        if out:
-            if (out[0] == 's'):
-                return True
-        return False
+        lv = self._get_lv_metadata(name)
+        return bool(lv) and lv['attr'][0] == 's'
 
     def lv_is_open(self, name):
         """Return True if LV is currently open, False otherwise."""
-        cmd = LVM.LVM_CMD_PREFIX + ['lvdisplay', '--noheading', '-C', '-o',
-                                    'Attr', '%s/%s' % (self.vg_name, name)]
-        out, _err = self._execute(*cmd,
-                                  root_helper=self._root_helper,
-                                  run_as_root=True)
-        out = out.strip()
-        if out:
-            if (out[5] == 'o'):
-                return True
-        return False
+        lv = self._get_lv_metadata(name)
+        return bool(lv) and lv['attr'][5] == 'o'
 
     def lv_get_origin(self, name):
         """Return the origin of an LV that is a snapshot, None otherwise."""
-        cmd = LVM.LVM_CMD_PREFIX + ['lvdisplay', '--noheading', '-C', '-o',
-                                    'Origin', '%s/%s' % (self.vg_name, name)]
+        lv = self._get_lv_metadata(name)
+        return lv['origin'] if lv else None
+
+    def lv_get_data_percent(self, name):
+        """Return the used percentage of a snapshot or thin LV.
+
+        For a snapshot this is the share of its COW store holding exceptions.
+        It is always queried from LVM, as it grows as the origin is written.
+
+        :returns: Percentage as a float, None if LVM doesn't report one
+
+        """
+        cmd = LVM.LVM_CMD_PREFIX + ['lvs', '--noheadings', '-o',
+                                    'data_percent',
+                                    '%s/%s' % (self.vg_name, name)]
         out, _err = self._execute(*cmd,
                                   root_helper=self._root_helper,
                                   run_as_root=True)
-        out = out.strip()
-        if out:
-            return out
-        return None
+        try:
+            return float(out.strip())
+        except ValueError:
+            return None
 
+    @invalidates_lv_cache
     def extend_volume(self, lv_name, new_size):
         """Extend the size of an existing volume."""
         # Volumes with snaps have attributes 'o' or 'O' and will be
@@ -856,6 +948,7 @@ class LVM(executor.Executor):
     def vg_mirror_size(self, mirror_count):
         return (self.vg_free_space / (mirror_count + 1))
 
+    @invalidates_lv_cache
     def rename_volume(self, lv_name, new_name):
         """Change the name of an existing volume."""
 
@@ -1667,6 +1667,11 @@ def image_volume_cache_get_all(context, **filters):
     return IMPL.image_volume_cache_get_all(context, **filters)
 
 
+def image_volume_cache_get_usage(context, **filters):
+    """Return the number of cache entries and their total size in GB."""
+    return IMPL.image_volume_cache_get_usage(context, **filters)
+
+
 def image_volume_cache_include_in_cluster(context, cluster,
                                           partial_rename=True, **filters):
     """Include in cluster image volume cache entries matching the filters.
@@ -6752,6 +6752,19 @@ def image_volume_cache_get_all(context, **filters):
             all()
 
 
+@require_context
+def image_volume_cache_get_usage(context, **filters):
+    filters = _clean_filters(filters)
+    session = get_session()
+    with session.begin():
+        count, size = session.query(
+            func.count(models.ImageVolumeCacheEntry.id),
+            func.sum(models.ImageVolumeCacheEntry.size)).\
+            filter_by(**filters).\
+            one()
+    return count, size or 0
+
+
 @require_admin_context
 def image_volume_cache_include_in_cluster(context, cluster,
                                           partial_rename=True, **filters):
@@ -0,0 +1,30 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+
+
+def upgrade(migrate_engine):
+    """Add indexes to sort the image-volume cache entries by last use."""
+    meta = MetaData(bind=migrate_engine)
+    entries = Table('image_volume_cache_entries', meta, autoload=True)
+
+    indexes = Inspector(migrate_engine).get_indexes(
+        'image_volume_cache_entries')
+    index_names = [i['name'] for i in indexes]
+    for column in ('host', 'cluster_name'):
+        index_name = 'image_volume_cache_entries_%s_last_used_idx' % column
+        if index_name not in index_names:
+            Index(index_name, entries.c[column], entries.c.last_used).create()
@@ -875,6 +875,10 @@ class Message(BASE, CinderBase):
 class ImageVolumeCacheEntry(BASE, models.ModelBase):
     """Represents an image volume cache entry"""
     __tablename__ = 'image_volume_cache_entries'
+    __table_args__ = (Index('image_volume_cache_entries_host_last_used_idx',
+                            'host', 'last_used'),
+                      Index('image_volume_cache_entries_cluster_name_'
+                            'last_used_idx', 'cluster_name', 'last_used'))
 
     id = Column(Integer, primary_key=True, nullable=False)
     host = Column(String(255), index=True, nullable=False)
@@ -12,6 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import threading
+
+import eventlet
 from pytz import timezone
 import six
 
@@ -27,6 +31,10 @@ CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
 
+# Admin metadata key marking the image-volumes evicted from the cache that
+# are waiting to be deleted.
+EVICTED_KEY = 'image_volume_cache_evicted'
+
 
 class ImageVolumeCache(object):
     def __init__(self, db, volume_api, max_cache_size_gb=0,
@@ -36,6 +44,13 @@ class ImageVolumeCache(object):
         self.max_cache_size_gb = int(max_cache_size_gb)
         self.max_cache_size_count = int(max_cache_size_count)
         self.notifier = rpc.get_notifier('volume', CONF.host)
+        # Space reserved by ensure_space for the entries being created, by
+        # service, as a [count, size in GB] pair.
+        self._reserved = {}
+        self._lock = threading.Lock()
+        # Image-volumes of evicted entries waiting to be deleted
+        self._evicted = collections.deque()
+        self._eviction_worker = None
 
     def get_by_image_volume(self, context, volume_id):
         return self.db.image_volume_cache_get_by_volume_id(context, volume_id)
@@ -68,7 +83,7 @@ class ImageVolumeCache(object):
                 LOG.debug('Image-volume cache entry is out-dated, evicting: '
                           '%(entry)s.',
                           {'entry': self._entry_to_str(cache_entry)})
-                self._delete_image_volume(context, cache_entry)
+                self._evict_in_background(context, cache_entry)
                 cache_entry = None
 
         if cache_entry:
@@ -117,7 +132,11 @@ class ImageVolumeCache(object):
     def ensure_space(self, context, volume):
         """Makes room for a volume cache entry.
 
-        Returns True if successful, false otherwise.
+        Returns True if successful, false otherwise. The space of the entry
+        is reserved until release_space is called, so that concurrent
+        creations don't count on the same room. The least recently used
+        entries are evicted right away, and their image-volumes are deleted
+        in the background.
         """
 
         # Check to see if the cache is actually limited.
@@ -131,57 +150,132 @@ class ImageVolumeCache(object):
                 volume.size > self.max_cache_size_gb):
             return False
 
-        # Assume the entries are ordered by most recently used to least used.
-        entries = self.db.image_volume_cache_get_all(
-            context,
-            **self._get_query_filters(volume))
-
-        current_count = len(entries)
-
-        current_size = 0
-        for entry in entries:
-            current_size += entry['size']
-
-        # Add values for the entry we intend to create.
-        current_size += volume.size
-        current_count += 1
-
-        LOG.debug('Image-volume cache for %(service)s current_size (GB) = '
-                  '%(size_gb)s (max = %(max_gb)s), current count = %(count)s '
-                  '(max = %(max_count)s).',
-                  {'service': volume.service_topic_queue,
-                   'size_gb': current_size,
-                   'max_gb': self.max_cache_size_gb,
-                   'count': current_count,
-                   'max_count': self.max_cache_size_count})
-
-        while ((current_size > self.max_cache_size_gb
-               or current_count > self.max_cache_size_count)
-               and len(entries)):
-            entry = entries.pop()
-            LOG.debug('Reclaiming image-volume cache space; removing cache '
-                      'entry %(entry)s.', {'entry': self._entry_to_str(entry)})
-            self._delete_image_volume(context, entry)
-            current_size -= entry['size']
-            current_count -= 1
-            LOG.debug('Image-volume cache for %(service)s new size (GB) = '
-                      '%(size_gb)s, new count = %(count)s.',
-                      {'service': volume.service_topic_queue,
+        filters = self._get_query_filters(volume)
+        service = volume.service_topic_queue
+        with self._lock:
+            current_count, current_size = self.db.image_volume_cache_get_usage(
+                context, **filters)
+            reserved_count, reserved_size = self._reserved.get(service,
+                                                               (0, 0))
+
+            # Add values for the reserved entries and the one we intend to
+            # create.
+            current_size += reserved_size + volume.size
+            current_count += reserved_count + 1
+
+            LOG.debug('Image-volume cache for %(service)s current_size (GB) '
+                      '= %(size_gb)s (max = %(max_gb)s), current count = '
+                      '%(count)s (max = %(max_count)s).',
+                      {'service': service,
                        'size_gb': current_size,
-                       'count': current_count})
-
-        # It is only possible to not free up enough gb, we will always be able
-        # to free enough count. This is because 0 means unlimited which means
-        # it is guaranteed to be >0 if limited, and we can always delete down
-        # to 0.
-        if self.max_cache_size_gb > 0:
-            if current_size > self.max_cache_size_gb > 0:
-                LOG.warning('Image-volume cache for %(service)s does '
-                            'not have enough space (GB).',
-                            {'service': volume.service_topic_queue})
-                return False
-
-        return True
+                       'max_gb': self.max_cache_size_gb,
+                       'count': current_count,
+                       'max_count': self.max_cache_size_count})
+
+            if self._is_over_limit(current_size, current_count):
+                # The entries are ordered by most recently used to least used.
+                entries = self.db.image_volume_cache_get_all(context,
+                                                             **filters)
+                while (self._is_over_limit(current_size, current_count)
+                       and len(entries)):
+                    entry = entries.pop()
+                    LOG.debug('Reclaiming image-volume cache space; removing '
+                              'cache entry %(entry)s.',
+                              {'entry': self._entry_to_str(entry)})
+                    self._evict_in_background(context, entry)
+                    current_size -= entry['size']
+                    current_count -= 1
+                LOG.debug('Image-volume cache for %(service)s new size (GB) = '
+                          '%(size_gb)s, new count = %(count)s.',
+                          {'service': service,
+                           'size_gb': current_size,
+                           'count': current_count})
+
+            # It is only possible to not free up enough gb, we will always be
+            # able to free enough count. This is because 0 means unlimited
+            # which means it is guaranteed to be >0 if limited, and we can
+            # always delete down to 0.
+            has_space = not current_size > self.max_cache_size_gb > 0
+            if has_space:
+                reserved = self._reserved.setdefault(service, [0, 0])
+                reserved[0] += 1
+                reserved[1] += volume.size
+
+        if not has_space:
+            LOG.warning('Image-volume cache for %(service)s does '
+                        'not have enough space (GB).',
+                        {'service': service})
+        return has_space
+
+    def release_space(self, volume):
+        """Release the space reserved by ensure_space for a cache entry.
+
+        Called once the entry has been created, or failed to be.
+        """
+        service = volume.service_topic_queue
+        with self._lock:
+            reserved = self._reserved.get(service)
+            if not reserved or not reserved[0]:
+                return
+            reserved[0] -= 1
+            reserved[1] -= volume.size
+            if not reserved[0]:
+                del self._reserved[service]
+
+    def _is_over_limit(self, size, count):
+        return ((self.max_cache_size_gb and size > self.max_cache_size_gb) or
+                (self.max_cache_size_count and
+                 count > self.max_cache_size_count))
+
+    def _evict_in_background(self, context, cache_entry):
+        """Evict an entry and delete its image-volume in the background.
+
+        The entry is removed from the cache right away, so that its space is
+        free and its image-volume isn't used anymore. The image-volume is
+        marked as evicted first, so that resume_evictions can delete it if
+        the service stops before it is.
+        """
+        self.db.volume_admin_metadata_update(context.elevated(),
+                                             cache_entry['volume_id'],
+                                             {EVICTED_KEY: 'True'}, False)
+        self.evict(context, cache_entry)
+        self._queue_deletion(context, cache_entry)
+
+    def resume_evictions(self, context, volumes):
+        """Delete the image-volumes evicted before the service stopped.
+
+        The deletions of evicted image-volumes are queued in memory only, so
+        those still marked as evicted when the service starts are queued
+        again.
+        """
+        for volume in volumes:
+            if (volume.status == 'deleting' or
+                    volume.admin_metadata.get(EVICTED_KEY) != 'True'):
+                continue
+            LOG.info('Resuming the deletion of image-volume %(volume_id)s '
+                     'evicted from the image-volume cache.',
+                     {'volume_id': volume.id})
+            # The cache entry is evicted by the deletion if it is left.
+            self._queue_deletion(context, {'volume_id': volume.id})
+
+    def _queue_deletion(self, context, cache_entry):
+        self._evicted.append((context, cache_entry))
+        if self._eviction_worker is None or self._eviction_worker.dead:
+            self._eviction_worker = eventlet.spawn(
+                self._delete_evicted_volumes)
+
+    def _delete_evicted_volumes(self):
+        while self._evicted:
+            context, cache_entry = self._evicted.popleft()
+            self._delete_evicted_volume(context, cache_entry)
+
+    def _delete_evicted_volume(self, context, cache_entry):
+        try:
+            self._delete_image_volume(context, cache_entry)
+        except Exception:
+            LOG.exception('Failed to delete image-volume %(volume_id)s '
+                          'evicted from the image-volume cache.',
+                          {'volume_id': cache_entry['volume_id']})
 
     @utils.if_notifications_enabled
     def _notify_cache_hit(self, context, image_id, host):
@@ -20,19 +20,30 @@
 from __future__ import absolute_import
 
 import copy
+import hashlib
+import io
 import itertools
+import os
 import random
 import shutil
 import sys
 import time
 
+import eventlet
+from eventlet import tpool
 import glanceclient.exc
+from keystoneauth1 import adapter as ks_adapter
+from keystoneauth1 import exceptions as ks_exceptions
 from keystoneauth1.loading import session as ks_session
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import excutils
 from oslo_utils import timeutils
+from oslo_utils import units
+import requests
 import six
+from six.moves import http_client
 from six.moves import range
 from six.moves import urllib
 
@@ -53,6 +64,19 @@ glance_opts = [
                     'catalog. Format is: separated values of the form: '
                     '<service_type>:<service_name>:<endpoint_type> - '
                     'Only used if glance_api_servers are not provided.'),
+    cfg.IntOpt('glance_download_segments',
+               default=1,
+               min=1,
+               help='Maximum number of concurrent HTTP range requests used '
+                    'to download an image to a file. Images whose store '
+                    'does not support range requests are downloaded in a '
+                    'single stream. 1 => disabled.'),
+    cfg.IntOpt('glance_download_segment_size_mb',
+               default=64,
+               min=1,
+               help='Minimum size in MB of the segments of an image '
+                    'downloaded with concurrent range requests. Smaller '
+                    'images are downloaded in a single stream.'),
 ]
 glance_core_properties_opts = [
     cfg.ListOpt('glance_core_properties',
@@ -69,6 +93,9 @@ _SESSION = None
 
 LOG = logging.getLogger(__name__)
 
+_CHECKSUM_CHUNK_SIZE = units.Mi
+_RANGE_CHUNK_SIZE = 64 * units.Ki
+
 
 def _parse_image_ref(image_href):
     """Parse an image href into composite parts.
@@ -85,6 +112,18 @@ def _parse_image_ref(image_href):
     return (image_id, netloc, use_ssl)
 
 
+def _md5sum(fd, size):
+    md5 = hashlib.md5()
+    offset = 0
+    while offset < size:
+        chunk = os.pread(fd, min(_CHECKSUM_CHUNK_SIZE, size - offset), offset)
+        if not chunk:
+            break
+        md5.update(chunk)
+        offset += len(chunk)
+    return md5.hexdigest()
+
+
 def _create_glance_client(context, netloc, use_ssl):
     """Instantiate a new glanceclient.Client object."""
     params = {'global_request_id': context.global_id}
@@ -109,7 +148,61 @@ def _create_glance_client(context, netloc, use_ssl):
 
     scheme = 'https' if use_ssl else 'http'
     endpoint = '%s://%s' % (scheme, netloc)
-    return glanceclient.Client('2', endpoint, **params)
+    client = glanceclient.Client('2', endpoint, **params)
+    client.image_ranges = _ImageRangeController(client)
+    return client
+
+
+class _ImageRangeController(object):
+    """Get byte ranges of the data of images.
+
+    glanceclient percent-encodes the values of the headers it sends, which
+    turns "bytes=0-9" into a Range header that Glance ignores, so range
+    requests are sent directly with the session of the client's HTTP client.
+    Errors are raised as the glanceclient exceptions the wrapper expects.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, image_id, start, end):
+        http_client = self._client.http_client
+        url = '/v2/images/%s/file' % image_id
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1)}
+        if http_client.global_request_id:
+            headers['X-OpenStack-Request-ID'] = http_client.global_request_id
+        try:
+            if isinstance(http_client, ks_adapter.Adapter):
+                # Skip the request method of glanceclient's SessionClient,
+                # the adapter still adds the authentication and endpoint.
+                resp = ks_adapter.Adapter.request(
+                    http_client, url, 'GET', headers=headers, stream=True,
+                    raise_exc=False)
+            else:
+                headers.update(http_client.identity_headers or {})
+                if http_client.auth_token:
+                    headers['X-Auth-Token'] = http_client.auth_token
+                resp = http_client.session.get(
+                    http_client.endpoint.rstrip('/') + url, headers=headers,
+                    stream=True, timeout=http_client.timeout)
+        except (ks_exceptions.ConnectTimeout,
+                requests.exceptions.Timeout) as e:
+            raise glanceclient.exc.InvalidEndpoint(message=six.text_type(e))
+        except (ks_exceptions.ConnectFailure,
+                requests.exceptions.ConnectionError) as e:
+            raise glanceclient.exc.CommunicationError(
+                message=six.text_type(e))
+        if not resp.ok:
+            raise glanceclient.exc.from_response(resp, resp.content)
+        return resp, self._iter_body(resp)
+
+    @staticmethod
+    def _iter_body(resp):
+        try:
+            for chunk in resp.iter_content(chunk_size=_RANGE_CHUNK_SIZE):
+                yield chunk
+        finally:
+            resp.close()
 
 
 def get_api_servers(context):
@@ -192,12 +285,12 @@ class GlanceClientWrapper(object):
                       glanceclient.exc.InvalidEndpoint,
                       glanceclient.exc.CommunicationError)
         num_attempts = 1 + CONF.glance_num_retries
+        controller_name = kwargs.pop('controller', 'images')
 
         for attempt in range(1, num_attempts + 1):
             client = self.client or self._create_onetime_client(context)
             try:
-                controller = getattr(client,
-                                     kwargs.pop('controller', 'images'))
+                controller = getattr(client, controller_name)
                 return getattr(controller, method)(*args, **kwargs)
             except retry_excs as e:
                 netloc = self.netloc
@@ -318,6 +411,9 @@ class GlanceImageService(object):
                         shutil.copyfileobj(f, data)
                     return
 
+        if data and self._download_segmented(context, image_id, data):
+            return
+
         try:
             image_chunks = self._client.call(context, 'data', image_id)
         except Exception:
@@ -329,6 +425,101 @@ class GlanceImageService(object):
             for chunk in image_chunks:
                 data.write(chunk)
 
+    def _download_segmented(self, context, image_id, data):
+        """Download an image to a file with concurrent range requests.
+
+        The segments are written at their offsets in the file as they are
+        received, and the whole image is verified against its checksum.
+        Returns False without downloading anything when the image is too
+        small to be split or data isn't a file, and falls back to a single
+        stream when the store of the image doesn't support range requests.
+        """
+        max_segments = CONF.glance_download_segments
+        if max_segments < 2 or not hasattr(os, 'pwrite'):
+            return False
+        try:
+            fd = data.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return False
+
+        image_meta = self.show(context, image_id)
+        size = image_meta.get('size')
+        min_segment_size = CONF.glance_download_segment_size_mb * units.Mi
+        if not size or size < 2 * min_segment_size:
+            return False
+        segments = min(max_segments, size // min_segment_size)
+        segment_size = -(-size // segments)
+        ranges = [(start, min(start + segment_size, size))
+                  for start in range(0, size, segment_size)]
+
+        resp, body = self._get_image_range(context, image_id, *ranges[0])
+        if resp.status_code != http_client.PARTIAL_CONTENT:
+            LOG.warning('Range request for image %(image)s answered with '
+                        'status %(status)s, downloading it in a single '
+                        'stream.',
+                        {'image': image_id, 'status': resp.status_code})
+            ranges = [(0, size)]
+        else:
+            LOG.debug('Downloading image %(image)s in %(count)d segments.',
+                      {'image': image_id, 'count': len(ranges)})
+
+        threads = [eventlet.spawn(self._download_range, context, image_id,
+                                  fd, start, end)
+                   for start, end in ranges[1:]]
+        try:
+            self._download_range(context, image_id, fd, ranges[0][0],
+                                 ranges[0][1], body=body)
+            for thread in threads:
+                thread.wait()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for thread in threads:
+                    thread.kill()
+
+        checksum = image_meta.get('checksum')
+        if checksum:
+            try:
+                actual = tpool.execute(_md5sum, fd, size)
+            except ValueError:
+                # MD5 isn't available, for instance on FIPS enabled systems
+                actual = checksum
+            if actual != checksum:
+                raise exception.ImageUnacceptable(
+                    image_id=image_id,
+                    reason=_("checksum of the downloaded image %(actual)s "
+                             "doesn't match %(checksum)s") %
+                    {'actual': actual, 'checksum': checksum})
+        return True
+
+    def _get_image_range(self, context, image_id, start, end):
+        try:
+            return self._client.call(context, 'get', image_id, start, end,
+                                     controller='image_ranges')
+        except Exception:
+            _reraise_translated_image_exception(image_id)
+
+    def _download_range(self, context, image_id, fd, start, end, body=None):
+        """Write the bytes of an image from start to end at their offsets."""
+        if body is None:
+            resp, body = self._get_image_range(context, image_id, start, end)
+            if resp.status_code != http_client.PARTIAL_CONTENT:
+                raise exception.ImageUnacceptable(
+                    image_id=image_id,
+                    reason=_("range request answered with status %s") %
+                    resp.status_code)
+        offset = start
+        for chunk in body:
+            if offset + len(chunk) <= end:
+                os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+        if offset != end:
+            raise exception.ImageUnacceptable(
+                image_id=image_id,
+                reason=_("received %(received)d bytes instead of %(size)d "
+                         "for the segment at offset %(start)d") %
+                {'received': offset - start, 'size': end - start,
+                 'start': start})
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
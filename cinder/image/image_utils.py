@@ -26,14 +26,19 @@ we should look at maybe pushing this up to Oslo
 
 import contextlib
 import errno
+import hashlib
 import math
 import os
 import re
 import tempfile
 
+import eventlet
+from eventlet import event
+from eventlet import tpool
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import excutils
 from oslo_utils import fileutils
 from oslo_utils import imageutils
 from oslo_utils import timeutils
@@ -42,6 +47,7 @@ import psutil
 
 from cinder import exception
 from cinder.i18n import _
+from cinder.image import local_cache
 from cinder import utils
 from cinder.volume import throttling
 from cinder.volume import utils as volume_utils
@@ -51,7 +57,17 @@ LOG = logging.getLogger(__name__)
 image_helper_opts = [cfg.StrOpt('image_conversion_dir',
                                 default='$state_path/conversion',
                                 help='Directory used for temporary storage '
-                                'during image conversion'), ]
+                                'during image conversion'),
+                     cfg.BoolOpt('image_stream_raw',
+                                 default=False,
+                                 help='Write the images that Glance reports '
+                                 'as raw to raw volumes while they are '
+                                 'downloaded, instead of downloading them '
+                                 'to image_conversion_dir first. Their data '
+                                 'is checked against the Glance checksum, '
+                                 'and images that have the header of '
+                                 'another format are downloaded and checked '
+                                 'with qemu-img as before.'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_helper_opts)
@@ -71,6 +87,26 @@ QEMU_IMG_FORMAT_MAP = {
 }
 QEMU_IMG_FORMAT_MAP_INV = {v: k for k, v in QEMU_IMG_FORMAT_MAP.items()}
 
+# Headers of the image formats that raw images are not allowed to have,
+# by offset, as probed by qemu-img.  Formats that may have backing files are
+# all covered.
+IMAGE_FORMAT_MAGICS = (
+    (0, b'QFI\xfb', 'qcow2'),
+    (0, b'QED\x00', 'qed'),
+    (0, b'KDMV', 'vmdk'),
+    (0, b'COWD', 'vmdk'),
+    (0, b'# Disk DescriptorFile', 'vmdk'),
+    (0, b'conectix', 'vhd'),
+    (0, b'vhdxfile', 'vhdx'),
+    (0x40, b'\x7f\x10\xda\xbe', 'vdi'),
+    (0, b'WithoutFreeSpace', 'parallels'),
+    (0, b'WithouFreSpacExt', 'parallels'),
+    (0, b'LUKS\xba\xbe', 'luks'),
+)
+# Size of the buffers of streamed images, of which one is written while the
+# next one is downloaded.
+STREAM_BUFFER_SIZE = 4 * units.Mi
+
 QEMU_IMG_VERSION = None
 QEMU_IMG_MIN_FORCE_SHARE_VERSION = [2, 10, 0]
 QEMU_IMG_MIN_CONVERT_LUKS_VERSION = '2.10'
@@ -421,6 +457,189 @@ def fetch_to_raw(context, image_service,
                            run_as_root=run_as_root)
 
 
+def _check_image_fits_volume(image_id, virtual_size, size):
+    virt_size = int(math.ceil(float(virtual_size) / units.Gi))
+
+    # NOTE(xqueralt): If the image virtual size doesn't fit in the
+    # requested volume there is no point on resizing it because it will
+    # generate an unusable image.
+    if size is not None and virt_size > size:
+        params = {'image_size': virt_size, 'volume_size': size}
+        reason = _("Size is %(image_size)dGB and doesn't fit in a "
+                   "volume of size %(volume_size)dGB.") % params
+        raise exception.ImageUnacceptable(image_id=image_id, reason=reason)
+
+
+def _write_cached_image(cached, image_id, dest, size, run_as_root):
+    """Write an image from the local cache of converted images."""
+    virtual_size = os.path.getsize(cached)
+    _check_image_fits_volume(image_id, virtual_size, size)
+    check_available_space(dest, virtual_size, image_id)
+    convert_image(cached, dest, 'raw', src_format='raw',
+                  run_as_root=run_as_root)
+
+
+def _cache_converted_image(cache, image_id, checksum, tmp, data,
+                           disk_format):
+    """Convert a downloaded image to raw into the local cache.
+
+    :returns: Whether the image was cached
+    """
+    if not cache.fits(data.virtual_size):
+        return False
+    try:
+        fileutils.ensure_tree(cache.path)
+        check_available_space(cache.path, data.virtual_size, image_id)
+        if not local_cache.checksum_matches(tmp, checksum):
+            LOG.warning('Not caching image %s, its data does not match '
+                        'its checksum.', image_id)
+            return False
+        with cache.add(image_id, checksum) as part:
+            convert_image(tmp, part, 'raw', src_format=disk_format,
+                          run_as_root=False)
+    except (exception.ImageTooBig, processutils.ProcessExecutionError,
+            EnvironmentError) as e:
+        LOG.warning('Failed to cache converted image %(image)s: %(err)s',
+                    {'image': image_id, 'err': e})
+        return False
+    return True
+
+
+class _NotRawImage(Exception):
+    """A raw image has the header of another format."""
+
+
+def _check_raw_image_header(header):
+    for offset, magic, fmt in IMAGE_FORMAT_MAGICS:
+        if header[offset:offset + len(magic)] == magic:
+            raise _NotRawImage(fmt)
+
+
+class _RawImageStream(object):
+    """File object writing a raw image download to a volume.
+
+    The downloaded data is buffered, and the full buffers are written in a
+    native thread while the next one is downloaded. Nothing is written
+    before the image header was checked.
+    """
+
+    def __init__(self, image_id, fd, checksum=None, rate_limiter=None):
+        self.image_id = image_id
+        self.fd = fd
+        self.checksum = checksum
+        self.rate_limiter = rate_limiter
+        self.buf = bytearray()
+        self.header_checked = False
+        self.pending_write = None
+        self.md5 = None
+        if checksum:
+            try:
+                self.md5 = hashlib.md5()
+            except ValueError:
+                # MD5 isn't available, for instance on FIPS enabled systems
+                LOG.debug('Not verifying the checksum of image %s.',
+                          image_id)
+
+    def write(self, data):
+        if self.md5:
+            self.md5.update(data)
+        self.buf += data
+        if len(self.buf) >= STREAM_BUFFER_SIZE:
+            self._flush()
+
+    def _write_buffer(self, buf):
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def _wait(self):
+        pending_write, self.pending_write = self.pending_write, None
+        if pending_write is not None:
+            pending_write.wait()
+
+    def _flush(self):
+        if not self.header_checked:
+            _check_raw_image_header(bytes(self.buf[:STREAM_BUFFER_SIZE]))
+            self.header_checked = True
+        self._wait()
+        buf, self.buf = self.buf, bytearray()
+        if self.rate_limiter:
+            self.rate_limiter.consume(len(buf))
+        self.pending_write = eventlet.spawn(tpool.execute,
+                                            self._write_buffer, buf)
+
+    def abort(self):
+        try:
+            self._wait()
+        except Exception:
+            LOG.debug('Failed to write image %s.', self.image_id,
+                      exc_info=True)
+
+    def close(self):
+        """Write the rest of the image and verify its checksum."""
+        if self.buf or not self.header_checked:
+            self._flush()
+        self._wait()
+        tpool.execute(os.fsync, self.fd)
+        if self.md5 and self.md5.hexdigest() != self.checksum:
+            reason = (_("The data of the image doesn't match its checksum "
+                        "%s.") % self.checksum)
+            raise exception.ImageUnacceptable(image_id=self.image_id,
+                                              reason=reason)
+
+
+def can_stream_image(image_meta):
+    """Whether an image is written to raw volumes as it is downloaded.
+
+    Images aren't streamed when the node caches them once converted.
+    """
+    return (CONF.image_stream_raw and os.name != 'nt' and
+            bool(image_meta) and image_meta.get('disk_format') == 'raw' and
+            not local_cache.LocalImageCache.from_config())
+
+
+@contextlib.contextmanager
+def _volume_write_access(dest, run_as_root):
+    if run_as_root and not os.access(dest, os.W_OK):
+        with utils.temporary_chown(dest):
+            yield
+    else:
+        yield
+
+
+def _stream_raw_image(context, image_service, image_id, image_meta, dest,
+                      size, run_as_root):
+    image_size = image_meta['size']
+    _check_image_fits_volume(image_id, image_size, size)
+    check_available_space(dest, image_size, image_id)
+
+    LOG.debug('Streaming raw image %(image)s to %(dest)s.',
+              {'image': image_id, 'dest': dest})
+    start_time = timeutils.utcnow()
+    rate_limiter = throttling.Throttle.get_default().get_rate_limiter()
+    with _volume_write_access(dest, run_as_root):
+        fd = os.open(dest, os.O_WRONLY)
+        try:
+            stream = _RawImageStream(image_id, fd, image_meta.get('checksum'),
+                                     rate_limiter)
+            try:
+                image_service.download(context, image_id, stream)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    stream.abort()
+            stream.close()
+        finally:
+            os.close(fd)
+
+    duration = max(timeutils.delta_seconds(start_time, timeutils.utcnow()),
+                   1)
+    LOG.info('Image streaming details: dest %(dest)s, size %(size).2f MB, '
+             'duration %(duration).2f sec, rate %(rate).2f MB/s',
+             {'dest': dest, 'size': image_size / float(units.Mi),
+              'duration': duration,
+              'rate': image_size / float(units.Mi) / duration})
+
+
 def fetch_to_volume_format(context, image_service,
                            image_id, dest, volume_format, blocksize,
                            volume_subformat=None, user_id=None,
@@ -428,6 +647,32 @@ def fetch_to_volume_format(context, image_service,
     qemu_img = True
     image_meta = image_service.show(context, image_id)
 
+    # Images converted to raw may be found in the local cache
+    cache = None
+    checksum = image_meta.get('checksum') if image_meta else None
+    if volume_format == 'raw' and checksum:
+        cache = local_cache.LocalImageCache.from_config()
+    if cache:
+        with cache.get(image_id, checksum) as cached:
+            if cached:
+                _write_cached_image(cached, image_id, dest, size, run_as_root)
+                return
+
+    # Raw images are written as they are downloaded, unless they were
+    # already downloaded or are cached once converted.
+    if (volume_format == 'raw' and not cache and
+            can_stream_image(image_meta) and
+            not TemporaryImages.for_image_service(image_service).get(
+                context, image_id)):
+        try:
+            _stream_raw_image(context, image_service, image_id, image_meta,
+                              dest, size, run_as_root)
+            return
+        except _NotRawImage as e:
+            LOG.warning('Image %(image)s has a %(fmt)s header, it will be '
+                        'downloaded and checked before being written.',
+                        {'image': image_id, 'fmt': e})
+
     # NOTE(avishay): I'm not crazy about creating temp files which may be
     # large and cause disk full errors which would confuse users.
     # Unfortunately it seems that you can't pipe to 'qemu-img convert' because
@@ -465,16 +710,7 @@ def fetch_to_volume_format(context, image_service,
             return
 
         data = qemu_img_info(tmp, run_as_root=run_as_root)
-        virt_size = int(math.ceil(float(data.virtual_size) / units.Gi))
-
-        # NOTE(xqueralt): If the image virtual size doesn't fit in the
-        # requested volume there is no point on resizing it because it will
-        # generate an unusable image.
-        if size is not None and virt_size > size:
-            params = {'image_size': virt_size, 'volume_size': size}
-            reason = _("Size is %(image_size)dGB and doesn't fit in a "
-                       "volume of size %(volume_size)dGB.") % params
-            raise exception.ImageUnacceptable(image_id=image_id, reason=reason)
+        _check_image_fits_volume(image_id, data.virtual_size, size)
 
         fmt = data.file_format
         if fmt is None:
@@ -503,6 +739,16 @@ def fetch_to_volume_format(context, image_service,
         LOG.debug("%s was %s, converting to %s ", image_id, fmt, volume_format)
         disk_format = fixup_disk_format(image_meta['disk_format'])
 
+        # Convert through the local cache when it's enabled, writing the
+        # volume directly if the image can't be cached.
+        if cache and _cache_converted_image(cache, image_id, checksum, tmp,
+                                            data, disk_format):
+            with cache.get(image_id, checksum) as cached:
+                if cached:
+                    convert_image(cached, dest, 'raw', src_format='raw',
+                                  run_as_root=run_as_root)
+                    return
+
         convert_image(tmp, dest, volume_format,
                       out_subformat=volume_subformat,
                       src_format=disk_format,
@@ -660,6 +906,14 @@ def cleanup_temporary_file(backend_name):
         LOG.warning("Exception caught while clearing temporary image "
                     "files: %s", e)
 
+    cache = local_cache.LocalImageCache.from_config()
+    if cache:
+        try:
+            cache.reconcile()
+        except OSError as e:
+            LOG.warning("Exception caught while cleaning up the converted "
+                        "image cache: %s", e)
+
 
 @contextlib.contextmanager
 def temporary_file(*args, **kwargs):
@@ -732,6 +986,15 @@ def decode_cipher(cipher_spec, key_size):
             'ivgen_alg': ivgen_alg}
 
 
+class _SharedImage(object):
+    """An image download shared by the requests for the same image."""
+
+    def __init__(self):
+        self.path = None
+        self.users = 0
+        self.fetched = None
+
+
 class TemporaryImages(object):
     """Manage temporarily downloaded images to avoid downloading it twice.
 
@@ -739,8 +1002,17 @@ class TemporaryImages(object):
     clause, 'tmp' can be used as the downloaded image path. In addition,
     image_utils.fetch() will use the pre-fetched image by the TemporaryImages.
     This is useful to inspect image contents before conversion.
+
+    Within 'with TemporaryImages.shared(image_id, checksum, suffix)' clauses,
+    the image is only downloaded by the first fetch of the concurrent
+    requests for it. The others wait for that download and use the same
+    file, which is deleted when the last request leaves its clause.
     """
 
+    # Images shared by the requests of the service, by (image id, checksum,
+    # suffix).
+    _shared_images = {}
+
     def __init__(self, image_service):
         self.temporary_images = {}
         self.image_service = image_service
@@ -755,10 +1027,68 @@ class TemporaryImages(object):
 
     @classmethod
     @contextlib.contextmanager
-    def fetch(cls, image_service, context, image_id, suffix=''):
+    def shared(cls, image_id, checksum, suffix=''):
+        key = (image_id, checksum, suffix)
+        shared_image = cls._shared_images.get(key)
+        if shared_image is None:
+            shared_image = cls._shared_images[key] = _SharedImage()
+        shared_image.users += 1
+        try:
+            yield
+        finally:
+            shared_image.users -= 1
+            if not shared_image.users:
+                del cls._shared_images[key]
+                if shared_image.path:
+                    fileutils.delete_if_exists(shared_image.path)
+                    LOG.debug("Shared temporary image %s is deleted.",
+                              image_id)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _fetch_shared(shared_image, image_service, context, image_id,
+                      suffix):
+        while shared_image.path is None:
+            if shared_image.fetched is not None:
+                # Another request is downloading the image, check again
+                # once it is done as its download may have failed.
+                shared_image.fetched.wait()
+                continue
+
+            shared_image.fetched = event.Event()
+            try:
+                tmp = create_temporary_file(suffix=suffix)
+                with fileutils.remove_path_on_error(tmp):
+                    fetch_verify_image(context, image_service, image_id, tmp)
+                shared_image.path = tmp
+                LOG.debug("Temporary image %s is fetched to be shared.",
+                          image_id)
+            finally:
+                fetched = shared_image.fetched
+                shared_image.fetched = None
+                fetched.send()
+            break
+        else:
+            # The image was fetched with the context of another request,
+            # make sure this one may access it.
+            image_service.show(context, image_id)
+            LOG.debug("Using shared temporary image %s.", image_id)
+        yield shared_image.path
+
+    @classmethod
+    @contextlib.contextmanager
+    def fetch(cls, image_service, context, image_id, suffix='',
+              checksum=None):
         tmp_images = cls.for_image_service(image_service).temporary_images
-        with temporary_file(suffix=suffix) as tmp:
-            fetch_verify_image(context, image_service, image_id, tmp)
+        shared_image = cls._shared_images.get((image_id, checksum, suffix))
+        if shared_image is not None:
+            fetched_image = cls._fetch_shared(shared_image, image_service,
+                                              context, image_id, suffix)
+        else:
+            fetched_image = temporary_file(suffix=suffix)
+        with fetched_image as tmp:
+            if shared_image is None:
+                fetch_verify_image(context, image_service, image_id, tmp)
             user = context.user_id
             if not tmp_images.get(user):
                 tmp_images[user] = {}
@@ -0,0 +1,255 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Node-local cache of the images converted to raw.
+
+The raw images converted from Glance images are kept in the cache directory
+of image_conversion_dir, named after the image id and the checksum of the
+image data, so that the volumes created again from the same image on the
+node are written from them without downloading and converting the image.
+
+The volume services of the node share the cache and change it under an
+external lock. The modification time of a cached image is the last time it
+was used, and the least recently used images are evicted when the cache
+exceeds its limits. Images being read are locked with a shared flock so
+that they are never evicted while in use.
+"""
+
+import contextlib
+import errno
+import hashlib
+import os
+import tempfile
+
+from eventlet import tpool
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+from oslo_utils import fileutils
+from oslo_utils import units
+
+from cinder import utils
+
+if os.name == 'nt':
+    fcntl = None
+else:
+    import fcntl
+
+
+LOG = logging.getLogger(__name__)
+
+local_cache_opts = [
+    cfg.BoolOpt('image_conversion_cache_enabled',
+                default=False,
+                help='Keep the images converted to raw when creating volumes '
+                     'from images in a cache directory of '
+                     'image_conversion_dir, so that new volumes from the same '
+                     'image on this node are written without downloading '
+                     'and converting the image again. The cache is shared by '
+                     'the volume services of the node.'),
+    cfg.IntOpt('image_conversion_cache_max_size_gb',
+               default=10,
+               min=0,
+               help='Maximum size in GB of the images in the image '
+                    'conversion cache. 0 => unlimited.'),
+    cfg.IntOpt('image_conversion_cache_max_count',
+               default=0,
+               min=0,
+               help='Maximum number of images in the image conversion '
+                    'cache. 0 => unlimited.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(local_cache_opts)
+
+CACHE_DIR_NAME = 'cache'
+_IMAGE_SUFFIX = '.raw'
+_PART_SUFFIX = '.part'
+_CHECKSUM_CHUNK_SIZE = units.Mi
+
+
+def _try_flock(fd, operation):
+    """Lock a file without waiting, returning whether it was locked."""
+    try:
+        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+def _md5sum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHECKSUM_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def checksum_matches(path, checksum):
+    """Check a downloaded image against the checksum reported by Glance."""
+    try:
+        return tpool.execute(_md5sum, path) == checksum
+    except ValueError:
+        # MD5 isn't available, for instance on FIPS enabled systems
+        return False
+
+
+class LocalImageCache(object):
+    def __init__(self, path, max_size_gb=0, max_count=0):
+        self.path = path
+        self.max_size = max_size_gb * units.Gi
+        self.max_count = max_count
+
+    @classmethod
+    def from_config(cls):
+        """Return the cache of the node, or None if it isn't enabled."""
+        if (not CONF.image_conversion_cache_enabled or fcntl is None or
+                not CONF.image_conversion_dir):
+            return None
+        return cls(os.path.join(CONF.image_conversion_dir, CACHE_DIR_NAME),
+                   max_size_gb=CONF.image_conversion_cache_max_size_gb,
+                   max_count=CONF.image_conversion_cache_max_count)
+
+    def _image_path(self, image_id, checksum):
+        return os.path.join(self.path,
+                            '%s-%s%s' % (image_id, checksum, _IMAGE_SUFFIX))
+
+    def fits(self, size):
+        """Whether an image of the given size in bytes can be cached."""
+        return not self.max_size or size <= self.max_size
+
+    @contextlib.contextmanager
+    def get(self, image_id, checksum):
+        """Yield the path of the cached image, or None if it isn't cached.
+
+        The image can't be evicted until the end of the clause.
+        """
+        image_file = self._open(self._image_path(image_id, checksum))
+        if image_file is None:
+            yield None
+            return
+        try:
+            LOG.debug('Using cached converted image %s.', image_file.name)
+            yield image_file.name
+        finally:
+            # Closing the file releases its lock
+            image_file.close()
+
+    def get_size(self, image_id, checksum):
+        """Return the size of the cached image, or None if it isn't cached."""
+        with self.get(image_id, checksum) as cached:
+            return os.path.getsize(cached) if cached else None
+
+    @utils.synchronized('image-conversion-cache', external=True)
+    def _open(self, path):
+        try:
+            image_file = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if not _try_flock(image_file.fileno(), fcntl.LOCK_SH):
+            image_file.close()
+            return None
+        # The modification time tracks the last use for the LRU eviction
+        os.utime(path, None)
+        return image_file
+
+    @contextlib.contextmanager
+    def add(self, image_id, checksum):
+        """Yield a path to write an image to, cached at the end of the clause.
+
+        The image is only visible in the cache once it is complete, and the
+        path is removed if the clause fails.
+        """
+        fileutils.ensure_tree(self.path)
+        fd, part = tempfile.mkstemp(
+            dir=self.path, prefix='%s-%s-' % (image_id, checksum),
+            suffix=_PART_SUFFIX)
+        try:
+            # Keep the startup cleanup of another service from removing it
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield part
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    fileutils.delete_if_exists(part)
+            self._insert(part, self._image_path(image_id, checksum))
+        finally:
+            os.close(fd)
+
+    @utils.synchronized('image-conversion-cache', external=True)
+    def _insert(self, part, path):
+        os.rename(part, path)
+        LOG.debug('Cached converted image %s.', path)
+        self._evict(keep=path)
+
+    def _images(self):
+        """Return the paths, last uses and sizes of the cached images."""
+        images = []
+        for name in os.listdir(self.path):
+            if not name.endswith(_IMAGE_SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            # Converted images are sparse, count the space they use
+            images.append((path, stat.st_mtime, stat.st_blocks * 512))
+        return images
+
+    def _remove_unused(self, path):
+        """Remove a file unless it is locked, returning whether it was."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            return e.errno == errno.ENOENT
+        try:
+            if not _try_flock(fd, fcntl.LOCK_EX):
+                return False
+            fileutils.delete_if_exists(path)
+        finally:
+            os.close(fd)
+        return True
+
+    def _evict(self, keep=None):
+        images = sorted(self._images(), key=lambda image: image[1])
+        size = sum(image[2] for image in images)
+        count = len(images)
+        for path, _last_use, image_size in images:
+            if ((not self.max_size or size <= self.max_size) and
+                    (not self.max_count or count <= self.max_count)):
+                break
+            if path == keep or not self._remove_unused(path):
+                continue
+            LOG.debug('Evicted cached converted image %s.', path)
+            size -= image_size
+            count -= 1
+
+    @utils.synchronized('image-conversion-cache', external=True)
+    def reconcile(self):
+        """Clean up the cache when the service starts.
+
+        Removes the images left partially written by interrupted services
+        and evicts images if the limits were lowered.
+        """
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(_PART_SUFFIX):
+                self._remove_unused(os.path.join(self.path, name))
+        self._evict()
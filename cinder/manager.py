@@ -52,11 +52,14 @@ This module provides Manager, a base class for managers.
 """
 
 
+import copy
+
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
 from oslo_service import periodic_task
 from oslo_utils import timeutils
+from oslo_utils import uuidutils
 
 from cinder import context
 from cinder import db
@@ -175,6 +178,13 @@ class SchedulerDependentManager(ThreadPoolManager):
         self.last_capabilities = None
         self.service_name = service_name
         self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
+        # Capabilities are sent in full the first time and after a resync,
+        # and as deltas against the last report the rest of the time.  The
+        # generation identifies this run of the service, so schedulers can
+        # tell a restart apart from a lost report.
+        self._capabilities_generation = uuidutils.generate_uuid()
+        self._capabilities_seq = 0
+        self._published_capabilities = None
         super(SchedulerDependentManager, self).__init__(host, db_driver,
                                                         cluster=cluster)
 
@@ -182,16 +192,67 @@ class SchedulerDependentManager(ThreadPoolManager):
         """Remember these capabilities to send on next periodic update."""
         self.last_capabilities = capabilities
 
+    def resync_service_capabilities(self):
+        """Send the full capabilities on the next periodic update."""
+        self._published_capabilities = None
+
+    @staticmethod
+    def _get_capabilities_delta(old, new):
+        """Return the changes between two capability reports.
+
+        Top level fields are compared one by one and pools are matched by
+        their pool_name and sent whole when any of their fields changed.
+        Returns None when the reports cannot be diffed, for example when a
+        pool has no name, in which case the full report must be sent.
+        """
+        def pools_by_name(capabilities):
+            pools = capabilities.get('pools') or []
+            by_name = {pool.get('pool_name'): pool for pool in pools}
+            if None in by_name or len(by_name) != len(pools):
+                return None
+            return by_name
+
+        # Going from a pool list to no pools at all (or the other way) is
+        # a change of the pools field itself.
+        if ('pools' in old) != ('pools' in new):
+            return None
+        old_pools = pools_by_name(old)
+        new_pools = pools_by_name(new)
+        if old_pools is None or new_pools is None:
+            return None
+
+        delta = {
+            'updated': {key: value for key, value in new.items()
+                        if key != 'pools' and
+                        (key not in old or old[key] != value)},
+            'removed': [key for key in old
+                        if key != 'pools' and key not in new],
+            'pools': {name: pool for name, pool in new_pools.items()
+                      if old_pools.get(name) != pool},
+            'removed_pools': [name for name in old_pools
+                              if name not in new_pools],
+        }
+        return delta
+
     def _publish_service_capabilities(self, context):
         """Pass data back to the scheduler at a periodic interval."""
         if self.last_capabilities:
             LOG.debug('Notifying Schedulers of capabilities ...')
+            delta = None
+            if self._published_capabilities is not None:
+                delta = self._get_capabilities_delta(
+                    self._published_capabilities, self.last_capabilities)
+            self._capabilities_seq += 1
             self.scheduler_rpcapi.update_service_capabilities(
                 context,
                 self.service_name,
                 self.host,
                 self.last_capabilities,
-                self.cluster)
+                self.cluster,
+                seq=[self._capabilities_generation, self._capabilities_seq],
+                delta=delta)
+            self._published_capabilities = copy.deepcopy(
+                self.last_capabilities)
             try:
                 self.scheduler_rpcapi.notify_service_capabilities(
                     context,
@@ -185,7 +185,8 @@ class CinderCleanableObject(base.CinderPersistentObject):
 
         By default will take care of all cleanable objects, but we can limit
         which objects we want by passing the name of the arguments we want
-        to be added.
+        to be added. Arguments that are lists of cleanable objects, like the
+        volumes of a batch, have a worker entry for each of their elements.
         """
         def _decorator(f):
             def wrapper(f, *args, **kwargs):
@@ -195,6 +196,9 @@ class CinderCleanableObject(base.CinderPersistentObject):
                 else:
                     candidates = list(args)
                     candidates.extend(kwargs.values())
+                candidates = [item for cand in candidates
+                              for item in (cand if isinstance(cand, list)
+                                           else (cand,))]
                 cleanables = [cand for cand in candidates
                               if (isinstance(cand, CinderCleanableObject)
                                   and cand.is_cleanable(pinned=False))]
@@ -52,6 +52,7 @@ from cinder.db import api as cinder_db_api
 from cinder.db import base as cinder_db_base
 from cinder.image import glance as cinder_image_glance
 from cinder.image import image_utils as cinder_image_imageutils
+from cinder.image import local_cache as cinder_image_localcache
 from cinder.keymgr import conf_key_mgr as cinder_keymgr_confkeymgr
 from cinder.message import api as cinder_message_api
 from cinder import quota as cinder_quota
@@ -231,6 +232,7 @@ def list_opts():
                 cinder_image_glance.glance_opts,
                 cinder_image_glance.glance_core_properties_opts,
                 cinder_image_imageutils.image_helper_opts,
+                cinder_image_localcache.local_cache_opts,
                 cinder_message_api.messages_opts,
                 cinder_quota.quota_opts,
                 cinder_scheduler_driver.scheduler_driver_opts,
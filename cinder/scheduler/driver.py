@@ -90,13 +90,19 @@ class Scheduler(object):
         return self.host_manager.has_all_capabilities()
 
     def update_service_capabilities(self, service_name, host, capabilities,
-                                    cluster_name, timestamp):
-        """Process a capability update from a service node."""
-        self.host_manager.update_service_capabilities(service_name,
-                                                      host,
-                                                      capabilities,
-                                                      cluster_name,
-                                                      timestamp)
+                                    cluster_name, timestamp, seq=None,
+                                    delta=False):
+        """Process a capability update from a service node.
+
+        Returns False when the update was a delta that could not be applied.
+        """
+        return self.host_manager.update_service_capabilities(service_name,
+                                                             host,
+                                                             capabilities,
+                                                             cluster_name,
+                                                             timestamp,
+                                                             seq=seq,
+                                                             delta=delta)
 
     def notify_service_capabilities(self, service_name, backend,
                                     capabilities, timestamp):
@@ -130,6 +136,12 @@ class Scheduler(object):
         """Must override schedule method for scheduler to work."""
         raise NotImplementedError(_("Must implement schedule_create_volume"))
 
+    def schedule_create_volumes(self, context, request_spec_list,
+                                filter_properties_list):
+        """Must override schedule method for scheduler to work."""
+        raise NotImplementedError(_(
+            "Must implement schedule_create_volumes"))
+
     def schedule_create_group(self, context, group,
                               group_spec,
                               request_spec_list,
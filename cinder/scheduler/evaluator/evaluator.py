@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import operator
 import re
 
@@ -34,34 +35,65 @@ def _operatorOperands(tokenList):
             break
 
 
+def _divide(dividend, divisor):
+    return dividend / float(divisor)
+
+
 class EvalConstant(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        result = self.value
-        if (isinstance(result, six.string_types) and
-                re.match(r"^[a-zA-Z_]+\.[a-zA-Z_]+$", result)):
-            (which_dict, entry) = result.split('.')
-            try:
-                result = _vars[which_dict][entry]
-            except KeyError as e:
-                raise exception.EvaluatorParseException(
-                    _("KeyError: %s") % e)
-            except TypeError as e:
-                raise exception.EvaluatorParseException(
-                    _("TypeError: %s") % e)
-
+    def _lookup(self, variables):
+        (which_dict, entry) = self.value.split('.')
+        try:
+            return variables[which_dict][entry]
+        except KeyError as e:
+            raise exception.EvaluatorParseException(
+                _("KeyError: %s") % e)
+        except TypeError as e:
+            raise exception.EvaluatorParseException(
+                _("TypeError: %s") % e)
+
+    @staticmethod
+    def _to_number(result):
         try:
-            result = int(result)
+            return int(result)
         except ValueError:
             try:
-                result = float(result)
+                return float(result)
             except ValueError as e:
                 raise exception.EvaluatorParseException(
                     _("ValueError: %s") % e)
 
-        return result
+    def _is_variable(self):
+        return (isinstance(self.value, six.string_types) and
+                re.match(r"^[a-zA-Z_]+\.[a-zA-Z_]+$", self.value))
+
+    def eval(self, variables):
+        result = self.value
+        if self._is_variable():
+            result = self._lookup(variables)
+        return self._to_number(result)
+
+    def compile(self):
+        if self._is_variable():
+            lookup = self._lookup
+            to_number = self._to_number
+
+            def variable(variables):
+                return to_number(lookup(variables))
+            return variable
+
+        try:
+            value = self._to_number(self.value)
+        except exception.EvaluatorParseException as e:
+            args = e.args
+
+            def invalid(variables):
+                raise exception.EvaluatorParseException(*args)
+            return invalid
+
+        return lambda variables: value
 
 
 class EvalSignOp(object):
@@ -73,59 +105,108 @@ class EvalSignOp(object):
     def __init__(self, toks):
         self.sign, self.value = toks[0]
 
-    def eval(self):
-        return self.operations[self.sign] * self.value.eval()
+    def eval(self, variables):
+        return self.operations[self.sign] * self.value.eval(variables)
+
+    def compile(self):
+        sign = self.operations[self.sign]
+        value = self.value.compile()
+        return lambda variables: sign * value(variables)
 
 
 class EvalAddOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        sum = self.value[0].eval()
+    def eval(self, variables):
+        sum = self.value[0].eval(variables)
         for op, val in _operatorOperands(self.value[1:]):
             if op == '+':
-                sum += val.eval()
+                sum += val.eval(variables)
             elif op == '-':
-                sum -= val.eval()
+                sum -= val.eval(variables)
         return sum
 
+    def compile(self):
+        first = self.value[0].compile()
+        rest = [(operator.add if op == '+' else operator.sub, val.compile())
+                for op, val in _operatorOperands(self.value[1:])]
+
+        def add(variables):
+            sum = first(variables)
+            for fn, val in rest:
+                sum = fn(sum, val(variables))
+            return sum
+        return add
+
 
 class EvalMultOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        prod = self.value[0].eval()
+    def eval(self, variables):
+        prod = self.value[0].eval(variables)
         for op, val in _operatorOperands(self.value[1:]):
             try:
                 if op == '*':
-                    prod *= val.eval()
+                    prod *= val.eval(variables)
                 elif op == '/':
-                    prod /= float(val.eval())
+                    prod /= float(val.eval(variables))
             except ZeroDivisionError as e:
                 raise exception.EvaluatorParseException(
                     _("ZeroDivisionError: %s") % e)
         return prod
 
+    def compile(self):
+        first = self.value[0].compile()
+        rest = [(operator.mul if op == '*' else _divide, val.compile())
+                for op, val in _operatorOperands(self.value[1:])]
+
+        def mult(variables):
+            prod = first(variables)
+            for fn, val in rest:
+                try:
+                    prod = fn(prod, val(variables))
+                except ZeroDivisionError as e:
+                    raise exception.EvaluatorParseException(
+                        _("ZeroDivisionError: %s") % e)
+            return prod
+        return mult
+
 
 class EvalPowerOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        prod = self.value[0].eval()
+    def eval(self, variables):
+        prod = self.value[0].eval(variables)
         for op, val in _operatorOperands(self.value[1:]):
-            prod = pow(prod, val.eval())
+            prod = pow(prod, val.eval(variables))
         return prod
 
+    def compile(self):
+        first = self.value[0].compile()
+        rest = [val.compile()
+                for _op, val in _operatorOperands(self.value[1:])]
+
+        def power(variables):
+            prod = first(variables)
+            for val in rest:
+                prod = pow(prod, val(variables))
+            return prod
+        return power
+
 
 class EvalNegateOp(object):
     def __init__(self, toks):
         self.negation, self.value = toks[0]
 
-    def eval(self):
-        return not self.value.eval()
+    def eval(self, variables):
+        return not self.value.eval(variables)
+
+    def compile(self):
+        value = self.value.compile()
+        return lambda variables: not value(variables)
 
 
 class EvalComparisonOp(object):
@@ -142,11 +223,11 @@ class EvalComparisonOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        val1 = self.value[0].eval()
+    def eval(self, variables):
+        val1 = self.value[0].eval(variables)
         for op, val in _operatorOperands(self.value[1:]):
             fn = self.operations[op]
-            val2 = val.eval()
+            val2 = val.eval(variables)
             if not fn(val1, val2):
                 break
             val1 = val2
@@ -154,17 +235,43 @@ class EvalComparisonOp(object):
             return True
         return False
 
+    def compile(self):
+        first = self.value[0].compile()
+        rest = [(self.operations[op], val.compile())
+                for op, val in _operatorOperands(self.value[1:])]
+
+        def compare(variables):
+            val1 = first(variables)
+            for fn, val in rest:
+                val2 = val(variables)
+                if not fn(val1, val2):
+                    return False
+                val1 = val2
+            return True
+        return compare
+
 
 class EvalTernaryOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        condition = self.value[0].eval()
+    def eval(self, variables):
+        condition = self.value[0].eval(variables)
         if condition:
-            return self.value[2].eval()
+            return self.value[2].eval(variables)
         else:
-            return self.value[4].eval()
+            return self.value[4].eval(variables)
+
+    def compile(self):
+        condition = self.value[0].compile()
+        if_true = self.value[2].compile()
+        if_false = self.value[4].compile()
+
+        def ternary(variables):
+            if condition(variables):
+                return if_true(variables)
+            return if_false(variables)
+        return ternary
 
 
 class EvalFunction(object):
@@ -177,21 +284,35 @@ class EvalFunction(object):
     def __init__(self, toks):
         self.func, self.value = toks[0]
 
-    def eval(self):
-        args = self.value.eval()
+    def eval(self, variables):
+        args = self.value.eval(variables)
         if type(args) is list:
             return self.functions[self.func](*args)
         else:
             return self.functions[self.func](args)
 
+    def compile(self):
+        if self.func not in self.functions:
+            # Fail when evaluated, like the interpreter.
+            return self.eval
+        func = self.functions[self.func]
+        value = self.value.compile()
+
+        def function(variables):
+            args = value(variables)
+            if type(args) is list:
+                return func(*args)
+            return func(args)
+        return function
+
 
 class EvalCommaSeperator(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        val1 = self.value[0].eval()
-        val2 = self.value[2].eval()
+    def eval(self, variables):
+        val1 = self.value[0].eval(variables)
+        val2 = self.value[2].eval(variables)
         if type(val2) is list:
             val_list = []
             val_list.append(val1)
@@ -201,28 +322,67 @@ class EvalCommaSeperator(object):
 
         return [val1, val2]
 
+    def compile(self):
+        first = self.value[0].compile()
+        second = self.value[2].compile()
+
+        def comma(variables):
+            val1 = first(variables)
+            val2 = second(variables)
+            if type(val2) is list:
+                return [val1] + val2
+            return [val1, val2]
+        return comma
+
 
 class EvalBoolAndOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        left = self.value[0].eval()
-        right = self.value[2].eval()
+    def eval(self, variables):
+        left = self.value[0].eval(variables)
+        right = self.value[2].eval(variables)
         return left and right
 
+    def compile(self):
+        left = self.value[0].compile()
+        right = self.value[2].compile()
+
+        def bool_and(variables):
+            # Both sides are always evaluated, so errors on either are raised.
+            left_value = left(variables)
+            right_value = right(variables)
+            return left_value and right_value
+        return bool_and
+
 
 class EvalBoolOrOp(object):
     def __init__(self, toks):
         self.value = toks[0]
 
-    def eval(self):
-        left = self.value[0].eval()
-        right = self.value[2].eval()
+    def eval(self, variables):
+        left = self.value[0].eval(variables)
+        right = self.value[2].eval(variables)
         return left or right
 
+    def compile(self):
+        left = self.value[0].compile()
+        right = self.value[2].compile()
+
+        def bool_or(variables):
+            left_value = left(variables)
+            right_value = right(variables)
+            return left_value or right_value
+        return bool_or
+
 _parser = None
-_vars = {}
+
+# Compiled expressions, most recently used last. Drivers report the same filter
+# and goodness functions for all their pools, so the expressions are compiled
+# once and reused by every scheduling request instead of being parsed for each
+# pool.
+_COMPILE_CACHE_SIZE = 256
+_compile_cache = collections.OrderedDict()
 
 
 def _def_parser():
@@ -272,26 +432,49 @@ def _def_parser():
     return expr
 
 
-def evaluate(expression, **kwargs):
-    """Evaluates an expression.
+def parse(expression):
+    """Parses an expression into a tree of Eval* objects.
 
-    Provides the facility to evaluate mathematical expressions, and to
-    substitute variables from dictionaries into those expressions.
-
-    Supports both integer and floating point values, and automatic
-    promotion where necessary.
+    The tree can be interpreted with its ``eval`` method, passing it a
+    dictionary of the variable dictionaries, or compiled into a function with
+    its ``compile`` method.
     """
     global _parser
     if _parser is None:
         _parser = _def_parser()
 
-    global _vars
-    _vars = kwargs
-
     try:
-        result = _parser.parseString(expression, parseAll=True)[0]
+        return _parser.parseString(expression, parseAll=True)[0]
     except pyparsing.ParseException as e:
         raise exception.EvaluatorParseException(
             _("ParseException: %s") % e)
 
-    return result.eval()
+
+def compile_expression(expression):
+    """Compiles an expression into a function of the variable dictionaries.
+
+    The function is built out of closures, so evaluating it doesn't walk the
+    parsed tree nor run any Python code from the expression. Functions are
+    cached by expression, evicting the least recently used ones.
+    """
+    try:
+        result = _compile_cache.pop(expression)
+    except KeyError:
+        result = parse(expression).compile()
+        if len(_compile_cache) >= _COMPILE_CACHE_SIZE:
+            _compile_cache.popitem(last=False)
+
+    _compile_cache[expression] = result
+    return result
+
+
+def evaluate(expression, **kwargs):
+    """Evaluates an expression.
+
+    Provides the facility to evaluate mathematical expressions, and to
+    substitute variables from dictionaries into those expressions.
+
+    Supports both integer and floating point values, and automatic
+    promotion where necessary.
+    """
+    return compile_expression(expression)(kwargs)
@@ -109,6 +109,50 @@ class FilterScheduler(driver.Scheduler):
                                          filter_properties,
                                          allow_reschedule=True)
 
+    def schedule_create_volumes(self, context, request_spec_list,
+                                filter_properties_list):
+        """Schedule the creation of identical volumes in a single pass.
+
+        Returns the backend of each volume, or None for the volumes that could
+        not be scheduled.
+        """
+        backends = self._schedule_volumes(context, request_spec_list,
+                                          filter_properties_list)
+        result = []
+        for request_spec, filter_properties, backend in zip(
+                request_spec_list, filter_properties_list, backends):
+            if not backend:
+                result.append(None)
+                continue
+
+            volume_id = request_spec['volume_id']
+            try:
+                updated_volume = driver.volume_update_db(context, volume_id,
+                                                         backend.host,
+                                                         backend.cluster_name)
+                self._post_select_populate_filter_properties(
+                    filter_properties, backend)
+
+                # context is not serializable
+                filter_properties.pop('context', None)
+
+                self.volume_rpcapi.create_volume(context, updated_volume,
+                                                 request_spec,
+                                                 filter_properties,
+                                                 allow_reschedule=True)
+            except Exception:
+                LOG.exception('Failed to create volume %(volume_id)s on '
+                              'backend %(backend)s.',
+                              {'volume_id': volume_id,
+                               'backend': backend.backend_id})
+                self.host_manager.revert_volume_consumed_capacity(
+                    backend.backend_id,
+                    request_spec['volume_properties']['size'])
+                result.append(None)
+                continue
+            result.append(backend.backend_id)
+        return result
+
     def backend_passes_filters(self, context, backend, request_spec,
                                filter_properties):
         """Check if the specified backend passes the filters."""
@@ -541,6 +585,49 @@ class FilterScheduler(driver.Scheduler):
             return None
         return self._choose_top_backend(weighed_backends, request_spec)
 
+    def _schedule_volumes(self, context, request_spec_list,
+                          filter_properties_list):
+        """Choose the backends of identical volumes.
+
+        The backends are filtered once, using the first volume's request, and
+        the volumes are then placed one by one on the top weighed backend,
+        consuming its capacity, so the weighers spread them across the
+        backends. A backend stops being a candidate once it doesn't pass the
+        filters after consuming a volume.
+        """
+        filter_properties = filter_properties_list[0]
+        weighed_backends = self._get_weighted_candidates(
+            context, request_spec_list[0], filter_properties)
+        candidates = [weighed.obj for weighed in weighed_backends]
+
+        shared_properties = {key: value
+                             for key, value in filter_properties.items()
+                             if key not in ('retry', 'request_spec')}
+        for request_spec, properties in zip(request_spec_list[1:],
+                                            filter_properties_list[1:]):
+            self._populate_retry(properties,
+                                 request_spec['volume_properties'])
+            properties.update(shared_properties)
+            properties['request_spec'] = jsonutils.to_primitive(request_spec)
+
+        backends = []
+        for index, request_spec in enumerate(request_spec_list):
+            if not candidates:
+                LOG.warning('No weighed backend found for volume %s.',
+                            request_spec['volume_id'])
+                backends.append(None)
+                continue
+            if index:
+                weighed_backends = self.host_manager.get_weighed_backends(
+                    candidates, filter_properties)
+            backend = self._choose_top_backend(weighed_backends,
+                                               request_spec).obj
+            backends.append(backend)
+            if not self.host_manager.get_filtered_backends(
+                    [backend], filter_properties):
+                candidates.remove(backend)
+        return backends
+
     def _schedule_generic_group(self, context, group_spec, request_spec_list,
                                 group_filter_properties=None,
                                 filter_properties_list=None):
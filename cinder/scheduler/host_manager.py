@@ -58,6 +58,18 @@ host_manager_opts = [
                default='cinder.scheduler.weights.OrderedHostWeightHandler',
                help='Which handler to use for selecting the host/pool '
                     'after weighing'),
+    cfg.IntOpt('scheduler_service_refresh_interval',
+               default=0,
+               min=0,
+               help='Maximum age in seconds of the list of volume services '
+                    'kept in memory by the scheduler. While it is not older '
+                    'than this, scheduling requests use the state of the '
+                    'backends kept up to date by their capability reports '
+                    'instead of reading the services from the database. '
+                    'Services that are disabled, frozen or go down are '
+                    'noticed after up to this time, so it should be well '
+                    'below service_down_time. 0 reads the services on '
+                    'every request.'),
 ]
 
 CONF = cfg.CONF
@@ -420,6 +432,12 @@ class HostManager(object):
         self.weight_classes = self.weight_handler.get_all_classes()
 
         self._no_capabilities_backends = set()  # Services without capabilities
+        self._volume_services = []
+        self._services_watch = None  # Age of _volume_services
+        self._service_backends = set()  # Hosts and clusters of the services
+        self._backend_state_map_outdated = True
+        # Last sequence number and capabilities received from each host
+        self._capabilities_seqs = {}
         self._update_backend_state_map(cinder_context.get_admin_context())
         self.service_states_last_update = {}
 
@@ -494,9 +512,32 @@ class HostManager(object):
                                                        backends,
                                                        weight_properties)
 
+    @staticmethod
+    def _apply_capabilities_delta(capabilities, delta):
+        """Return the capabilities resulting from applying a delta."""
+        result = {key: value for key, value in capabilities.items()
+                  if key not in delta['removed']}
+        result.update(delta['updated'])
+        if 'pools' in capabilities:
+            pools = [pool for pool in capabilities['pools']
+                     if pool['pool_name'] not in delta['removed_pools']]
+            for i, pool in enumerate(pools):
+                pools[i] = delta['pools'].get(pool['pool_name'], pool)
+            names = {pool['pool_name'] for pool in pools}
+            pools.extend(pool for name, pool in delta['pools'].items()
+                         if name not in names)
+            result['pools'] = pools
+        return result
+
     def update_service_capabilities(self, service_name, host, capabilities,
-                                    cluster_name, timestamp):
-        """Update the per-service capabilities based on this notification."""
+                                    cluster_name, timestamp, seq=None,
+                                    delta=False):
+        """Update the per-service capabilities based on this notification.
+
+        When the service sends sequenced reports, delta ones only carry the
+        changes since the previous report of that same host, and False is
+        returned if we missed that report and the delta cannot be applied.
+        """
         if service_name != 'volume':
             LOG.debug('Ignoring %(service_name)s service update '
                       'from %(host)s',
@@ -506,9 +547,6 @@ class HostManager(object):
         # TODO(geguileo): In P - Remove the next line since we receive the
         # timestamp
         timestamp = timestamp or timeutils.utcnow()
-        # Copy the capabilities, so we don't modify the original dict
-        capab_copy = dict(capabilities)
-        capab_copy["timestamp"] = timestamp
 
         # Set the default capabilities in case None is set.
         backend = cluster_name or host
@@ -521,19 +559,43 @@ class HostManager(object):
             LOG.info('Ignoring old capability report from %s.', backend)
             return
 
+        if delta:
+            generation, number = seq
+            last_seq, capab_base = self._capabilities_seqs.get(host,
+                                                               (None, None))
+            if last_seq != (generation, number - 1):
+                LOG.info('Missed capability report from %s, requesting a '
+                         'full one.', host)
+                self._capabilities_seqs.pop(host, None)
+                return False
+            # Only the pools in the delta may have been updated
+            updated_pools = self._get_updated_pools(
+                {'pools': [pool for pool in capab_base.get('pools', [])
+                           if pool['pool_name'] in capabilities['pools']]},
+                {'pools': list(capabilities['pools'].values())})
+            capab_copy = self._apply_capabilities_delta(capab_base,
+                                                        capabilities)
+        else:
+            # Copy the capabilities, so we don't modify the original dict
+            capab_copy = dict(capabilities)
+            updated_pools = self._get_updated_pools(capab_old, capab_copy)
+        capab_copy["timestamp"] = timestamp
+
         # If the capabilities are not changed and the timestamp is older,
         # record the capabilities.
 
         # There are cases: capab_old has the capabilities set,
         # but the timestamp may be None in it. So does capab_last_update.
 
-        if (not self._get_updated_pools(capab_old, capab_copy)) and (
+        if (not updated_pools) and (
                 (not capab_old.get("timestamp")) or
                 (not capab_last_update.get("timestamp")) or
                 (capab_last_update["timestamp"] < capab_old["timestamp"])):
             self.service_states_last_update[backend] = capab_old
 
         self.service_states[backend] = capab_copy
+        if seq is not None:
+            self._capabilities_seqs[host] = (tuple(seq), capab_copy)
 
         cluster_msg = (('Cluster: %s - Host: ' % cluster_name) if cluster_name
                        else '')
@@ -544,6 +606,11 @@ class HostManager(object):
                    'cluster': cluster_msg})
 
         self._no_capabilities_backends.discard(backend)
+        self._backend_state_map_outdated = True
+        if backend not in self._service_backends:
+            # Reread the services, this may be a new one
+            self._services_watch = None
+        return True
 
     def notify_service_capabilities(self, service_name, backend, capabilities,
                                     timestamp):
@@ -578,18 +645,39 @@ class HostManager(object):
     def has_all_capabilities(self):
         return len(self._no_capabilities_backends) == 0
 
+    def _refresh_volume_services(self, context):
+        topic = constants.VOLUME_TOPIC
+        self._volume_services = objects.ServiceList.get_all(
+            context, {'topic': topic, 'disabled': False, 'frozen': False}
+        ).objects
+        self._service_backends = set()
+        for service in self._volume_services:
+            self._service_backends.add(service.host)
+            self._service_backends.add(service.cluster_name)
+        interval = CONF.scheduler_service_refresh_interval
+        if interval:
+            self._services_watch = timeutils.StopWatch(duration=interval)
+            self._services_watch.start()
+
     def _update_backend_state_map(self, context):
+        """Update the backend states from the services and capabilities.
+
+        The services are read from the database once they are older than
+        scheduler_service_refresh_interval, and the states are only rebuilt
+        when the services have been read or a capability report has been
+        received since the last update.
+        """
+        if self._services_watch is None or self._services_watch.expired():
+            # Get resource usage across the available volume nodes:
+            self._refresh_volume_services(context)
+        elif not self._backend_state_map_outdated:
+            return
+        self._backend_state_map_outdated = False
 
-        # Get resource usage across the available volume nodes:
-        topic = constants.VOLUME_TOPIC
-        volume_services = objects.ServiceList.get_all(context,
-                                                      {'topic': topic,
-                                                       'disabled': False,
-                                                       'frozen': False})
         active_backends = set()
         active_hosts = set()
         no_capabilities_backends = set()
-        for service in volume_services.objects:
+        for service in self._volume_services:
             host = service.host
             if not service.is_up:
                 LOG.warning("volume service is down. (host: %s)", host)
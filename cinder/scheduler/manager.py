@@ -40,12 +40,14 @@ from cinder import flow_utils
 from cinder.i18n import _
 from cinder import manager
 from cinder.message import api as mess_api
+from cinder.message import message_field
 from cinder import objects
 from cinder.objects import fields
 from cinder import quota
 from cinder import rpc
 from cinder.scheduler.flows import create_volume
 from cinder.scheduler import rpcapi as scheduler_rpcapi
+from cinder.volume.flows import common as flow_common
 from cinder.volume import rpcapi as volume_rpcapi
 
 
@@ -108,7 +110,7 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
     def update_service_capabilities(self, context, service_name=None,
                                     host=None, capabilities=None,
                                     cluster_name=None, timestamp=None,
-                                    **kwargs):
+                                    seq=None, delta=False, **kwargs):
         """Process a capability update from a service node."""
         if capabilities is None:
             capabilities = {}
@@ -117,11 +119,17 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
             timestamp = datetime.strptime(timestamp,
                                           timeutils.PERFECT_TIME_FORMAT)
 
-        self.driver.update_service_capabilities(service_name,
-                                                host,
-                                                capabilities,
-                                                cluster_name,
-                                                timestamp)
+        applied = self.driver.update_service_capabilities(service_name,
+                                                          host,
+                                                          capabilities,
+                                                          cluster_name,
+                                                          timestamp,
+                                                          seq=seq,
+                                                          delta=delta)
+        if applied is False:
+            # We missed a report the delta is based on, ask the service to
+            # send us all its capabilities again.
+            self.volume_api.publish_service_capabilities(context, host)
 
     def notify_service_capabilities(self, context, service_name,
                                     capabilities, host=None, backend=None,
@@ -194,6 +202,51 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
         with flow_utils.DynamicLogListener(flow_engine, logger=LOG):
             flow_engine.run()
 
+    @objects.Volume.set_workers
+    def create_volumes(self, context, volumes, request_spec_list=None,
+                       filter_properties_list=None):
+        """Schedule the creation of identical volumes in a single pass.
+
+        Returns the backend chosen for each volume, or None for the volumes
+        that could not be scheduled, which are set to error. The placements
+        of the whole batch are also sent in a scheduler.create_volumes
+        notification, since the API casts the batch.
+        """
+        self._wait_for_scheduler()
+
+        filter_properties_list = [filter_properties or {}
+                                  for filter_properties in
+                                  filter_properties_list or
+                                  [None] * len(volumes)]
+        backends = [None] * len(volumes)
+        error = exception.NoValidBackend(reason=_("No weighed backends "
+                                                  "available"))
+        try:
+            backends = self.driver.schedule_create_volumes(
+                context, request_spec_list, filter_properties_list)
+        except Exception as e:
+            error = e
+            LOG.exception("Failed to schedule volumes %(volume_ids)s.",
+                          {'volume_ids': [volume.id for volume in volumes]})
+
+        for volume, backend in zip(volumes, backends):
+            if backend is None:
+                self.message_api.create(
+                    context,
+                    message_field.Action.SCHEDULE_ALLOCATE_VOLUME,
+                    resource_uuid=volume.id,
+                    exception=error)
+                flow_common.error_out(volume, reason=error)
+
+        payload = {'placements': [{'volume_id': volume.id,
+                                   'backend': backend}
+                                  for volume, backend in zip(volumes,
+                                                             backends)]}
+        rpc.get_notifier('scheduler').info(context,
+                                           'scheduler.create_volumes',
+                                           payload)
+        return backends
+
     def create_snapshot(self, ctxt, volume, snapshot, backend,
                         request_spec=None, filter_properties=None):
         """Create snapshot for a volume.
@@ -72,9 +72,11 @@ class SchedulerAPI(rpc.RPCAPI):
         3.9 - Adds create_snapshot method
         3.10 - Adds backup_id to create_volume method.
         3.11 - Adds manage_existing_snapshot method.
+        3.12 - Adds create_volumes method.
+        3.13 - Adds seq and delta to update_service_capabilities.
     """
 
-    RPC_API_VERSION = '3.11'
+    RPC_API_VERSION = '3.13'
     RPC_DEFAULT_VERSION = '3.0'
     TOPIC = constants.SCHEDULER_TOPIC
     BINARY = 'cinder-scheduler'
@@ -108,6 +110,17 @@ class SchedulerAPI(rpc.RPCAPI):
             msg_args.pop('backup_id')
         return cctxt.cast(ctxt, 'create_volume', **msg_args)
 
+    @rpc.assert_min_rpc_version('3.12')
+    def create_volumes(self, ctxt, volumes, request_spec_list=None,
+                       filter_properties_list=None):
+        for volume in volumes:
+            volume.create_worker()
+        cctxt = self._get_cctxt()
+        msg_args = {'volumes': volumes,
+                    'request_spec_list': request_spec_list,
+                    'filter_properties_list': filter_properties_list}
+        cctxt.cast(ctxt, 'create_volumes', **msg_args)
+
     @rpc.assert_min_rpc_version('3.8')
     def validate_host_capacity(self, ctxt, backend, request_spec,
                                filter_properties=None):
@@ -204,11 +217,21 @@ class SchedulerAPI(rpc.RPCAPI):
 
     def update_service_capabilities(self, ctxt, service_name, host,
                                     capabilities, cluster_name,
-                                    timestamp=None):
+                                    timestamp=None, seq=None, delta=None):
         msg_args = dict(service_name=service_name, host=host,
                         capabilities=capabilities)
 
-        version = '3.3'
+        # Schedulers that understand sequenced reports get the delta
+        # against the previous report when there is one, the others always
+        # get the full capabilities.
+        if seq is not None and self.client.can_send_version('3.13'):
+            version = '3.13'
+            msg_args.update(seq=seq, delta=delta is not None)
+            if delta is not None:
+                msg_args['capabilities'] = delta
+        else:
+            version = '3.3'
+
         # If server accepts timestamping the capabilities and the cluster name
         if self.client.can_send_version(version):
             # Serialize the timestamp
@@ -150,6 +150,13 @@ class GoogleBackupDriverTestCase(test.TestCase):
         self.volume_file.write(bytes([65] * data_size))
         self.volume_file.seek(0)
 
+    def _read_sha256file(self, service, backup):
+        sha256file = service._read_sha256file(backup)
+        digests = service._get_sha256_digests(sha256file)
+        sha256file['sha256s'] = [digests[offset:offset + 32]
+                                 for offset in range(0, len(digests), 32)]
+        return sha256file
+
     def setUp(self):
         super(GoogleBackupDriverTestCase, self).setUp()
         self.flags(backup_gcs_bucket='gcscinderbucket')
@@ -298,7 +305,7 @@ class GoogleBackupDriverTestCase(test.TestCase):
         self.assertEqual(container_name, backup.container)
 
         # Verify sha contents
-        content1 = service._read_sha256file(backup)
+        content1 = self._read_sha256file(service, backup)
         self.assertEqual(64 * units.Ki / content1['chunk_size'],
                          len(content1['sha256s']))
 
@@ -325,8 +332,8 @@ class GoogleBackupDriverTestCase(test.TestCase):
         self.assertEqual(container_name, deltabackup.container)
 
         # Compare shas from both files
-        content1 = service1._read_sha256file(backup)
-        content2 = service2._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service1, backup)
+        content2 = self._read_sha256file(service2, deltabackup)
 
         self.assertEqual(len(content1['sha256s']), len(content2['sha256s']))
         self.assertEqual(set(content1['sha256s']), set(content2['sha256s']))
@@ -361,8 +368,8 @@ class GoogleBackupDriverTestCase(test.TestCase):
         service2.backup(deltabackup, self.volume_file)
         self.assertEqual(container_name, deltabackup.container)
 
-        content1 = service1._read_sha256file(backup)
-        content2 = service2._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service1, backup)
+        content2 = self._read_sha256file(service2, deltabackup)
 
         # Verify that two shas are changed at index 16 and 32
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
@@ -400,8 +407,8 @@ class GoogleBackupDriverTestCase(test.TestCase):
         self.assertEqual(container_name, deltabackup.container)
 
         # Verify that two shas are changed at index 16 and 20
-        content1 = service1._read_sha256file(backup)
-        content2 = service2._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service1, backup)
+        content2 = self._read_sha256file(service2, deltabackup)
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
         self.assertNotEqual(content1['sha256s'][20], content2['sha256s'][20])
 
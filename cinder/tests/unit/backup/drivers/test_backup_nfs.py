@@ -16,13 +16,16 @@
 Tests for Backup NFS driver.
 
 """
+import binascii
 import bz2
 import ddt
 import filecmp
 import hashlib
+import json
 import os
 import shutil
 import stat
+import sys
 import tempfile
 import threading
 import zlib
@@ -33,6 +36,7 @@ from os_brick.remotefs import remotefs as remotefs_brick
 from oslo_config import cfg
 import six
 
+from cinder.backup import chunkeddriver
 from cinder.backup.drivers import nfs
 from cinder import context
 from cinder import db
@@ -187,6 +191,13 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.thread_dict['thread'] = threading.current_thread()
         return self.thread_original_method(*args, **kwargs)
 
+    def _read_sha256file(self, service, backup):
+        sha256file = service._read_sha256file(backup)
+        digests = service._get_sha256_digests(sha256file)
+        sha256file['sha256s'] = [digests[offset:offset + 32]
+                                 for offset in range(0, len(digests), 32)]
+        return sha256file
+
     def setUp(self):
         super(BackupNFSSwiftBasedTestCase, self).setUp()
 
@@ -378,7 +389,7 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertEqual(backup['container'], container_name)
 
         # Verify sha contents
-        content1 = service._read_sha256file(backup)
+        content1 = self._read_sha256file(service, backup)
         self.assertEqual(32 * 1024 / content1['chunk_size'],
                          len(content1['sha256s']))
 
@@ -421,8 +432,8 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertEqual(deltabackup['container'], container_name)
 
         # Compare shas from both files
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
 
         self.assertEqual(len(content1['sha256s']), len(content2['sha256s']))
         self.assertEqual(set(content1['sha256s']), set(content2['sha256s']))
@@ -473,8 +484,8 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         deltabackup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
         self.assertEqual(deltabackup['container'], container_name)
 
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
 
         # Verify that two shas are changed at index 16 and 20
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
@@ -527,11 +538,60 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertEqual(deltabackup['container'], container_name)
 
         # Verify that two shas are changed at index 16 and 20
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
         self.assertNotEqual(content1['sha256s'][20], content2['sha256s'][20])
 
+    def test_backup_delta_v1_sha256file(self):
+        volume_id = fake.VOLUME_ID
+        self.flags(backup_file_size=(1024 * 8))
+        self.flags(backup_sha_block_size_bytes=1024)
+        self._create_backup_db_entry(volume_id=volume_id,
+                                     backup_id=fake.BACKUP_ID)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        # Rewrite the sha256 file of the parent in the 1.0.0 format.
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        sha256file = service._read_sha256file(backup)
+        digests = service._get_sha256_digests(sha256file)
+        sha256file['version'] = '1.0.0'
+        sha256file['sha256s'] = [
+            binascii.hexlify(digests[offset:offset + 32]).decode('ascii')
+            for offset in range(0, len(digests), 32)]
+        with service._get_object_writer(
+                backup.container, service._sha256_filename(backup)) as writer:
+            writer.write(json.dumps(sha256file).encode('utf-8'))
+
+        self.volume_file.seek(16 * 1024)
+        self.volume_file.write(os.urandom(1024))
+        self._create_backup_db_entry(volume_id=volume_id,
+                                     backup_id=fake.BACKUP2_ID,
+                                     parent_id=fake.BACKUP_ID)
+        self.volume_file.seek(0)
+        deltabackup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
+        service.backup(deltabackup, self.volume_file)
+
+        deltabackup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
+        metadata = service._read_metadata(deltabackup)
+        self.assertEqual([{'offset': 16 * 1024, 'length': 1024}],
+                         [{'offset': list(obj.values())[0]['offset'],
+                           'length': list(obj.values())[0]['length']}
+                          for obj in metadata['objects']])
+        content = service._read_sha256file(deltabackup)
+        self.assertEqual(service.SHA256FILE_VERSION, content['version'])
+        self.assertEqual(digests[:16 * 32],
+                         service._get_sha256_digests(content)[:16 * 32])
+
+    def test_get_sha256_digests_unsupported_version(self):
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.assertRaises(exception.InvalidBackup,
+                          service._get_sha256_digests,
+                          {'version': '99.0.0', 'sha256s': ''})
+
     def test_backup_backup_metadata_fail(self):
         """Test of when an exception occurs in backup().
 
@@ -658,6 +718,35 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertNotEqual(threading.current_thread(),
                             self.thread_dict['thread'])
 
+    def test_restore_zstd(self):
+        # Stand in for the zstandard library, which may not be installed.
+        fake_zstd = mock.Mock(compress=mock.Mock(side_effect=zlib.compress),
+                              decompress=zlib.decompress)
+        self.mock_object(sys, 'modules',
+                         dict(sys.modules, zstandard=fake_zstd))
+        volume_id = fake.VOLUME_ID
+
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_compression_algorithm='zstd',
+                   backup_compression_level=9)
+        file_size = 1024 * 3
+        self.flags(backup_file_size=file_size)
+        self.flags(backup_sha_block_size_bytes=1024)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self._write_effective_compression_file(file_size)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        metadata = service._read_metadata(backup)
+        self.assertEqual(
+            'zstd', list(metadata['objects'][0].values())[0]['compression'])
+        fake_zstd.compress.assert_any_call(mock.ANY, 9)
+        with tempfile.NamedTemporaryFile() as restored_file:
+            backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+            service.restore(backup, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
     def test_restore_delta(self):
         volume_id = fake.VOLUME_ID
 
@@ -707,6 +796,242 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
             self.assertTrue(filecmp.cmp(self.volume_file.name,
                             restored_file.name))
 
+    def test_restore_delta_chain(self):
+        volume_id = fake.VOLUME_ID
+        self.flags(backup_compression_algorithm='none')
+        self.flags(backup_file_size=(1024 * 8))
+        self.flags(backup_sha_block_size_bytes=1024)
+        service = nfs.NFSBackupDriver(self.ctxt)
+
+        parent_id = None
+        for backup_id in (fake.BACKUP_ID, fake.BACKUP2_ID, fake.BACKUP3_ID):
+            if parent_id:
+                self.volume_file.seek(16 * 1024)
+                self.volume_file.write(os.urandom(1024))
+                self.volume_file.seek(20 * 1024)
+                self.volume_file.write(os.urandom(1024))
+            self._create_backup_db_entry(volume_id=volume_id,
+                                         backup_id=backup_id,
+                                         parent_id=parent_id)
+            self.volume_file.seek(0)
+            backup = objects.Backup.get_by_id(self.ctxt, backup_id)
+            service.backup(backup, self.volume_file)
+            parent_id = backup_id
+
+        # The second backup is fully overwritten by the third one, and the
+        # objects of the rest are only read once.
+        read_objects = []
+        get_object_reader = service.get_object_reader
+
+        def _get_object_reader(container, object_name, extra_metadata=None):
+            read_objects.append(object_name)
+            return get_object_reader(container, object_name, extra_metadata)
+
+        self.mock_object(service, 'get_object_reader',
+                         side_effect=_get_object_reader)
+        with tempfile.NamedTemporaryFile() as restored_file:
+            backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP3_ID)
+            service.restore(backup, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
+        data_objects = [name for name in read_objects
+                        if not name.endswith(('_metadata', '_sha256file'))]
+        self.assertEqual(len(set(data_objects)), len(data_objects))
+        self.assertEqual(4 + 2, len(data_objects))
+        backup2 = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
+        self.assertEqual([], [name for name in data_objects
+                              if name.startswith(backup2.service_metadata)])
+
+    @mock.patch('os.fsync')
+    def test_restore_prefetch_batched_fsync(self, mock_fsync):
+        volume_id = fake.VOLUME_ID
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_compression_algorithm='zlib')
+        self.flags(backup_file_size=1024 * 4)
+        self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_restore_prefetch_objects=3)
+        self.flags(backup_restore_fsync_objects=3)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        with tempfile.NamedTemporaryFile() as restored_file:
+            backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+            service.restore(backup, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
+        # 8 objects are synced after the 3rd, the 6th and the last one.
+        self.assertEqual(3, mock_fsync.call_count)
+
+    def test_restore_read_failure(self):
+        volume_id = fake.VOLUME_ID
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_file_size=1024 * 4)
+        self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_restore_prefetch_objects=2)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        read_restore_object = service._read_restore_object
+
+        def _fake_read_restore_object(source, *args, **kwargs):
+            if source[1].endswith('-00002'):
+                raise exception.BackupDriverException(message='fake')
+            return read_restore_object(source, *args, **kwargs)
+
+        self.mock_object(service, '_read_restore_object',
+                         side_effect=_fake_read_restore_object)
+        with tempfile.NamedTemporaryFile() as restored_file:
+            backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+            self.assertRaises(exception.BackupDriverException,
+                              service.restore, backup, volume_id,
+                              restored_file)
+        # Only the objects within the prefetch window were requested.
+        self.assertEqual(4, service._read_restore_object.call_count)
+
+    def test_backup_dedup(self):
+        volume_id = fake.VOLUME_ID
+        self.flags(backup_dedup=True)
+        self.flags(backup_file_size=1024 * 4)
+        self.flags(backup_sha_block_size_bytes=1024)
+        # The last 8 KB are the same as the first 8 KB.
+        self.volume_file.seek(0)
+        data = self.volume_file.read(8 * 1024)
+        self.volume_file.seek(24 * 1024)
+        self.volume_file.write(data)
+        service = nfs.NFSBackupDriver(self.ctxt)
+
+        for backup_id in (fake.BACKUP_ID, fake.BACKUP2_ID):
+            self._create_backup_db_entry(volume_id=volume_id,
+                                         backup_id=backup_id)
+            self.volume_file.seek(0)
+            backup = objects.Backup.get_by_id(self.ctxt, backup_id)
+            service.backup(backup, self.volume_file)
+
+        backup1 = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        backup2 = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
+        container = backup1.container
+        # The first backup only stored 6 of its 8 chunks, and the second one
+        # stored none.
+        self.assertEqual(6, len(service._generate_object_names(backup1)) - 2)
+        self.assertEqual(2, len(service._generate_object_names(backup2)))
+        metadata = service._read_metadata(backup2)
+        refs = [list(obj.values())[0]['dedup_ref']
+                for obj in metadata['objects']]
+        self.assertEqual(refs[:2], refs[6:])
+        index = service._read_dedup_index(container)
+        self.assertEqual(6, len(index.objects))
+        self.assertEqual(4, index.objects[refs[0]]['refs'])
+        self.assertEqual(2, index.objects[refs[2]]['refs'])
+
+        # Data referenced by the second backup is kept after deleting the
+        # first one, and all of it is gone once both are deleted.
+        service.delete_backup(backup1)
+        self.assertEqual(6, len(service._read_dedup_index(container).objects))
+        with tempfile.NamedTemporaryFile() as restored_file:
+            service.restore(backup2, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
+        service.delete_backup(backup2)
+        self.assertEqual({}, service._read_dedup_index(container).objects)
+        self.assertEqual(
+            [service.DEDUP_INDEX_FILENAME],
+            service.get_container_entries(container, ''))
+
+    def test_backup_dedup_concurrent_chunks(self):
+        volume_id = fake.VOLUME_ID
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_dedup=True)
+        self.flags(backup_file_size=1024 * 4)
+        self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_object_writers=4)
+        self.flags(backup_max_inflight_chunks=8)
+        # All the chunks have the same data and are stored concurrently.
+        self.volume_file.seek(0)
+        data = self.volume_file.read(4 * 1024)
+        for offset in range(4 * 1024, 32 * 1024, 4 * 1024):
+            self.volume_file.seek(offset)
+            self.volume_file.write(data)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        # The data was only uploaded once, and referenced by every chunk.
+        self.assertEqual(1, len(service._generate_object_names(backup)) - 2)
+        index = service._read_dedup_index(backup.container)
+        self.assertEqual(1, len(index.objects))
+        self.assertEqual(8, list(index.objects.values())[0]['refs'])
+        with tempfile.NamedTemporaryFile() as restored_file:
+            service.restore(backup, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
+    def test_backup_restore_concurrent_writers(self):
+        volume_id = fake.VOLUME_ID
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_compression_algorithm='zlib')
+        self.flags(backup_file_size=1024 * 2)
+        self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_object_writers=4)
+        self.flags(backup_max_inflight_chunks=8)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        service.backup(backup, self.volume_file)
+
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+        metadata = service._read_metadata(backup)
+        self.assertEqual(16, len(metadata['objects']))
+        prefix = backup['service_metadata']
+        for index, metadata_object in enumerate(metadata['objects']):
+            object_name, obj = list(metadata_object.items())[0]
+            self.assertEqual('%s-%05d' % (prefix, index + 1), object_name)
+            self.assertEqual(index * 1024 * 2, obj['offset'])
+            self.assertEqual('fake-md5-sum', obj['md5'])
+            self.assertIn('compression', obj)
+
+        with tempfile.NamedTemporaryFile() as restored_file:
+            service.restore(backup, volume_id, restored_file)
+            self.assertTrue(filecmp.cmp(self.volume_file.name,
+                            restored_file.name))
+
+    def test_backup_chunk_failure(self):
+        volume_id = fake.VOLUME_ID
+        self._create_backup_db_entry(volume_id=volume_id)
+        self.flags(backup_file_size=1024 * 2)
+        self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_object_writers=2)
+        self.flags(backup_max_inflight_chunks=4)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        store_chunk = service._store_chunk
+        stored = []
+
+        def _fake_store_chunk(container, object_name, *args, **kwargs):
+            if object_name.endswith('-00003'):
+                raise exception.BackupDriverException(message='fake')
+            store_chunk(container, object_name, *args, **kwargs)
+            stored.append(object_name)
+
+        self.mock_object(service, '_store_chunk',
+                         side_effect=_fake_store_chunk)
+        self.volume_file.seek(0)
+        backup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP_ID)
+
+        self.assertRaises(exception.BackupDriverException,
+                          service.backup, backup, self.volume_file)
+        # Chunks that were in flight when the failure was noticed have been
+        # waited for, and no more chunks were submitted afterwards.
+        self.assertLessEqual(len(stored), 2 + 4)
+        self.assertEqual(len(stored), service._store_chunk.call_count - 1)
+
     def test_delete(self):
         volume_id = fake.VOLUME_ID
         self._create_backup_db_entry(volume_id=volume_id)
@@ -726,6 +1051,27 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertIsInstance(compressor, tpool.Proxy)
         self.assertRaises(ValueError, service._get_compressor, 'fake')
 
+    @mock.patch.dict('sys.modules', {'zstandard': None, 'lz4': None,
+                                     'lz4.frame': None})
+    def test_get_compressor_missing_library(self):
+        service = nfs.NFSBackupDriver(self.ctxt)
+        self.assertRaises(ValueError, service._get_compressor, 'zstd')
+        self.assertRaises(ValueError, service._get_compressor, 'lz4')
+
+    def test_get_compressor_zstd_lz4(self):
+        fake_zstd = mock.sentinel.zstandard
+        fake_lz4 = mock.Mock(frame=mock.sentinel.lz4_frame)
+        self.mock_object(sys, 'modules',
+                         dict(sys.modules, zstandard=fake_zstd, lz4=fake_lz4,
+                              **{'lz4.frame': fake_lz4.frame}))
+        service = nfs.NFSBackupDriver(self.ctxt)
+        compressor = service._get_compressor('zstd')
+        self.assertEqual(compressor, fake_zstd)
+        self.assertIsInstance(compressor, tpool.Proxy)
+        compressor = service._get_compressor('lz4')
+        self.assertEqual(compressor, fake_lz4.frame)
+        self.assertIsInstance(compressor, tpool.Proxy)
+
     def create_buffer(self, size):
         # Set up buffer of zeroed bytes
         fake_data = bytearray(size)
@@ -761,6 +1107,55 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
         self.assertEqual('none', result[0])
         self.assertEqual(fake_data, result[1])
 
+    def test_prepare_output_data_level(self):
+        self.flags(backup_compression_level=1)
+        self.mock_object(zlib, 'compress', return_value=b'compressed')
+        service = nfs.NFSBackupDriver(self.ctxt)
+        fake_data = self.create_buffer(128)
+
+        result = service._prepare_output_data(fake_data)
+
+        self.assertEqual(('zlib', b'compressed'), result)
+        zlib.compress.assert_called_once_with(fake_data, 1)
+
+    def test_prepare_output_data_adaptive_incompressible(self):
+        self.flags(backup_compression_adaptive=True)
+        self.mock_object(zlib, 'compress', side_effect=zlib.compress)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        fake_data = os.urandom(1024 * 1024)
+
+        result = service._prepare_output_data(fake_data)
+
+        self.assertEqual(('none', fake_data), result)
+        # Only the sample was compressed.
+        sample = zlib.compress.call_args[0][0]
+        self.assertEqual(chunkeddriver.COMPRESSION_SAMPLES *
+                         chunkeddriver.COMPRESSION_SAMPLE_BYTES,
+                         len(sample))
+        self.assertEqual(fake_data[-len(sample) // 4:],
+                         sample[-len(sample) // 4:])
+
+    def test_prepare_output_data_adaptive_compressible(self):
+        self.flags(backup_compression_adaptive=True)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        fake_data = self.create_buffer(1024 * 1024)
+
+        result = service._prepare_output_data(fake_data)
+
+        self.assertEqual('zlib', result[0])
+        self.assertEqual(fake_data, zlib.decompress(result[1]))
+
+    def test_prepare_output_data_adaptive_min_savings(self):
+        self.flags(backup_compression_adaptive=True,
+                   backup_compression_min_savings=50)
+        service = nfs.NFSBackupDriver(self.ctxt)
+        # Small chunks are not sampled but still need the minimum savings.
+        fake_data = os.urandom(64) + bytes(64)
+
+        result = service._prepare_output_data(fake_data)
+
+        self.assertEqual(('none', fake_data), result)
+
     def test_prepare_output_data_ineffective_compression(self):
         service = nfs.NFSBackupDriver(self.ctxt)
         fake_data = self.create_buffer(128)
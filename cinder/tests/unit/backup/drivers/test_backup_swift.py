@@ -99,6 +99,13 @@ class BackupSwiftTestCase(test.TestCase):
         self.volume_file.write(bytes([65] * data_size))
         self.volume_file.seek(0)
 
+    def _read_sha256file(self, service, backup):
+        sha256file = service._read_sha256file(backup)
+        digests = service._get_sha256_digests(sha256file)
+        sha256file['sha256s'] = [digests[offset:offset + 32]
+                                 for offset in range(0, len(digests), 32)]
+        return sha256file
+
     def setUp(self):
         super(BackupSwiftTestCase, self).setUp()
         service_catalog = [{u'type': u'object-store', u'name': u'swift',
@@ -455,7 +462,7 @@ class BackupSwiftTestCase(test.TestCase):
         self.assertEqual(container_name, backup['container'])
 
         # Verify sha contents
-        content1 = service._read_sha256file(backup)
+        content1 = self._read_sha256file(service, backup)
         self.assertEqual(64 * 1024 / content1['chunk_size'],
                          len(content1['sha256s']))
 
@@ -502,8 +509,8 @@ class BackupSwiftTestCase(test.TestCase):
         self.assertEqual(container_name, deltabackup['container'])
 
         # Compare shas from both files
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
 
         self.assertEqual(len(content1['sha256s']), len(content2['sha256s']))
         self.assertEqual(set(content1['sha256s']), set(content2['sha256s']))
@@ -558,8 +565,8 @@ class BackupSwiftTestCase(test.TestCase):
         deltabackup = objects.Backup.get_by_id(self.ctxt, fake.BACKUP2_ID)
         self.assertEqual(container_name, deltabackup['container'])
 
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
 
         # Verify that two shas are changed at index 16 and 32
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
@@ -616,8 +623,8 @@ class BackupSwiftTestCase(test.TestCase):
         self.assertEqual(container_name, deltabackup['container'])
 
         # Verify that two shas are changed at index 16 and 20
-        content1 = service._read_sha256file(backup)
-        content2 = service._read_sha256file(deltabackup)
+        content1 = self._read_sha256file(service, backup)
+        content2 = self._read_sha256file(service, deltabackup)
         self.assertNotEqual(content1['sha256s'][16], content2['sha256s'][16])
         self.assertNotEqual(content1['sha256s'][20], content2['sha256s'][20])
 
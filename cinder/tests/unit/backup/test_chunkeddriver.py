@@ -0,0 +1,164 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the helpers of the chunked backup driver."""
+
+import hashlib
+
+import eventlet
+
+from cinder.backup import chunkeddriver
+from cinder import test
+
+
+class Sha256DigestsTestCase(test.TestCase):
+
+    def test_sha256_digests(self):
+        data = b'a' * 10 + b'b' * 10 + b'c' * 5
+        expected = b''.join(hashlib.sha256(block).digest()
+                            for block in (b'a' * 10, b'b' * 10, b'c' * 5))
+        self.assertEqual(expected, chunkeddriver._sha256_digests(data, 10))
+
+    def test_changed_extents(self):
+        parent = chunkeddriver._sha256_digests(b'abcdefgh', 1)
+        digests = chunkeddriver._sha256_digests(b'aXcdYZgQ', 1)
+        self.assertEqual([(1, 2), (4, 6), (7, 8)],
+                         chunkeddriver._changed_extents(digests, parent, 1,
+                                                        8))
+
+    def test_changed_extents_unchanged(self):
+        parent = chunkeddriver._sha256_digests(b'abcdefgh', 2)
+        self.assertEqual([], chunkeddriver._changed_extents(parent, parent,
+                                                            2, 8))
+
+    def test_changed_extents_short_parent(self):
+        parent = chunkeddriver._sha256_digests(b'abcd', 2)
+        digests = chunkeddriver._sha256_digests(b'abcdefg', 2)
+        self.assertEqual([(4, 7)],
+                         chunkeddriver._changed_extents(digests, parent, 2,
+                                                        7))
+
+
+class ExtentMapTestCase(test.TestCase):
+
+    def _add(self, extents):
+        extent_map = chunkeddriver._ExtentMap()
+        for start, end, source in extents:
+            extent_map.add(start, end, source)
+        return list(extent_map)
+
+    def test_add_disjoint(self):
+        result = self._add([(20, 30, 'b'), (0, 10, 'a'), (40, 50, 'c')])
+        self.assertEqual([(0, 10, 'a'), (20, 30, 'b'), (40, 50, 'c')],
+                         result)
+
+    def test_add_inside(self):
+        result = self._add([(0, 100, 'full'), (20, 30, 'inc')])
+        self.assertEqual([(0, 20, 'full'), (20, 30, 'inc'),
+                          (30, 100, 'full')], result)
+
+    def test_add_same_range(self):
+        result = self._add([(0, 100, 'full'), (0, 100, 'inc')])
+        self.assertEqual([(0, 100, 'inc')], result)
+
+    def test_add_spanning(self):
+        result = self._add([(0, 10, 'a'), (10, 20, 'b'), (20, 30, 'c'),
+                            (5, 25, 'd')])
+        self.assertEqual([(0, 5, 'a'), (5, 25, 'd'), (25, 30, 'c')], result)
+
+    def test_add_covering(self):
+        result = self._add([(10, 20, 'a'), (30, 40, 'b'), (0, 50, 'c')])
+        self.assertEqual([(0, 50, 'c')], result)
+
+    def test_add_adjacent(self):
+        result = self._add([(0, 10, 'a'), (20, 30, 'b'), (10, 20, 'c')])
+        self.assertEqual([(0, 10, 'a'), (10, 20, 'c'), (20, 30, 'b')],
+                         result)
+
+    def test_add_chain(self):
+        result = self._add([(0, 8, 'f1'), (8, 16, 'f2'), (16, 24, 'f3'),
+                            (4, 6, 'i1'), (12, 20, 'i1'),
+                            (14, 18, 'i2')])
+        self.assertEqual([(0, 4, 'f1'), (4, 6, 'i1'), (6, 8, 'f1'),
+                          (8, 12, 'f2'), (12, 14, 'i1'), (14, 18, 'i2'),
+                          (18, 20, 'i1'), (20, 24, 'f3')], result)
+
+
+class DedupIndexTestCase(test.TestCase):
+
+    def _index(self):
+        return chunkeddriver._DedupIndex({
+            'objects': {'obj-1': {'sha256': 'sha-1', 'compression': 'zlib',
+                                  'md5': 'md5-1', 'refs': 1},
+                        'obj-2': {'sha256': 'sha-2', 'compression': 'none',
+                                  'md5': 'md5-2', 'refs': 2}},
+            'sha256s': {'sha-1': 'obj-1', 'sha-2': 'obj-2'}})
+
+    def test_lookup(self):
+        index = self._index()
+        self.assertEqual('obj-1', index.lookup('sha-1')[0])
+        self.assertEqual((None, None), index.lookup('sha-3'))
+        index.add('obj-3', 'sha-3', 'zlib', 'md5-3')
+        self.assertEqual(('obj-3', {'sha256': 'sha-3', 'compression': 'zlib',
+                                    'md5': 'md5-3'}),
+                         index.lookup('sha-3'))
+
+    def test_claim(self):
+        index = self._index()
+        self.assertEqual('obj-1', index.claim('sha-1')[0])
+        self.assertEqual((None, None), index.claim('sha-3'))
+
+        # A chunk with the same data waits for the upload of the first one.
+        waiter = eventlet.spawn(index.claim, 'sha-3')
+        eventlet.sleep(0)
+        self.assertFalse(waiter.dead)
+        index.add('obj-3', 'sha-3', 'zlib', 'md5-3')
+        self.assertEqual('obj-3', waiter.wait()[0])
+        self.assertEqual({}, index.pending)
+        self.assertEqual(['obj-3'], index.referenced)
+
+    def test_claim_abandoned(self):
+        index = self._index()
+        self.assertEqual((None, None), index.claim('sha-3'))
+        waiter = eventlet.spawn(index.claim, 'sha-3')
+        eventlet.sleep(0)
+
+        # The upload failed, the waiting chunk has to upload the data.
+        index.abandon('sha-3')
+        self.assertEqual((None, None), waiter.wait())
+        self.assertIn('sha-3', index.pending)
+
+    def test_merge(self):
+        backup_index = chunkeddriver._DedupIndex(self._index().to_dict())
+        backup_index.add('obj-3', 'sha-3', 'zlib', 'md5-3')
+        backup_index.reference('obj-1')
+        backup_index.reference('obj-3')
+
+        index = self._index()
+        self.assertEqual([], backup_index.merge(index))
+        self.assertEqual(2, index.objects['obj-1']['refs'])
+        self.assertEqual(2, index.objects['obj-2']['refs'])
+        self.assertEqual(2, index.objects['obj-3']['refs'])
+        self.assertEqual('obj-3', index.sha256s['sha-3'])
+
+    def test_merge_missing(self):
+        backup_index = self._index()
+        backup_index.reference('obj-1')
+        index = chunkeddriver._DedupIndex()
+        self.assertEqual(['obj-1'], backup_index.merge(index))
+
+    def test_release(self):
+        index = self._index()
+        unused = index.release(['obj-1', 'obj-2', 'untracked'])
+        self.assertEqual(['obj-1'], unused)
+        self.assertEqual({'obj-2'}, set(index.objects))
+        self.assertEqual({'sha-2': 'obj-2'}, index.sha256s)
+        self.assertEqual(1, index.objects['obj-2']['refs'])
@@ -23,7 +23,7 @@ class FakeBrickLVM(object):
         return False
 
     def get_volumes(self):
-        return ['fake-volume']
+        return [{'vg': self.vg_name, 'name': 'fake-volume', 'size': '1.00'}]
 
     def get_volume(self, name):
         return ['name']
@@ -55,6 +55,9 @@ class FakeBrickLVM(object):
     def lv_has_snapshot(self, name):
         return False
 
+    def lv_get_data_percent(self, name):
+        return None
+
     def activate_lv(self, lv, is_snapshot=False, permanent=False):
         pass
 
@@ -121,22 +121,15 @@ class BrickLvmTestCase(test.TestCase):
             else:
                 data = "  fake-vg fake-1 1.00g\n"
                 data += "  fake-vg fake-2 1.00g\n"
-        elif (_lvm_prefix + 'lvdisplay, --noheading, -C, -o, Attr' in
-              cmd_string):
-            if 'test-volumes' in cmd_string:
-                data = '  wi-a-'
-            elif 'snapshot' in cmd_string:
-                data = '  swi-a-s--'
-            elif 'open' in cmd_string:
-                data = '  -wi-ao---'
-            else:
-                data = '  owi-a-'
-        elif (_lvm_prefix + 'lvdisplay, --noheading, -C, -o, Origin' in
-              cmd_string):
-            if 'snapshot' in cmd_string:
-                data = '  fake-volume-1'
-            else:
-                data = '       '
+        elif (_lvm_prefix + 'lvs, --unit=g, --nosuffix, -o, '
+              'vg_name,lv_name,lv_size,lv_attr,origin, --noheadings, '
+              '--separator, |, fake-vg' == cmd_string):
+            data = "  fake-vg|fake-1|1.00|-wi-a-----|\n"
+            data += "  fake-vg|fake-2|1.00|-wi-a-----|\n"
+            data += "  fake-vg|fake-origin|1.00|owi-a-----|\n"
+            data += "  fake-vg|fake-snapshot|1.00|swi-a-s---|fake-origin\n"
+            data += "  fake-vg|fake-open|1.00|-wi-ao----|\n"
+            data += "  fake-vg|test-volumes|1.00|-wi-a-----|\n"
         elif _lvm_prefix + 'pvs, --noheadings' in cmd_string:
             data = "  fake-vg|/dev/sda|10.00|1.00\n"
             data += "  fake-vg|/dev/sdb|10.00|1.00\n"
@@ -379,8 +372,9 @@ class BrickLvmTestCase(test.TestCase):
             m_gavg.assert_called()
 
     def test_lv_has_snapshot(self):
-        self.assertTrue(self.vg.lv_has_snapshot('fake-vg'))
+        self.assertTrue(self.vg.lv_has_snapshot('fake-origin'))
         self.assertFalse(self.vg.lv_has_snapshot('test-volumes'))
+        self.assertFalse(self.vg.lv_has_snapshot('fake-unknown'))
 
     def test_lv_is_snapshot(self):
         self.assertTrue(self.vg.lv_is_snapshot('fake-snapshot'))
@@ -391,9 +385,105 @@ class BrickLvmTestCase(test.TestCase):
         self.assertFalse(self.vg.lv_is_open('fake-snapshot'))
 
     def test_lv_get_origin(self):
-        self.assertEqual('fake-volume-1',
+        self.assertEqual('fake-origin',
                          self.vg.lv_get_origin('fake-snapshot'))
         self.assertIsNone(self.vg.lv_get_origin('test-volumes'))
+        self.assertIsNone(self.vg.lv_get_origin('fake-unknown'))
+
+    @ddt.data(('  12.50\n', 12.5), ('    \n', None))
+    @ddt.unpack
+    def test_lv_get_data_percent(self, out, expected):
+        with mock.patch.object(self.vg, '_execute',
+                               return_value=(out, '')) as mock_exec:
+            self.assertEqual(expected,
+                             self.vg.lv_get_data_percent('fake-snapshot'))
+        mock_exec.assert_called_once_with(
+            *(brick.LVM.LVM_CMD_PREFIX +
+              ['lvs', '--noheadings', '-o', 'data_percent',
+               'fake-vg/fake-snapshot']),
+            root_helper='sudo', run_as_root=True)
+
+    def test_lv_is_active(self):
+        self.assertTrue(self.vg._lv_is_active('fake-1'))
+        self.assertFalse(self.vg._lv_is_active('fake-unknown'))
+
+    def test_lv_metadata_single_lvs_call(self):
+        with mock.patch.object(self.vg, '_execute',
+                               wraps=self.vg._execute) as mock_exec:
+            self.assertEqual({'vg': 'fake-vg', 'name': 'fake-1',
+                              'size': '1.00'},
+                             self.vg.get_volume('fake-1'))
+            self.assertTrue(self.vg.lv_has_snapshot('fake-origin'))
+            self.assertTrue(self.vg.lv_is_snapshot('fake-snapshot'))
+            self.assertTrue(self.vg.lv_is_open('fake-open'))
+            self.assertEqual('fake-origin',
+                             self.vg.lv_get_origin('fake-snapshot'))
+            self.assertEqual(1, mock_exec.call_count)
+
+    def test_lv_metadata_json_report(self):
+        self.vg._supports_lvs_json_report = True
+        out = ('{"report": [{"lv": ['
+               '{"vg_name": "fake-vg", "lv_name": "fake-origin", '
+               '"lv_size": "1.00", "lv_attr": "owi-a-----", "origin": ""}, '
+               '{"vg_name": "fake-vg", "lv_name": "fake-snapshot", '
+               '"lv_size": "1.00", "lv_attr": "swi-a-s---", '
+               '"origin": "fake-origin"}]}]}')
+        with mock.patch.object(self.vg, '_execute',
+                               return_value=(out, '')) as mock_exec:
+            self.assertTrue(self.vg.lv_has_snapshot('fake-origin'))
+            self.assertIsNone(self.vg.lv_get_origin('fake-origin'))
+            self.assertEqual('fake-origin',
+                             self.vg.lv_get_origin('fake-snapshot'))
+            self.assertIsNone(self.vg.get_volume('fake-1'))
+        mock_exec.assert_called_once_with(
+            *(brick.LVM.LVM_CMD_PREFIX +
+              ['lvs', '--unit=g', '--nosuffix', '-o',
+               'vg_name,lv_name,lv_size,lv_attr,origin',
+               '--reportformat', 'json', 'fake-vg']),
+            root_helper='sudo', run_as_root=True)
+
+    @mock.patch('oslo_utils.timeutils.now')
+    def test_lv_metadata_cache_ttl(self, mock_now):
+        mock_now.return_value = 100
+        with mock.patch.object(self.vg, '_execute',
+                               wraps=self.vg._execute) as mock_exec:
+            self.vg.get_volume('fake-1')
+            mock_now.return_value = 104
+            self.vg.get_volume('fake-1')
+            self.assertEqual(1, mock_exec.call_count)
+            mock_now.return_value = 105
+            self.vg.get_volume('fake-1')
+            self.assertEqual(2, mock_exec.call_count)
+
+    def test_lv_metadata_cache_invalidated(self):
+        self.vg.get_volume('fake-1')
+        with mock.patch.object(self.vg, '_execute',
+                               wraps=self.vg._execute) as mock_exec:
+            self.vg.create_volume('fake-3', '1G')
+            self.vg.get_volume('fake-3')
+            self.vg.extend_volume('fake-1', '2G')
+            self.vg.get_volume('fake-1')
+        # lvcreate, lvs, lvextend and lvs: extend_volume looked up the
+        # origin flag of fake-1 in the listing made after the lvcreate.
+        self.assertEqual(4, mock_exec.call_count)
+
+    def test_lv_metadata_cache_invalidated_on_failure(self):
+        self.vg.get_volume('fake-1')
+        self.assertIsNotNone(self.vg._lv_cache)
+        with mock.patch.object(self.vg, '_execute',
+                               side_effect=processutils.ProcessExecutionError):
+            self.assertRaises(processutils.ProcessExecutionError,
+                              self.vg.rename_volume, 'fake-1', 'fake-3')
+        self.assertIsNone(self.vg._lv_cache)
+
+    def test_lv_metadata_racing_change_not_cached(self):
+        def query_lvs():
+            self.vg._invalidate_lv_cache()
+            return {}
+
+        with mock.patch.object(self.vg, '_query_lvs', side_effect=query_lvs):
+            self.assertIsNone(self.vg.get_volume('fake-1'))
+        self.assertIsNone(self.vg._lv_cache)
 
     def test_activate_lv(self):
         with mock.patch.object(self.vg, '_execute'):
@@ -405,6 +405,18 @@ class MigrationsMixin(test_migrations.WalkVersionsMixin):
         volume_attachment = db_utils.get_table(engine, 'volume_attachment')
         self.assertIn('connector', volume_attachment.c)
 
+    def _check_123(self, engine, data):
+        entries = db_utils.get_table(engine, 'image_volume_cache_entries')
+        indexes = {idx.name: sorted(idx.columns.keys())
+                   for idx in entries.indexes}
+        self.assertEqual(
+            ['host', 'last_used'],
+            indexes.get('image_volume_cache_entries_host_last_used_idx'))
+        self.assertEqual(
+            ['cluster_name', 'last_used'],
+            indexes.get(
+                'image_volume_cache_entries_cluster_name_last_used_idx'))
+
     def test_walk_versions(self):
         self.walk_versions(False, False)
         self.assert_each_foreign_key_is_part_of_an_index()
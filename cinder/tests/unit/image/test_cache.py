@@ -20,6 +20,7 @@ from oslo_utils import timeutils
 
 from cinder import context as ctxt
 from cinder.db.sqlalchemy import models
+from cinder import exception
 from cinder.image import cache as image_cache
 from cinder import objects
 from cinder import test
@@ -63,6 +64,16 @@ class ImageVolumeCacheTestCase(test.TestCase):
         }
         return entry
 
+    def _set_entries(self, entries):
+        self.mock_db.image_volume_cache_get_all.return_value = entries
+        self.mock_db.image_volume_cache_get_usage.return_value = (
+            len(entries), sum(entry['size'] for entry in entries))
+
+    @staticmethod
+    def _wait_for_evictions(cache):
+        if cache._eviction_worker is not None:
+            cache._eviction_worker.wait()
+
     def test_get_by_image_volume(self):
         cache = self._build_cache()
         ret = {'id': 1}
@@ -180,17 +191,22 @@ class ImageVolumeCacheTestCase(test.TestCase):
                                       entry['image_id'],
                                       image_meta)
 
-        # Expect that the cache entry is not returned and the image-volume
-        # for it is deleted.
+        # Expect that the cache entry is not returned and evicted, and the
+        # image-volume for it is deleted.
         self.assertIsNone(found_entry)
+        self.mock_db.image_volume_cache_delete.assert_called_once_with(
+            self.context, entry['volume_id'])
+        self._wait_for_evictions(cache)
         self.mock_volume_api.delete.assert_called_with(self.context,
                                                        mock_volume)
-        msg = self.notifier.notifications[0]
-        self.assertEqual('image_volume_cache.miss', msg['event_type'])
+        self.assertEqual(['image_volume_cache.evict',
+                          'image_volume_cache.miss'],
+                         [msg['event_type']
+                          for msg in self.notifier.notifications])
+        msg = self.notifier.notifications[1]
         self.assertEqual('INFO', msg['priority'])
         self.assertEqual(self.volume.host, msg['payload']['host'])
         self.assertEqual(entry['image_id'], msg['payload']['image_id'])
-        self.assertEqual(1, len(self.notifier.notifications))
 
     def test_create_cache_entry(self):
         cache = self._build_cache()
@@ -225,7 +241,7 @@ class ImageVolumeCacheTestCase(test.TestCase):
 
     def test_ensure_space_no_entries(self):
         cache = self._build_cache(max_gb=100, max_count=10)
-        self.mock_db.image_volume_cache_get_all.return_value = []
+        self._set_entries([])
 
         self.volume_ovo.size = 5
         has_space = cache.ensure_space(self.context, self.volume_ovo)
@@ -246,14 +262,17 @@ class ImageVolumeCacheTestCase(test.TestCase):
         entries.append(entry2)
         entry3 = self._build_entry(size=10)
         entries.append(entry3)
-        self.mock_db.image_volume_cache_get_all.return_value = entries
+        self._set_entries(entries)
 
         self.volume_ovo.size = 15
         has_space = cache.ensure_space(self.context, self.volume_ovo)
         self.assertTrue(has_space)
+        self._wait_for_evictions(cache)
         self.assertEqual(2, mock_delete.call_count)
         mock_delete.assert_any_call(self.context, entry2)
         mock_delete.assert_any_call(self.context, entry3)
+        self.mock_db.image_volume_cache_get_usage.assert_called_with(
+            self.context, cluster_name=self.volume_ovo.cluster_name)
         self.mock_db.image_volume_cache_get_all.assert_called_with(
             self.context, cluster_name=self.volume_ovo.cluster_name)
 
@@ -266,11 +285,12 @@ class ImageVolumeCacheTestCase(test.TestCase):
         entries.append(entry1)
         entry2 = self._build_entry(size=5)
         entries.append(entry2)
-        self.mock_db.image_volume_cache_get_all.return_value = entries
+        self._set_entries(entries)
 
         self.volume_ovo.size = 12
         has_space = cache.ensure_space(self.context, self.volume_ovo)
         self.assertTrue(has_space)
+        self._wait_for_evictions(cache)
         self.assertEqual(1, mock_delete.call_count)
         mock_delete.assert_any_call(self.context, entry2)
 
@@ -285,11 +305,12 @@ class ImageVolumeCacheTestCase(test.TestCase):
         entries.append(entry2)
         entry3 = self._build_entry(size=12)
         entries.append(entry3)
-        self.mock_db.image_volume_cache_get_all.return_value = entries
+        self._set_entries(entries)
 
         self.volume_ovo.size = 16
         has_space = cache.ensure_space(self.context, self.volume_ovo)
         self.assertTrue(has_space)
+        self._wait_for_evictions(cache)
         self.assertEqual(2, mock_delete.call_count)
         mock_delete.assert_any_call(self.context, entry2)
         mock_delete.assert_any_call(self.context, entry3)
@@ -298,10 +319,127 @@ class ImageVolumeCacheTestCase(test.TestCase):
         cache = self._build_cache(max_gb=30, max_count=10)
         mock_delete = mock.patch.object(cache, '_delete_image_volume').start()
 
-        entries = list(self._build_entry(size=25))
-        self.mock_db.image_volume_cache_get_all.return_value = entries
+        entries = [self._build_entry(size=25)]
+        self._set_entries(entries)
 
         self.volume_ovo.size = 50
         has_space = cache.ensure_space(self.context, self.volume_ovo)
         self.assertFalse(has_space)
         mock_delete.assert_not_called()
+
+    def test_ensure_space_evicts_before_deleting(self):
+        cache = self._build_cache(max_gb=30, max_count=10)
+        mock_delete = mock.patch.object(cache, '_delete_image_volume').start()
+        entry = self._build_entry(size=20)
+        self._set_entries([entry])
+
+        self.volume_ovo.size = 15
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+
+        # The image-volume is marked as evicted, the entry is removed from
+        # the cache right away, and the image-volume is deleted in the
+        # background.
+        self.mock_db.volume_admin_metadata_update.assert_called_once_with(
+            mock.ANY, entry['volume_id'],
+            {image_cache.EVICTED_KEY: 'True'}, False)
+        self.mock_db.image_volume_cache_delete.assert_called_once_with(
+            self.context, entry['volume_id'])
+        mock_delete.assert_not_called()
+        self._wait_for_evictions(cache)
+        mock_delete.assert_called_once_with(self.context, entry)
+
+    def test_ensure_space_count_evicts_before_deleting(self):
+        cache = self._build_cache(max_gb=30, max_count=1)
+        mock_delete = mock.patch.object(cache, '_delete_image_volume').start()
+        entry = self._build_entry(size=5)
+        self._set_entries([entry])
+
+        self.volume_ovo.size = 5
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+
+        self.mock_db.image_volume_cache_delete.assert_called_once_with(
+            self.context, entry['volume_id'])
+        mock_delete.assert_not_called()
+        self._wait_for_evictions(cache)
+        mock_delete.assert_called_once_with(self.context, entry)
+
+    def test_resume_evictions(self):
+        cache = self._build_cache(max_gb=30, max_count=10)
+        mock_delete = mock.patch.object(cache, '_delete_image_volume').start()
+        evicted = {image_cache.EVICTED_KEY: 'True'}
+        volumes = [
+            objects.Volume(self.context, id=fake.VOLUME_ID,
+                           status='available', admin_metadata=evicted),
+            objects.Volume(self.context, id=fake.VOLUME2_ID,
+                           status='deleting', admin_metadata=evicted),
+            objects.Volume(self.context, id=fake.VOLUME3_ID,
+                           status='available', admin_metadata={}),
+        ]
+
+        cache.resume_evictions(self.context, volumes)
+        self._wait_for_evictions(cache)
+        # Only the evicted image-volume that isn't being deleted already is
+        # deleted.
+        mock_delete.assert_called_once_with(self.context,
+                                            {'volume_id': fake.VOLUME_ID})
+
+    def test_ensure_space_deletion_failure(self):
+        cache = self._build_cache(max_gb=30, max_count=10)
+        mock_delete = mock.patch.object(
+            cache, '_delete_image_volume',
+            side_effect=[exception.InvalidVolume(reason='busy'), None]).start()
+        entry1 = self._build_entry(size=10)
+        entry2 = self._build_entry(size=20)
+        self._set_entries([entry1, entry2])
+
+        self.volume_ovo.size = 30
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+        self._wait_for_evictions(cache)
+        # The failure is logged and the next image-volume is still deleted
+        self.assertEqual([mock.call(self.context, entry2),
+                          mock.call(self.context, entry1)],
+                         mock_delete.call_args_list)
+
+    def test_ensure_space_reserves_space(self):
+        cache = self._build_cache(max_gb=30, max_count=3)
+        self._set_entries([])
+
+        self.volume_ovo.size = 20
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+        # The first entry isn't created yet, but its space is reserved
+        self.assertFalse(cache.ensure_space(self.context, self.volume_ovo))
+        self.assertEqual({self.volume_ovo.service_topic_queue: [1, 20]},
+                         cache._reserved)
+
+        cache.release_space(self.volume_ovo)
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+
+    def test_ensure_space_reserves_count(self):
+        cache = self._build_cache(max_gb=0, max_count=2)
+        mock_delete = mock.patch.object(cache, '_delete_image_volume').start()
+        entry = self._build_entry(size=1)
+        self._set_entries([entry])
+
+        self.volume_ovo.size = 1
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+        self._wait_for_evictions(cache)
+        mock_delete.assert_not_called()
+
+        # The count of the reserved entry makes room for the next one
+        self.assertTrue(cache.ensure_space(self.context, self.volume_ovo))
+        self._wait_for_evictions(cache)
+        mock_delete.assert_called_once_with(self.context, entry)
+
+    def test_ensure_space_no_space_not_reserved(self):
+        cache = self._build_cache(max_gb=30, max_count=10)
+        self._set_entries([])
+        self.mock_db.image_volume_cache_get_usage.return_value = (1, 20)
+
+        self.volume_ovo.size = 20
+        self.assertFalse(cache.ensure_space(self.context, self.volume_ovo))
+        self.assertEqual({}, cache._reserved)
+
+    def test_release_space_not_reserved(self):
+        cache = self._build_cache(max_gb=30, max_count=10)
+        cache.release_space(self.volume_ovo)
+        self.assertEqual({}, cache._reserved)
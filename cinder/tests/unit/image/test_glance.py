@@ -15,14 +15,24 @@
 
 
 import datetime
+import hashlib
 import itertools
+import re
+import tempfile
+import threading
 
 import ddt
+from glanceclient.common import http as glance_http
 import glanceclient.exc
 from keystoneauth1.loading import session as ks_session
 from keystoneauth1 import session
 import mock
 from oslo_config import cfg
+from oslo_serialization import jsonutils
+from oslo_utils import units
+import requests
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
 
 from cinder import context
 from cinder import exception
@@ -797,6 +807,23 @@ class TestGlanceImageService(test.TestCase):
         self.assertRaises(exception.ImageLimitExceeded,
                           glance_wrapper.call, 'fake_context', 'method')
 
+    def test_call_retries_controller(self):
+        glance_wrapper = glance.GlanceClientWrapper()
+        fake_client = mock.Mock()
+        fake_client.image_ranges.get.side_effect = [
+            glanceclient.exc.CommunicationError(), mock.sentinel.result]
+        self.mock_object(glance_wrapper, 'client', fake_client)
+        glance_wrapper.netloc = 'localhost:9292'
+        self.mock_object(glance.time, 'sleep')
+        self.flags(glance_num_retries=1)
+
+        self.assertEqual(mock.sentinel.result,
+                         glance_wrapper.call('fake_context', 'get', 'img',
+                                             0, 10, controller='image_ranges'))
+        self.assertEqual([mock.call('img', 0, 10)] * 2,
+                         fake_client.image_ranges.get.call_args_list)
+        fake_client.images.get.assert_not_called()
+
 
 def _create_failing_glance_client(info):
     class MyGlanceStubClient(glance_stubs.StubGlanceClient):
@@ -810,6 +837,253 @@ def _create_failing_glance_client(info):
     return MyGlanceStubClient()
 
 
+class TestGlanceSegmentedDownload(test.TestCase):
+
+    def setUp(self):
+        super(TestGlanceSegmentedDownload, self).setUp()
+        self.flags(glance_download_segments=4)
+        self.flags(glance_download_segment_size_mb=1)
+        self.context = context.RequestContext('fake', 'fake', auth_token=True)
+
+        self.data = bytes(bytearray(i % 251 for i in range(4 * units.Mi + 5)))
+        self.checksum = hashlib.md5(self.data).hexdigest()
+        self.ranges = True
+        self.truncate = False
+        self.requests = []
+
+        client = glance.GlanceClientWrapper()
+        self.mock_object(client, 'call', side_effect=self._fake_call)
+        self.service = glance.GlanceImageService(client=client)
+
+    @staticmethod
+    def _chunks(data):
+        return [data[i:i + 256 * units.Ki]
+                for i in range(0, len(data), 256 * units.Ki)]
+
+    def _fake_call(self, context, method, *args, **kwargs):
+        controller = kwargs.get('controller', 'images')
+        if controller == 'schemas':
+            return glance_stubs.FakeSchema()
+        if controller == 'image_ranges':
+            image_id, start, end = args
+            if not self.ranges:
+                self.requests.append(None)
+                return mock.Mock(status_code=200), self._chunks(self.data)
+            self.requests.append((start, end))
+            body = self.data[start:end]
+            if self.truncate and start:
+                body = body[:-1]
+            return mock.Mock(status_code=206), self._chunks(body)
+        if method == 'data':
+            self.requests.append(None)
+            return self._chunks(self.data)
+        return glance_stubs.FakeImage(
+            {'id': args[0], 'status': 'active', 'visibility': 'public',
+             'size': len(self.data), 'checksum': self.checksum})
+
+    def _download(self):
+        with tempfile.TemporaryFile() as f:
+            self.service.download(self.context, 'fake-image', f)
+            f.seek(0)
+            return f.read()
+
+    def test_download_segmented(self):
+        self.assertEqual(self.data, self._download())
+        self.assertEqual([(0, units.Mi + 2),
+                          (units.Mi + 2, 2 * units.Mi + 4),
+                          (2 * units.Mi + 4, 3 * units.Mi + 6),
+                          (3 * units.Mi + 6, 4 * units.Mi + 5)],
+                         sorted(self.requests))
+
+    def test_download_segment_size(self):
+        self.flags(glance_download_segment_size_mb=2)
+        self.assertEqual(self.data, self._download())
+        self.assertEqual(2, len(self.requests))
+
+    def test_download_small_image(self):
+        self.data = self.data[:units.Mi]
+        self.checksum = hashlib.md5(self.data).hexdigest()
+        self.assertEqual(self.data, self._download())
+        self.assertEqual([None], self.requests)
+
+    @mock.patch.object(glance.LOG, 'warning')
+    def test_download_range_not_supported(self, mock_warning):
+        self.ranges = False
+        self.assertEqual(self.data, self._download())
+        self.assertEqual([None], self.requests)
+        self.assertEqual(1, mock_warning.call_count)
+
+    def test_download_checksum_mismatch(self):
+        self.checksum = 'wrong'
+        self.assertRaises(exception.ImageUnacceptable, self._download)
+
+    def test_download_truncated_segment(self):
+        self.truncate = True
+        self.assertRaises(exception.ImageUnacceptable, self._download)
+
+    def test_download_to_stream(self):
+        writer = mock.Mock(spec=['write'])
+        self.service.download(self.context, 'fake-image', writer)
+        self.assertEqual(self.data, b''.join(
+            call[0][0] for call in writer.write.call_args_list))
+        self.assertEqual([None], self.requests)
+
+
+class _GlanceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stand-in for the Glance API serving the metadata and data of images."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/v2/schemas/image':
+            properties = {key: {} for key in ('id', 'status', 'visibility',
+                                              'size', 'checksum')}
+            self._send(200, jsonutils.dump_as_bytes(
+                {'name': 'image', 'properties': properties}),
+                'application/json')
+        elif self.path == '/v2/images/%s' % server.image_id:
+            self._send(200, jsonutils.dump_as_bytes(
+                {'id': server.image_id, 'status': 'active',
+                 'visibility': 'public', 'size': len(server.data),
+                 'checksum': server.checksum}), 'application/json')
+        elif self.path == '/v2/images/%s/file' % server.image_id:
+            self._send_data()
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def _send_data(self):
+        server = self.server
+        data = server.data
+        range_header = self.headers.get('Range')
+        server.ranges.append(range_header)
+        match = re.match(r'bytes=(\d+)-(\d+)$', range_header or '')
+        if not match:
+            self._send(200, data, 'application/octet-stream')
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        self._send(206, data[start:end + 1], 'application/octet-stream',
+                   {'Content-Range': 'bytes %d-%d/%d' % (start, end,
+                                                         len(data))})
+
+
+class _GlanceServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestGlanceSegmentedDownloadServer(test.TestCase):
+    """Download segments from a local stand-in for the Glance API."""
+
+    def setUp(self):
+        super(TestGlanceSegmentedDownloadServer, self).setUp()
+        self.flags(auth_strategy='noauth')
+        self.flags(glance_download_segments=4)
+        self.flags(glance_download_segment_size_mb=1)
+        self.context = context.RequestContext('fake', 'fake', auth_token=True)
+
+        self.server = _GlanceServer(('127.0.0.1', 0), _GlanceHandler)
+        self.server.image_id = 'fake-image'
+        self.server.data = bytes(bytearray(
+            i % 251 for i in range(4 * units.Mi + 5)))
+        self.server.checksum = hashlib.md5(self.server.data).hexdigest()
+        self.server.ranges = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        client = glance.GlanceClientWrapper(
+            self.context, '127.0.0.1:%d' % self.server.server_address[1])
+        self.service = glance.GlanceImageService(client=client)
+
+    def test_download_segmented(self):
+        with tempfile.TemporaryFile() as f:
+            self.service.download(self.context, 'fake-image', f)
+            f.seek(0)
+            self.assertEqual(self.server.data, f.read())
+        # The Range headers reach the server without being encoded
+        self.assertEqual(['bytes=%d-%d' % (start, end) for start, end in
+                          ((0, units.Mi + 1),
+                           (units.Mi + 2, 2 * units.Mi + 3),
+                           (2 * units.Mi + 4, 3 * units.Mi + 5),
+                           (3 * units.Mi + 6, 4 * units.Mi + 4))],
+                         sorted(self.server.ranges))
+
+
+class TestImageRangeController(test.TestCase):
+
+    def _controller(self, http_client):
+        return glance._ImageRangeController(
+            mock.Mock(http_client=http_client))
+
+    def test_get_http_client(self):
+        http_client = glance_http.HTTPClient(
+            'http://fake_host:9292/', token='fake-token',
+            global_request_id='req-fake')
+        resp = mock.Mock(ok=True, status_code=206)
+        resp.iter_content.return_value = iter([b'abc', b'def'])
+        self.mock_object(http_client.session, 'get', return_value=resp)
+
+        result, body = self._controller(http_client).get('fake-image', 4, 10)
+
+        self.assertIs(resp, result)
+        self.assertEqual([b'abc', b'def'], list(body))
+        resp.close.assert_called_once_with()
+        http_client.session.get.assert_called_once_with(
+            'http://fake_host:9292/v2/images/fake-image/file',
+            headers={'Range': 'bytes=4-9',
+                     'X-Auth-Token': 'fake-token',
+                     'X-OpenStack-Request-ID': 'req-fake'},
+            stream=True, timeout=http_client.timeout)
+
+    def test_get_session_client(self):
+        ks_sess = mock.Mock(spec=session.Session)
+        http_client = glance_http.SessionClient(
+            ks_sess, auth=mock.sentinel.auth,
+            endpoint_override='http://fake_host:9292')
+        ks_sess.request.return_value = mock.Mock(ok=True, status_code=206)
+
+        resp, body = self._controller(http_client).get('fake-image', 0, 10)
+
+        self.assertIs(ks_sess.request.return_value, resp)
+        args, kwargs = ks_sess.request.call_args
+        self.assertEqual(('/v2/images/fake-image/file', 'GET'), args)
+        self.assertEqual({'Range': 'bytes=0-9'}, kwargs['headers'])
+        self.assertTrue(kwargs['stream'])
+        self.assertFalse(kwargs['raise_exc'])
+        self.assertEqual(mock.sentinel.auth, kwargs['auth'])
+
+    def test_get_error(self):
+        http_client = glance_http.HTTPClient('http://fake_host:9292')
+        resp = mock.Mock(ok=False, status_code=404, content=b'',
+                         headers={})
+        self.mock_object(http_client.session, 'get', return_value=resp)
+
+        self.assertRaises(glanceclient.exc.HTTPNotFound,
+                          self._controller(http_client).get,
+                          'fake-image', 0, 10)
+
+    def test_get_connection_error(self):
+        http_client = glance_http.HTTPClient('http://fake_host:9292')
+        self.mock_object(http_client.session, 'get',
+                         side_effect=requests.exceptions.ConnectionError)
+
+        self.assertRaises(glanceclient.exc.CommunicationError,
+                          self._controller(http_client).get,
+                          'fake-image', 0, 10)
+
+
 class TestGlanceImageServiceClient(test.TestCase):
 
     def setUp(self):
@@ -0,0 +1,148 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fcntl
+import hashlib
+import os
+
+import fixtures
+import mock
+from oslo_utils import units
+
+from cinder.image import local_cache
+from cinder import test
+
+
+class LocalImageCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(LocalImageCacheTestCase, self).setUp()
+        self.conversion_dir = self.useFixture(fixtures.TempDir()).path
+        self.override_config('image_conversion_dir', self.conversion_dir)
+        self.override_config('image_conversion_cache_enabled', True)
+        self.cache = local_cache.LocalImageCache.from_config()
+
+    def _add(self, image_id, checksum='sum', data=b'x' * 4096, mtime=None):
+        with self.cache.add(image_id, checksum) as part:
+            with open(part, 'wb') as f:
+                f.write(data)
+        path = self.cache._image_path(image_id, checksum)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _cached_images(self):
+        return sorted(name for name in os.listdir(self.cache.path)
+                      if not name.startswith('.'))
+
+    def test_from_config(self):
+        self.assertEqual(os.path.join(self.conversion_dir, 'cache'),
+                         self.cache.path)
+        self.assertEqual(10 * units.Gi, self.cache.max_size)
+        self.assertEqual(0, self.cache.max_count)
+
+        self.override_config('image_conversion_cache_enabled', False)
+        self.assertIsNone(local_cache.LocalImageCache.from_config())
+
+    def test_add_and_get(self):
+        with self.cache.get('image-1', 'sum') as cached:
+            self.assertIsNone(cached)
+
+        path = self._add('image-1', data=b'data')
+
+        with self.cache.get('image-1', 'sum') as cached:
+            self.assertEqual(path, cached)
+            with open(cached, 'rb') as f:
+                self.assertEqual(b'data', f.read())
+        self.assertEqual(4, self.cache.get_size('image-1', 'sum'))
+        # Images are cached by checksum
+        self.assertIsNone(self.cache.get_size('image-1', 'other'))
+
+    def test_add_failed(self):
+        def add():
+            with self.cache.add('image-1', 'sum') as part:
+                with open(part, 'wb') as f:
+                    f.write(b'partial')
+                raise ValueError()
+
+        self.assertRaises(ValueError, add)
+        self.assertEqual([], self._cached_images())
+
+    def test_get_updates_last_use(self):
+        path = self._add('image-1', mtime=1000)
+        with self.cache.get('image-1', 'sum'):
+            pass
+        self.assertGreater(os.stat(path).st_mtime, 1000)
+
+    def test_evict_count(self):
+        self.cache.max_count = 2
+        self._add('image-1', mtime=1000)
+        self._add('image-2', mtime=2000)
+        self._add('image-3')
+
+        self.assertIsNone(self.cache.get_size('image-1', 'sum'))
+        self.assertIsNotNone(self.cache.get_size('image-2', 'sum'))
+        self.assertIsNotNone(self.cache.get_size('image-3', 'sum'))
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_count = 2
+        self._add('image-1', mtime=1000)
+        self._add('image-2', mtime=2000)
+        with self.cache.get('image-1', 'sum'):
+            pass
+        self._add('image-3')
+
+        self.assertIsNotNone(self.cache.get_size('image-1', 'sum'))
+        self.assertIsNone(self.cache.get_size('image-2', 'sum'))
+
+    @mock.patch.object(local_cache.LocalImageCache, '_images')
+    def test_evict_size(self, mock_images):
+        self.cache.max_size = 3 * units.Gi
+        mock_images.return_value = [('/cache/a.raw', 1000, 2 * units.Gi),
+                                    ('/cache/b.raw', 3000, units.Gi),
+                                    ('/cache/c.raw', 2000, units.Gi)]
+        with mock.patch.object(self.cache, '_remove_unused',
+                               return_value=True) as mock_remove:
+            self.cache._evict(keep='/cache/b.raw')
+        mock_remove.assert_called_once_with('/cache/a.raw')
+
+    def test_evict_skips_images_in_use(self):
+        self.cache.max_count = 1
+        self._add('image-1', mtime=1000)
+        with self.cache.get('image-1', 'sum') as cached:
+            self._add('image-2')
+            self.assertTrue(os.path.exists(cached))
+        self.assertEqual(2, len(self._cached_images()))
+
+    def test_reconcile(self):
+        self._add('image-1', mtime=1000)
+        self._add('image-2', mtime=2000)
+        stale_part = os.path.join(self.cache.path, 'image-sum-xyz.part')
+        open(stale_part, 'w').close()
+        busy_part = os.path.join(self.cache.path, 'image-sum-abc.part')
+        open(busy_part, 'w').close()
+
+        self.cache.max_count = 1
+        with open(busy_part) as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.cache.reconcile()
+
+        self.assertEqual(['image-2-sum.raw', 'image-sum-abc.part'],
+                         self._cached_images())
+
+    def test_checksum_matches(self):
+        path = os.path.join(self.conversion_dir, 'image')
+        with open(path, 'wb') as f:
+            f.write(b'image data')
+        checksum = hashlib.md5(b'image data').hexdigest()
+        self.assertTrue(local_cache.checksum_matches(path, checksum))
+        self.assertFalse(local_cache.checksum_matches(path, 'other'))
@@ -377,3 +377,35 @@ class TestCleanable(test_objects.BaseObjectsTestCase):
             status='cleanable',
             orm_worker=worker)
         self.assertEqual(worker, backup3.worker)
+
+    @mock.patch('cinder.db.worker_update', autospec=True)
+    @mock.patch('cinder.db.worker_get', autospec=True)
+    def test_set_workers_list_argument(self, mock_get, mock_update):
+        """Test set workers decorator with a list of objects."""
+        @Backup.set_workers
+        def my_function(arg1, arg2):
+            return arg1, arg2
+
+        service.Service.service_id = mock.sentinel.service_id
+        mock_get.return_value.cleaning = False
+        backup = Backup(_context=self.context, status='cleanable',
+                        id=mock.sentinel.id)
+        backup2 = Backup(_context=self.context, status='non-cleanable',
+                         id=mock.sentinel.id2)
+        backup3 = Backup(_context=self.context, status='cleanable',
+                         id=mock.sentinel.id3)
+
+        res = my_function(mock.sentinel.arg1, [backup, backup2, backup3])
+        self.assertEqual((mock.sentinel.arg1, [backup, backup2, backup3]),
+                         res)
+
+        # Every cleanable object of the list gets a worker entry
+        self.assertEqual(
+            [mock.call(self.context, resource_type='Backup',
+                       resource_id=mock.sentinel.id),
+             mock.call(self.context, resource_type='Backup',
+                       resource_id=mock.sentinel.id3)],
+            mock_get.call_args_list)
+        self.assertEqual(2, mock_update.call_count)
+        self.assertEqual(mock_get.return_value, backup.worker)
+        self.assertEqual(mock_get.return_value, backup3.worker)
@@ -105,6 +105,88 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
                           sched.schedule_create_volume, fake_context,
                           request_spec, {})
 
+    def _get_volumes_request_specs(self, count, size):
+        return [objects.RequestSpec.from_primitives(
+            {'volume_properties': {'project_id': 1, 'size': size},
+             'volume_type': {'name': 'LVM_iSCSI'},
+             'volume_id': 'volume%s' % i}) for i in range(count)]
+
+    @mock.patch('cinder.db.service_get_all')
+    def test_schedule_volumes(self, _mock_service_get_all):
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager = fakes.FakeHostManager()
+        fake_context = context.RequestContext('user', 'project',
+                                              is_admin=True)
+        fakes.mock_host_manager_db_calls(_mock_service_get_all)
+        request_spec_list = self._get_volumes_request_specs(6, 300)
+        filter_properties_list = [{} for _rs in request_spec_list]
+
+        with mock.patch.object(sched, '_get_weighted_candidates',
+                               wraps=sched._get_weighted_candidates) as get:
+            backends = sched._schedule_volumes(fake_context,
+                                               request_spec_list,
+                                               filter_properties_list)
+
+        # Volumes are placed on host1 until it runs out of space.
+        self.assertEqual(['host1#lvm1'] * 3 + ['host5#_pool0'] * 3,
+                         [backend.backend_id for backend in backends])
+        get.assert_called_once_with(fake_context, request_spec_list[0],
+                                    filter_properties_list[0])
+        for request_spec, filter_properties in zip(request_spec_list,
+                                                   filter_properties_list):
+            self.assertEqual(1, filter_properties['retry']['num_attempts'])
+            self.assertEqual(request_spec.volume_id,
+                             filter_properties['request_spec']['volume_id'])
+            self.assertEqual(300, filter_properties['size'])
+
+    def test_schedule_volumes_no_hosts(self):
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project')
+        request_spec_list = self._get_volumes_request_specs(2, 1)
+
+        backends = sched._schedule_volumes(fake_context, request_spec_list,
+                                           [{}, {}])
+
+        self.assertEqual([None, None], backends)
+
+    @mock.patch('cinder.scheduler.driver.volume_update_db')
+    @mock.patch('cinder.db.service_get_all')
+    def test_schedule_create_volumes(self, _mock_service_get_all,
+                                     _mock_volume_update_db):
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager = fakes.FakeHostManager()
+        fake_context = context.RequestContext('user', 'project',
+                                              is_admin=True)
+        fakes.mock_host_manager_db_calls(_mock_service_get_all)
+        request_spec_list = self._get_volumes_request_specs(3, 1)
+        filter_properties_list = [{}, {}, {}]
+        _mock_volume_update_db.side_effect = [
+            mock.sentinel.volume0, exception.VolumeNotFound(volume_id='1'),
+            mock.sentinel.volume2]
+        self.mock_object(sched.host_manager,
+                         'revert_volume_consumed_capacity')
+
+        with mock.patch.object(sched.volume_rpcapi,
+                               'create_volume') as create_mock:
+            backends = sched.schedule_create_volumes(fake_context,
+                                                     request_spec_list,
+                                                     filter_properties_list)
+
+        self.assertEqual(['host2#lvm2', None, 'host2#lvm2'], backends)
+        self.assertEqual(
+            [mock.call(fake_context, mock.sentinel.volume0,
+                       request_spec_list[0], filter_properties_list[0],
+                       allow_reschedule=True),
+             mock.call(fake_context, mock.sentinel.volume2,
+                       request_spec_list[2], filter_properties_list[2],
+                       allow_reschedule=True)],
+            create_mock.call_args_list)
+        sched.host_manager.revert_volume_consumed_capacity\
+            .assert_called_once_with('host2#lvm2', 1)
+        self.assertNotIn('context', filter_properties_list[0])
+        self.assertEqual(['host2#lvm2'],
+                         filter_properties_list[0]['retry']['backends'])
+
     def test_create_volume_no_hosts_invalid_req(self):
         sched = fakes.FakeFilterScheduler()
 
@@ -145,6 +145,73 @@ class HostManagerTestCase(test.TestCase):
                     'host3': host3_volume_capabs}
         self.assertDictEqual(expected, service_states)
 
+    def test_update_service_capabilities_delta(self):
+        pool1 = {'pool_name': 'pool1', 'free_capacity_gb': 10}
+        pool2 = {'pool_name': 'pool2', 'free_capacity_gb': 20}
+        capabs = {'volume_backend_name': 'lvm', 'total_volumes': 1,
+                  'pools': [pool1, pool2]}
+        timestamp = datetime.utcnow()
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', capabs, None, timestamp,
+            seq=['generation', 1]))
+
+        new_pool2 = {'pool_name': 'pool2', 'free_capacity_gb': 15}
+        pool3 = {'pool_name': 'pool3', 'free_capacity_gb': 30}
+        delta = {'updated': {'total_volumes': 2}, 'removed': [],
+                 'pools': {'pool2': new_pool2, 'pool3': pool3},
+                 'removed_pools': ['pool1']}
+        timestamp = timestamp + timedelta(seconds=60)
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timestamp,
+            seq=['generation', 2], delta=True))
+
+        expected = {'volume_backend_name': 'lvm', 'total_volumes': 2,
+                    'pools': [new_pool2, pool3], 'timestamp': timestamp}
+        self.assertDictEqual({'host1': expected},
+                             self.host_manager.service_states)
+
+    def test_update_service_capabilities_delta_missed(self):
+        capabs = {'volume_backend_name': 'lvm', 'total_volumes': 1}
+        delta = {'updated': {'total_volumes': 2}, 'removed': [],
+                 'pools': {}, 'removed_pools': []}
+        timestamp = datetime.utcnow()
+        # Nothing to apply the delta to
+        self.assertFalse(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timestamp,
+            seq=['generation', 2], delta=True))
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', capabs, None, timestamp,
+            seq=['generation', 2]))
+        # A report was lost
+        self.assertFalse(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timestamp,
+            seq=['generation', 4], delta=True))
+        # The service was restarted
+        self.assertFalse(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timestamp,
+            seq=['new_generation', 3], delta=True))
+        self.assertEqual(capabs['total_volumes'],
+                         self.host_manager.service_states['host1'][
+                             'total_volumes'])
+
+    def test_update_service_capabilities_delta_cluster(self):
+        timestamp = datetime.utcnow()
+        for host, free in (('host1', 10), ('host2', 20)):
+            self.host_manager.update_service_capabilities(
+                'volume', host, {'free_capacity_gb': free}, 'cluster1',
+                timestamp, seq=[host, 1])
+
+        # Each host's delta applies to its own previous report
+        delta = {'updated': {'total_volumes': 3}, 'removed': [],
+                 'pools': {}, 'removed_pools': []}
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, 'cluster1', timestamp,
+            seq=['host1', 2], delta=True))
+
+        self.assertDictEqual({'free_capacity_gb': 10, 'total_volumes': 3,
+                              'timestamp': timestamp},
+                             self.host_manager.service_states['cluster1'])
+
     @mock.patch(
         'cinder.scheduler.host_manager.HostManager.get_usage_and_notify')
     @mock.patch('oslo_utils.timeutils.utcnow')
@@ -757,6 +824,63 @@ class HostManagerTestCase(test.TestCase):
             test_service.TestService._compare(self, volume_node,
                                               backend_state_map[host].service)
 
+    @mock.patch('cinder.db.service_get_all')
+    @mock.patch('cinder.objects.service.Service.is_up',
+                new_callable=mock.PropertyMock)
+    def test_get_all_backend_states_refresh_interval(self,
+                                                     _mock_service_is_up,
+                                                     _mock_service_get_all):
+        self.flags(scheduler_service_refresh_interval=60)
+        context = 'fake_context'
+        services = [
+            dict(id=1, host='host1', topic='volume', disabled=False,
+                 availability_zone='zone1', updated_at=timeutils.utcnow(),
+                 uuid='a3a593da-7f8d-4bb7-8b4c-f2bc1e0b4824'),
+        ]
+        _mock_service_get_all.return_value = services
+        _mock_service_is_up.return_value = True
+        self.host_manager.update_service_capabilities(
+            'volume', 'host1', {'free_capacity_gb': 100}, None,
+            datetime.utcnow())
+
+        res = self.host_manager.get_all_backend_states(context)
+        self.assertEqual([100], [state.free_capacity_gb for state in res])
+        _mock_service_get_all.assert_called_once_with(
+            context, disabled=False, frozen=False,
+            topic=constants.VOLUME_TOPIC)
+
+        # Capability reports from known services update the backend states
+        # without reading the services again.
+        self.host_manager.update_service_capabilities(
+            'volume', 'host1', {'free_capacity_gb': 200}, None,
+            datetime.utcnow())
+        res = self.host_manager.get_all_backend_states(context)
+        self.assertEqual([200], [state.free_capacity_gb for state in res])
+        res = self.host_manager.get_all_backend_states(context)
+        self.assertEqual([200], [state.free_capacity_gb for state in res])
+        self.assertEqual(1, _mock_service_get_all.call_count)
+
+        # A report from an unknown service rereads the services.
+        services.append(
+            dict(id=2, host='host2', topic='volume', disabled=False,
+                 availability_zone='zone1', updated_at=timeutils.utcnow(),
+                 uuid='4200b32b-0bf9-436c-86b2-0675f6ac218e'))
+        self.host_manager.update_service_capabilities(
+            'volume', 'host2', {'free_capacity_gb': 300}, None,
+            datetime.utcnow())
+        res = self.host_manager.get_all_backend_states(context)
+        self.assertEqual([200, 300],
+                         sorted(state.free_capacity_gb for state in res))
+        self.assertEqual(2, _mock_service_get_all.call_count)
+
+        # Once the services are older than the interval they are reread.
+        del services[0]
+        with mock.patch.object(self.host_manager._services_watch, 'expired',
+                               return_value=True):
+            res = self.host_manager.get_all_backend_states(context)
+        self.assertEqual([300], [state.free_capacity_gb for state in res])
+        self.assertEqual(3, _mock_service_get_all.call_count)
+
     @mock.patch('cinder.db.service_get_all')
     @mock.patch('cinder.objects.service.Service.is_up',
                 new_callable=mock.PropertyMock)
@@ -62,6 +62,44 @@ class SchedulerRPCAPITestCase(test.RPCAPITestCase):
                            timestamp='123')
         can_send_version.assert_called_once_with('3.3')
 
+    @ddt.data(None, {'updated': {}, 'removed': [], 'pools': {},
+                     'removed_pools': []})
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                return_value=True)
+    def test_update_service_capabilities_seq(self, delta, can_send_version):
+        expected_kwargs_diff = {'delta': delta is not None}
+        if delta is not None:
+            expected_kwargs_diff['capabilities'] = delta
+        self._test_rpc_api('update_service_capabilities',
+                           rpc_method='cast',
+                           service_name='fake_name',
+                           host='fake_host',
+                           cluster_name='cluster_name',
+                           capabilities={'free_capacity_gb': 1},
+                           fanout=True,
+                           version='3.13',
+                           timestamp='123',
+                           seq=['fake_generation', 2],
+                           delta=delta,
+                           expected_kwargs_diff=expected_kwargs_diff)
+
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                side_effect=lambda x: x == '3.3')
+    def test_update_service_capabilities_seq_old_scheduler(
+            self, can_send_version):
+        self._test_rpc_api('update_service_capabilities',
+                           rpc_method='cast',
+                           service_name='fake_name',
+                           host='fake_host',
+                           cluster_name='cluster_name',
+                           capabilities={'free_capacity_gb': 1},
+                           fanout=True,
+                           version='3.3',
+                           timestamp='123',
+                           seq=['fake_generation', 2],
+                           delta={'updated': {}, 'removed': [], 'pools': {},
+                                  'removed_pools': []})
+
     @ddt.data('3.0', '3.10')
     @mock.patch('oslo_messaging.RPCClient.can_send_version')
     def test_create_volume(self, version, can_send_version):
@@ -79,6 +117,30 @@ class SchedulerRPCAPITestCase(test.RPCAPITestCase):
         create_worker_mock.assert_called_once()
         can_send_version.assert_called_once_with('3.10')
 
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                return_value=True)
+    def test_create_volumes(self, can_send_version_mock):
+        create_worker_mock = self.mock_object(self.fake_volume,
+                                              'create_worker')
+        self._test_rpc_api('create_volumes',
+                           rpc_method='cast',
+                           volumes=[self.fake_volume],
+                           request_spec_list=[self.fake_rs_obj],
+                           filter_properties_list=[self.fake_fp_dict])
+        create_worker_mock.assert_called_once_with()
+
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                return_value=False)
+    def test_create_volumes_capped(self, can_send_version_mock):
+        self.assertRaises(exception.ServiceTooOld,
+                          self._test_rpc_api,
+                          'create_volumes',
+                          rpc_method='cast',
+                          volumes=[self.fake_volume],
+                          request_spec_list=[self.fake_rs_obj],
+                          filter_properties_list=[self.fake_fp_dict],
+                          version='3.11')
+
     @mock.patch('oslo_messaging.RPCClient.can_send_version',
                 return_value=True)
     def test_create_snapshot(self, can_send_version_mock):
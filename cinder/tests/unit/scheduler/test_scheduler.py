@@ -183,7 +183,8 @@ class SchedulerManagerTestCase(test.TestCase):
         self.manager.update_service_capabilities(self.context,
                                                  service_name=service,
                                                  host=host)
-        _mock_update_cap.assert_called_once_with(service, host, {}, None, None)
+        _mock_update_cap.assert_called_once_with(service, host, {}, None, None,
+                                                 seq=None, delta=False)
 
     @mock.patch('cinder.scheduler.driver.Scheduler.'
                 'update_service_capabilities')
@@ -198,7 +199,22 @@ class SchedulerManagerTestCase(test.TestCase):
                                                  host=host,
                                                  capabilities=capabilities)
         _mock_update_cap.assert_called_once_with(service, host, capabilities,
-                                                 None, None)
+                                                 None, None, seq=None,
+                                                 delta=False)
+
+    @mock.patch('cinder.volume.rpcapi.VolumeAPI.publish_service_capabilities')
+    @mock.patch('cinder.scheduler.driver.Scheduler.'
+                'update_service_capabilities', return_value=False)
+    def test_update_service_capabilities_missed(self, _mock_update_cap,
+                                                publish_capabilities_mock):
+        # Test a delta we cannot apply requests the full capabilities
+        self.manager.update_service_capabilities(
+            self.context, service_name='volume', host='fake_host',
+            capabilities={'updated': {}, 'removed': [], 'pools': {},
+                          'removed_pools': []},
+            seq=['fake_generation', 3], delta=True)
+        publish_capabilities_mock.assert_called_once_with(self.context,
+                                                          'fake_host')
 
     @mock.patch('cinder.scheduler.driver.Scheduler.'
                 'notify_service_capabilities')
@@ -264,6 +280,76 @@ class SchedulerManagerTestCase(test.TestCase):
             resource_uuid=volume.id,
             exception=mock.ANY)
 
+    @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volumes')
+    @mock.patch('cinder.message.api.API.create')
+    @mock.patch('cinder.db.volume_update')
+    def test_create_volumes(self, _mock_volume_update, _mock_message_create,
+                            _mock_sched_create):
+        # Volumes that could not be placed are set to error.
+        volumes = [fake_volume.fake_volume_obj(self.context, id=volume_id)
+                   for volume_id in (fake.VOLUME_ID, fake.VOLUME2_ID)]
+        request_spec_list = [
+            objects.RequestSpec.from_primitives({'volume_id': volume.id})
+            for volume in volumes]
+        _mock_sched_create.return_value = ['host1#pool', None]
+
+        backends = self.manager.create_volumes(self.context, volumes,
+                                               request_spec_list,
+                                               [None, {'size': 1}])
+
+        self.assertEqual(['host1#pool', None], backends)
+        _mock_sched_create.assert_called_once_with(
+            self.context, request_spec_list, [{}, {'size': 1}])
+        _mock_volume_update.assert_called_once_with(self.context,
+                                                    fake.VOLUME2_ID,
+                                                    {'status': 'error'})
+        _mock_message_create.assert_called_once_with(
+            self.context, message_field.Action.SCHEDULE_ALLOCATE_VOLUME,
+            resource_uuid=fake.VOLUME2_ID,
+            exception=mock.ANY)
+        # The placements are notified, since the API doesn't get them back
+        msg = self.notifier.notifications[-1]
+        self.assertEqual('scheduler.create_volumes', msg['event_type'])
+        self.assertEqual({'placements': [
+            {'volume_id': fake.VOLUME_ID, 'backend': 'host1#pool'},
+            {'volume_id': fake.VOLUME2_ID, 'backend': None}]},
+            msg['payload'])
+
+    @mock.patch('cinder.objects.Volume.unset_worker')
+    @mock.patch('cinder.objects.Volume.set_worker')
+    @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volumes')
+    def test_create_volumes_set_workers(self, _mock_sched_create,
+                                        mock_set_worker, mock_unset_worker):
+        volumes = [fake_volume.fake_volume_obj(self.context, id=volume_id,
+                                               status='creating')
+                   for volume_id in (fake.VOLUME_ID, fake.VOLUME2_ID)]
+        _mock_sched_create.return_value = ['host1#pool', 'host2#pool']
+
+        self.manager.create_volumes(self.context, volumes, [{}, {}],
+                                    [{}, {}])
+
+        # Every volume of the batch has a worker entry, which is kept for
+        # the volume service since the volumes are still being created.
+        self.assertEqual(2, mock_set_worker.call_count)
+        mock_unset_worker.assert_not_called()
+
+    @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volumes')
+    @mock.patch('cinder.message.api.API.create')
+    @mock.patch('cinder.db.volume_update')
+    def test_create_volumes_exception(self, _mock_volume_update,
+                                      _mock_message_create,
+                                      _mock_sched_create):
+        volumes = [fake_volume.fake_volume_obj(self.context, id=volume_id)
+                   for volume_id in (fake.VOLUME_ID, fake.VOLUME2_ID)]
+        _mock_sched_create.side_effect = exception.CinderException()
+
+        backends = self.manager.create_volumes(self.context, volumes,
+                                               [{}, {}], [{}, {}])
+
+        self.assertEqual([None, None], backends)
+        self.assertEqual(2, _mock_volume_update.call_count)
+        self.assertEqual(2, _mock_message_create.call_count)
+
     @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volume')
     @mock.patch('eventlet.sleep')
     def test_create_volume_no_delay(self, _mock_sleep, _mock_sched_create):
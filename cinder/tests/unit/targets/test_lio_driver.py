@@ -10,6 +10,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import mock
 from oslo_concurrency import processutils as putils
 
@@ -40,6 +41,128 @@ class TestLioAdmDriver(tf.TargetDriverFixture):
         mlock_exec.assert_called_once_with(*expected_args, run_as_root=True)
         mexecute.assert_called_once_with(*expected_args, run_as_root=True)
 
+    @mock.patch.object(lio.LioAdm, '_execute')
+    def test_get_target_cached(self, mlock_exec):
+        mlock_exec.return_value = (self.test_vol + '\n', None)
+        self.assertEqual(self.test_vol, self.target._get_target(self.test_vol))
+        self.assertIsNone(self.target._get_target('iqn.2010-10.org.other'))
+        mlock_exec.assert_called_once_with('cinder-rtstool', 'get-targets',
+                                           run_as_root=True)
+
+    @mock.patch.object(lio.LioAdm, '_execute')
+    def test_targets_view_updated(self, mlock_exec):
+        iqn = self.iscsi_target_prefix + self.testvol['name']
+        targets = []
+
+        def execute(*args, **kwargs):
+            if args[1] == 'create':
+                targets.append(iqn)
+            elif args[1] == 'delete':
+                targets.remove(iqn)
+            elif args[1] == 'get-targets':
+                return '\n'.join(targets), ''
+            return '', ''
+
+        mlock_exec.side_effect = execute
+        get_targets = mock.call('cinder-rtstool', 'get-targets',
+                                run_as_root=True)
+        self.assertEqual(set(), self.target._get_targets())
+
+        self.target.create_iscsi_target(iqn, 0, 0, self.fake_volumes_dir)
+        self.assertEqual({iqn}, self.target._get_targets())
+        self.target.remove_iscsi_target(0, 0, self.testvol['id'],
+                                        self.testvol['name'])
+        self.assertEqual(set(), self.target._get_targets())
+        # The targets are only loaded once
+        self.assertEqual(1, mlock_exec.call_args_list.count(get_targets))
+
+    @mock.patch.object(lio.LioAdm, '_persist_configuration')
+    @mock.patch.object(lio.LioAdm, '_execute', return_value=('', ''))
+    def test_create_iscsi_target_missing(self, mlock_exec, mpersist_cfg):
+        iqn = self.iscsi_target_prefix + self.testvol['name']
+
+        # The targets are loaded after the creation and the new one is
+        # missing.
+        self.assertRaises(exception.NotFound,
+                          self.target.create_iscsi_target,
+                          iqn, 0, 0, self.fake_volumes_dir)
+        self.assertEqual(set(), self.target._get_targets())
+        self.assertFalse(mpersist_cfg.called)
+
+    @mock.patch.object(lio.LioAdm, '_execute')
+    def test_persist_configuration(self, mlock_exec):
+        self.target._persist_configuration(self.fake_volume_id)
+        mlock_exec.assert_called_once_with('cinder-rtstool', 'save',
+                                           run_as_root=True)
+
+    @mock.patch('eventlet.spawn_after')
+    @mock.patch.object(lio.LioAdm, '_execute')
+    def test_persist_configuration_delayed(self, mlock_exec,
+                                           mock_spawn_after):
+        self.target._persist_delay = 5
+
+        for _i in range(3):
+            self.target._persist_configuration(self.fake_volume_id)
+
+        # All changes are saved together once the delay has passed
+        mlock_exec.assert_not_called()
+        mock_spawn_after.assert_called_once_with(
+            5, self.target._save_pending_configuration)
+        self.target._save_pending_configuration()
+        mlock_exec.assert_called_once_with('cinder-rtstool', 'save',
+                                           run_as_root=True)
+
+        # A new change schedules a new save
+        self.target._persist_configuration(self.fake_volume_id)
+        self.assertEqual(2, mock_spawn_after.call_count)
+
+    @mock.patch.object(lio.LioAdm, '_execute')
+    def test_persist_configuration_wait(self, mlock_exec):
+        self.target._persist_delay = 0.01
+
+        def change(wait):
+            self.target._persist_configuration(self.fake_volume_id,
+                                               wait=wait)
+            # The change is saved once the waiting call returns
+            if wait:
+                mlock_exec.assert_called_once_with('cinder-rtstool', 'save',
+                                                   run_as_root=True)
+
+        threads = [eventlet.spawn(change, wait) for wait in
+                   (False, True, True, False, True)]
+        for thread in threads:
+            thread.wait()
+
+        # The waiting calls share a single save
+        mlock_exec.assert_called_once_with('cinder-rtstool', 'save',
+                                           run_as_root=True)
+        self.assertEqual(self.target._config_generation,
+                         self.target._saved_generation)
+        self.assertIsNone(self.target._persist_thread)
+
+    @mock.patch.object(lio.LioAdm, '_execute',
+                       side_effect=putils.ProcessExecutionError)
+    def test_persist_configuration_wait_failure(self, mlock_exec):
+        self.target._persist_delay = 0.01
+
+        # The failure is logged and doesn't block the change
+        self.target._persist_configuration(self.fake_volume_id, wait=True)
+        mlock_exec.assert_called_once_with('cinder-rtstool', 'save',
+                                           run_as_root=True)
+        self.assertLess(self.target._saved_generation,
+                        self.target._config_generation)
+
+    @mock.patch('eventlet.spawn_after')
+    @mock.patch.object(lio.LioAdm, '_execute',
+                       side_effect=putils.ProcessExecutionError)
+    def test_persist_configuration_delayed_failure(self, mlock_exec,
+                                                   mock_spawn_after):
+        self.target._persist_delay = 5
+        self.target._persist_configuration(self.fake_volume_id)
+        self.target._save_pending_configuration()
+        self.assertLess(self.target._saved_generation,
+                        self.target._config_generation)
+
     def test_get_iscsi_target(self):
         ctxt = context.get_admin_context()
         expected = 0
@@ -184,7 +307,8 @@ class TestLioAdmDriver(tf.TargetDriverFixture):
 
         mlock_exec.assert_called_once_with(*expected_args, run_as_root=True)
         mexecute.assert_called_once_with(*expected_args, run_as_root=True)
-        mpersist_cfg.assert_called_once_with(self.fake_volume_id)
+        mpersist_cfg.assert_called_once_with(self.fake_volume_id,
+                                             wait=True)
 
         # Test the failure case: putils.ProcessExecutionError
         mlock_exec.reset_mock()
@@ -226,6 +350,27 @@ class TestLioAdmDriver(tf.TargetDriverFixture):
                                   self.fake_volumes_dir)
         self.assertFalse(mock_restore.called)
 
+    @mock.patch('cinder.volume.targets.iscsi.ISCSITarget.ensure_export')
+    @mock.patch.object(lio.LioAdm, '_restore_configuration')
+    @mock.patch.object(lio.LioAdm, '_get_targets')
+    def test_ensure_export_persist_delay(self, mock_get_targets,
+                                         mock_restore, mock_ensure_export):
+        self.target._persist_delay = 5
+        ctxt = context.get_admin_context()
+        iqn = self.iscsi_target_prefix + self.testvol['name']
+
+        # Targets created after the last save are recreated
+        mock_get_targets.return_value = {self.iscsi_target_prefix + 'other'}
+        self.target.ensure_export(ctxt, self.testvol, self.fake_volumes_dir)
+        self.assertFalse(mock_restore.called)
+        mock_ensure_export.assert_called_once_with(ctxt, self.testvol,
+                                                   self.fake_volumes_dir)
+
+        mock_ensure_export.reset_mock()
+        mock_get_targets.return_value = {iqn}
+        self.target.ensure_export(ctxt, self.testvol, self.fake_volumes_dir)
+        mock_ensure_export.assert_not_called()
+
     @mock.patch.object(lio.LioAdm, '_execute', side_effect=lio.LioAdm._execute)
     @mock.patch.object(lio.LioAdm, '_persist_configuration')
     @mock.patch('cinder.utils.execute')
@@ -249,7 +394,7 @@ class TestLioAdmDriver(tf.TargetDriverFixture):
 
         mlock_exec.assert_called_once_with(*expected_args, run_as_root=True)
         mock_execute.assert_called_once_with(*expected_args, run_as_root=True)
-        mpersist_cfg.assert_called_once_with(self.fake_volume_id)
+        mpersist_cfg.assert_called_once_with(self.fake_volume_id, wait=True)
 
         # Test the failure case: putils.ProcessExecutionError
         mlock_exec.reset_mock()
@@ -281,7 +426,8 @@ class TestLioAdmDriver(tf.TargetDriverFixture):
 
         mlock_exec.assert_called_once_with(*expected_args, run_as_root=True)
         mock_execute.assert_called_once_with(*expected_args, run_as_root=True)
-        mpersist_cfg.assert_called_once_with(self.fake_volume_id)
+        mpersist_cfg.assert_called_once_with(self.fake_volume_id,
+                                             wait=True)
 
     @mock.patch.object(lio.LioAdm, '_execute', side_effect=lio.LioAdm._execute)
     @mock.patch.object(lio.LioAdm, '_persist_configuration')
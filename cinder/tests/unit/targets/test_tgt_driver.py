@@ -106,6 +106,31 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
                         return_value=(bad_scan, None)):
             self.assertFalse(self.target._verify_backing_lun(iqn, '1'))
 
+    def test_parse_targets(self):
+        other_vol = self.iscsi_target_prefix + 'volume-other'
+        scan = self.fake_iscsi_scan + self.fake_iscsi_scan.replace(
+            'Target 1: %s' % self.test_vol,
+            'Target 2: %s' % other_vol).replace('LUN: 1', 'LUN: 3')
+        self.assertEqual({self.test_vol: ('1', {'0', '1'}),
+                          other_vol: ('2', {'0', '3'})},
+                         self.target._parse_targets(scan))
+
+    @test.testtools.skipIf(sys.platform == "darwin", "SKIP on OSX")
+    def test_create_iscsi_target_single_show(self):
+        with mock.patch('cinder.utils.execute',
+                        return_value=(self.fake_iscsi_scan, '')) as m_exec:
+            self.assertEqual(
+                '1',
+                self.target.create_iscsi_target(
+                    self.test_vol,
+                    1,
+                    0,
+                    self.fake_volumes_dir))
+
+        # The targets shown after the update are used for the checks
+        self.assertNotIn(mock.call('tgt-admin', '--show', run_as_root=True),
+                         m_exec.call_args_list)
+
     @mock.patch.object(time, 'sleep')
     @mock.patch('cinder.utils.execute')
     def test_recreate_backing_lun(self, mock_execute, mock_sleep):
@@ -149,9 +174,9 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
     def test_create_iscsi_target(self):
         with mock.patch('cinder.utils.execute', return_value=('', '')),\
                 mock.patch.object(self.target, '_get_target',
-                                  side_effect=lambda x: 1),\
+                                  side_effect=lambda x, **kwargs: 1),\
                 mock.patch.object(self.target, '_verify_backing_lun',
-                                  side_effect=lambda x, y: True):
+                                  side_effect=lambda x, y, **kwargs: True):
             self.assertEqual(
                 1,
                 self.target.create_iscsi_target(
@@ -169,9 +194,9 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
         mock_open = mock.mock_open()
         with mock.patch('cinder.utils.execute', return_value=('', '')),\
                 mock.patch.object(self.target, '_get_target',
-                                  side_effect=lambda x: 1),\
+                                  side_effect=lambda x, **kwargs: 1),\
                 mock.patch.object(self.target, '_verify_backing_lun',
-                                  side_effect=lambda x, y: True),\
+                                  side_effect=lambda x, y, **kwargs: True),\
                 mock.patch('cinder.volume.targets.tgt.open',
                            mock_open, create=True):
             self.assertEqual(
@@ -196,9 +221,9 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
                 return 'fake out', 'fake err'
 
         with mock.patch.object(self.target, '_get_target',
-                               side_effect=lambda x: 1),\
+                               side_effect=lambda x, **kwargs: 1),\
                 mock.patch.object(self.target, '_verify_backing_lun',
-                                  side_effect=lambda x, y: True),\
+                                  side_effect=lambda x, y, **kwargs: True),\
                 mock.patch('cinder.utils.execute', _fake_execute):
             self.assertEqual(
                 1,
@@ -346,9 +371,9 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
 
         with mock.patch('cinder.utils.execute', return_value=('', '')),\
                 mock.patch.object(self.target, '_get_target',
-                                  side_effect=lambda x: 1),\
+                                  side_effect=lambda x, **kwargs: 1),\
                 mock.patch.object(self.target, '_verify_backing_lun',
-                                  side_effect=lambda x, y: True),\
+                                  side_effect=lambda x, y, **kwargs: True),\
                 mock.patch.object(self.target, '_get_target_chap_auth',
                                   side_effect=lambda x, y: None) as m_chap,\
                 mock.patch.object(vutils, 'generate_username',
@@ -394,7 +419,7 @@ class TestTgtAdmDriver(tf.TargetDriverFixture):
                 mock.patch.object(self.target, '_get_target',
                                   side_effect=[None, None, 1]) as get_target,\
                 mock.patch.object(self.target, '_verify_backing_lun',
-                                  side_effect=lambda x, y: True):
+                                  side_effect=lambda x, y, **kwargs: True):
             self.assertEqual(
                 1,
                 self.target.create_iscsi_target(
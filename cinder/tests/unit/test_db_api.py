@@ -3133,6 +3133,22 @@ class DBAPIImageVolumeCacheEntryTestCase(BaseTest):
         entries = db.image_volume_cache_get_all(self.ctxt, host=host)
         self.assertEqual([], entries)
 
+    def test_cache_entry_get_usage(self):
+        image_updated_at = datetime.datetime.utcnow()
+        for i in range(0, 3):
+            db.image_volume_cache_create(self.ctxt, 'host1', 'cluster1',
+                                         'image-' + str(i), image_updated_at,
+                                         'vol-' + str(i), i + 1)
+        db.image_volume_cache_create(self.ctxt, 'host2', 'cluster2',
+                                     'image-3', image_updated_at, 'vol-3', 10)
+
+        self.assertEqual((3, 6), db.image_volume_cache_get_usage(
+            self.ctxt, host='host1'))
+        self.assertEqual((1, 10), db.image_volume_cache_get_usage(
+            self.ctxt, cluster_name='cluster2'))
+        self.assertEqual((0, 0), db.image_volume_cache_get_usage(
+            self.ctxt, host='host3'))
+
     @ddt.data('host1@backend1#pool1', 'host1@backend1')
     def test_cache_entry_include_in_cluster_by_host(self, host):
         """Basic cache include test filtering by host and with full rename."""
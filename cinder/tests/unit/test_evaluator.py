@@ -13,6 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
+import mock
+
 from cinder import exception
 from cinder.scheduler.evaluator import evaluator
 from cinder import test
@@ -137,3 +141,80 @@ class EvaluatorTestCase(test.TestCase):
         self.assertRaises(exception.EvaluatorParseException,
                           evaluator.evaluate,
                           "7 / 0")
+
+    @mock.patch.object(evaluator, '_compile_cache',
+                       collections.OrderedDict())
+    def test_compile_cached(self):
+        func = evaluator.compile_expression("stats.iops * 2")
+        with mock.patch.object(evaluator, 'parse') as parse:
+            self.assertIs(func, evaluator.compile_expression("stats.iops * 2"))
+            parse.assert_not_called()
+        self.assertEqual(20, func({'stats': {'iops': 10}}))
+        self.assertEqual(8, func({'stats': {'iops': 4}}))
+
+    @mock.patch.object(evaluator, '_COMPILE_CACHE_SIZE', 2)
+    @mock.patch.object(evaluator, '_compile_cache',
+                       collections.OrderedDict())
+    def test_compile_cache_eviction(self):
+        evaluator.compile_expression("1 + 1")
+        evaluator.compile_expression("1 + 2")
+        evaluator.compile_expression("1 + 1")
+        evaluator.compile_expression("1 + 3")
+        self.assertEqual(["1 + 1", "1 + 3"], list(evaluator._compile_cache))
+
+    @mock.patch.object(evaluator, '_compile_cache',
+                       collections.OrderedDict())
+    def test_compile_error_not_cached(self):
+        self.assertRaises(exception.EvaluatorParseException,
+                          evaluator.compile_expression, "1/*1")
+        self.assertEqual({}, evaluator._compile_cache)
+
+    def test_compiled_matches_interpreted(self):
+        variables = {
+            'stats': {'free_capacity_gb': 407, 'total_capacity_gb': 1000,
+                      'usage': 0.65, 'count': '503', 'zero': 0},
+            'capabilities': {'total_volumes': 12},
+            'volume': {'size': 4},
+        }
+        expressions = [
+            "872 - 453 + 44 / 22 * 4 + 66",
+            "-stats.free_capacity_gb + +3 - -2",
+            "2 ^ 3 ^ 2",
+            "100 * stats.free_capacity_gb / stats.total_capacity_gb",
+            "stats.usage * 100",
+            "stats.count + 1",
+            "1 < 2 < 3",
+            "3 > 2 > 2",
+            "1 <> 1 or not 2 != 2",
+            "NOT stats.zero && stats.count",
+            "stats.zero || volume.size",
+            "capabilities.total_volumes < 10 ? 100 : 50",
+            "max(stats.free_capacity_gb, volume.size, 7) - "
+            "min(1, 2) + abs(-3)",
+            "abs(-volume.size)",
+            "inf > 1",
+        ]
+        for expression in expressions:
+            self.assertEqual(
+                evaluator.parse(expression).eval(variables),
+                evaluator.compile_expression(expression)(variables),
+                expression)
+
+    def test_compiled_errors(self):
+        variables = {'stats': {'zero': 0, 'name': 'foo'}, 'fake': None}
+        for expression in ("stats.bob + 1", "fake.var + 1",
+                           "stats.name + 1", "foo + 1", "1 / stats.zero",
+                           "1 * (2 / 0)"):
+            func = evaluator.compile_expression(expression)
+            self.assertRaises(exception.EvaluatorParseException,
+                              func, variables)
+            self.assertRaises(exception.EvaluatorParseException,
+                              evaluator.parse(expression).eval, variables)
+
+    def test_compiled_unknown_function(self):
+        variables = {'stats': {'count': 1}}
+        func = evaluator.compile_expression("foo(stats.count)")
+        # Like the interpreter, it fails when evaluated, not compiled.
+        self.assertRaises(KeyError, func, variables)
+        self.assertRaises(KeyError,
+                          evaluator.parse("foo(stats.count)").eval, variables)
@@ -16,8 +16,12 @@
 
 import ddt
 import errno
+import hashlib
 import math
+import os
 
+import eventlet
+import fixtures
 import mock
 from oslo_concurrency import processutils
 from oslo_utils import units
@@ -1412,6 +1416,283 @@ class TestFetchToVolumeFormat(test.TestCase):
             dest, run_as_root=run_as_root)
 
 
+@mock.patch('cinder.image.image_utils.check_available_space')
+@mock.patch('cinder.image.image_utils.convert_image')
+@mock.patch('cinder.image.image_utils.fetch')
+@mock.patch('cinder.image.image_utils.get_qemu_data')
+@mock.patch('cinder.image.image_utils.qemu_img_info')
+@mock.patch('cinder.image.image_utils.temporary_file')
+@mock.patch('cinder.image.local_cache.LocalImageCache.from_config')
+class TestFetchToVolumeFormatLocalCache(test.TestCase):
+    def setUp(self):
+        super(TestFetchToVolumeFormatLocalCache, self).setUp()
+        self.ctxt = mock.Mock(user_id=fake.USER_ID)
+        self.image_service = FakeImageService(disk_format='qcow2')
+        self.image_service.show = mock.Mock(return_value={
+            'size': units.Gi, 'disk_format': 'qcow2',
+            'container_format': 'bare', 'status': 'active',
+            'checksum': 'sum'})
+        self.image_id = fake.IMAGE_ID
+        self.dest = mock.sentinel.dest
+
+    def _mock_cache(self, mock_from_config, cached):
+        cache = mock_from_config.return_value
+        cache.path = '/conversion/cache'
+        cache.get.return_value.__enter__.return_value = cached
+        cache.add.return_value.__enter__.return_value = mock.sentinel.part
+        return cache
+
+    @mock.patch('os.path.getsize', return_value=units.Gi)
+    def test_cached(self, mock_getsize, mock_from_config, mock_temp,
+                    mock_info, mock_get_qemu_data, mock_fetch, mock_convert,
+                    mock_check_space):
+        cache = self._mock_cache(mock_from_config, mock.sentinel.cached)
+
+        image_utils.fetch_to_volume_format(self.ctxt, self.image_service,
+                                           self.image_id, self.dest, 'raw',
+                                           None, size=1)
+
+        cache.get.assert_called_once_with(self.image_id, 'sum')
+        self.assertFalse(mock_temp.called)
+        self.assertFalse(mock_fetch.called)
+        mock_check_space.assert_called_once_with(self.dest, units.Gi,
+                                                 self.image_id)
+        mock_convert.assert_called_once_with(mock.sentinel.cached, self.dest,
+                                             'raw', src_format='raw',
+                                             run_as_root=True)
+
+    @mock.patch('os.path.getsize', return_value=2 * units.Gi)
+    def test_cached_too_big(self, mock_getsize, mock_from_config, mock_temp,
+                            mock_info, mock_get_qemu_data, mock_fetch,
+                            mock_convert, mock_check_space):
+        self._mock_cache(mock_from_config, mock.sentinel.cached)
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.fetch_to_volume_format,
+                          self.ctxt, self.image_service, self.image_id,
+                          self.dest, 'raw', None, size=1)
+        self.assertFalse(mock_convert.called)
+
+    @mock.patch('cinder.image.local_cache.checksum_matches',
+                return_value=True)
+    def test_not_cached(self, mock_checksum, mock_from_config, mock_temp,
+                        mock_info, mock_get_qemu_data, mock_fetch,
+                        mock_convert, mock_check_space):
+        cache = self._mock_cache(mock_from_config, None)
+        cache.get.return_value.__enter__.side_effect = [
+            None, mock.sentinel.cached]
+        tmp = mock_temp.return_value.__enter__.return_value
+        data = mock_info.return_value
+        data.file_format = 'qcow2'
+        data.backing_file = None
+        data.virtual_size = units.Gi
+
+        image_utils.fetch_to_volume_format(self.ctxt, self.image_service,
+                                           self.image_id, self.dest, 'raw',
+                                           None)
+
+        mock_fetch.assert_called_once_with(self.ctxt, self.image_service,
+                                           self.image_id, tmp, None, None)
+        mock_checksum.assert_called_once_with(tmp, 'sum')
+        cache.add.assert_called_once_with(self.image_id, 'sum')
+        # The image is converted into the cache, then written from it
+        mock_convert.assert_has_calls([
+            mock.call(tmp, mock.sentinel.part, 'raw', src_format='qcow2',
+                      run_as_root=False),
+            mock.call(mock.sentinel.cached, self.dest, 'raw',
+                      src_format='raw', run_as_root=True)])
+        self.assertEqual(2, mock_convert.call_count)
+
+    @mock.patch('cinder.image.local_cache.checksum_matches',
+                return_value=False)
+    def test_not_cached_checksum_mismatch(self, mock_checksum,
+                                          mock_from_config, mock_temp,
+                                          mock_info, mock_get_qemu_data,
+                                          mock_fetch, mock_convert,
+                                          mock_check_space):
+        cache = self._mock_cache(mock_from_config, None)
+        tmp = mock_temp.return_value.__enter__.return_value
+        data = mock_info.return_value
+        data.file_format = 'qcow2'
+        data.backing_file = None
+        data.virtual_size = units.Gi
+
+        image_utils.fetch_to_volume_format(self.ctxt, self.image_service,
+                                           self.image_id, self.dest, 'raw',
+                                           None)
+
+        self.assertFalse(cache.add.called)
+        mock_convert.assert_called_once_with(tmp, self.dest, 'raw',
+                                             out_subformat=None,
+                                             run_as_root=True,
+                                             src_format='qcow2')
+
+    def test_other_volume_format(self, mock_from_config, mock_temp,
+                                 mock_info, mock_get_qemu_data, mock_fetch,
+                                 mock_convert, mock_check_space):
+        data = mock_info.return_value
+        data.file_format = 'qcow2'
+        data.backing_file = None
+        data.virtual_size = units.Gi
+
+        image_utils.fetch_to_volume_format(self.ctxt, self.image_service,
+                                           self.image_id, self.dest, 'qcow2',
+                                           None)
+
+        self.assertFalse(mock_from_config.called)
+        self.assertTrue(mock_fetch.called)
+
+
+@ddt.ddt
+class TestStreamRawImage(test.TestCase):
+    def setUp(self):
+        super(TestStreamRawImage, self).setUp()
+        self.override_config('image_stream_raw', True)
+        self.ctxt = mock.Mock(user_id=fake.USER_ID)
+        self.image_id = fake.IMAGE_ID
+        self.data = b'raw image data' * 10
+        self.image_meta = {'size': len(self.data), 'disk_format': 'raw',
+                           'container_format': 'bare', 'status': 'active',
+                           'checksum': hashlib.md5(self.data).hexdigest()}
+        self.image_service = FakeImageService()
+        self.image_service.show = mock.Mock(return_value=self.image_meta)
+        self.image_service.download = mock.Mock(side_effect=self._download)
+        self.dest = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'volume')
+        with open(self.dest, 'wb') as f:
+            f.write(b'\xff' * 4 * len(self.data))
+        self.mock_object(image_utils, 'STREAM_BUFFER_SIZE', 32)
+
+    def _download(self, context, image_id, data):
+        for offset in range(0, len(self.data), 10):
+            data.write(self.data[offset:offset + 10])
+
+    def _stream(self, size=None):
+        image_utils._stream_raw_image(self.ctxt, self.image_service,
+                                      self.image_id, self.image_meta,
+                                      self.dest, size, run_as_root=True)
+
+    def _read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_stream(self):
+        self._stream(size=1)
+        self.image_service.download.assert_called_once_with(
+            self.ctxt, self.image_id, mock.ANY)
+        self.assertEqual(self.data + b'\xff' * 3 * len(self.data),
+                         self._read_dest())
+
+    @mock.patch('cinder.volume.throttling.Throttle.get_default')
+    def test_stream_rate_limited(self, mock_get_default):
+        self._stream()
+        rate_limiter = mock_get_default.return_value.get_rate_limiter()
+        self.assertEqual(len(self.data),
+                         sum(args[0] for args, _kwargs in
+                             rate_limiter.consume.call_args_list))
+
+    def test_stream_checksum_mismatch(self):
+        self.image_meta['checksum'] = 'bad'
+        self.assertRaises(exception.ImageUnacceptable, self._stream)
+
+    def test_stream_no_checksum(self):
+        self.image_meta['checksum'] = None
+        self._stream()
+        self.assertEqual(self.data, self._read_dest()[:len(self.data)])
+
+    def test_stream_wait_unstarted_write(self):
+        stream = image_utils._RawImageStream(self.image_id, None)
+        write = eventlet.spawn(lambda: None)
+        stream.pending_write = write
+        stream._wait()
+        self.assertTrue(write.dead)
+        self.assertIsNone(stream.pending_write)
+
+    def test_stream_too_big(self):
+        self.image_meta['size'] = 2 * units.Gi
+        self.assertRaises(exception.ImageUnacceptable, self._stream, size=1)
+        self.assertFalse(self.image_service.download.called)
+
+    def test_stream_download_failure(self):
+        self.image_service.download.side_effect = exception.ImageNotFound(
+            image_id=self.image_id)
+        self.assertRaises(exception.ImageNotFound, self._stream)
+
+    def test_stream_not_raw(self):
+        self.data = b'QFI\xfb' + self.data
+        self.assertRaises(image_utils._NotRawImage, self._stream)
+        # Nothing was written to the volume
+        self.assertEqual(b'\xff' * 4 * (len(self.data) - 4),
+                         self._read_dest())
+
+    @ddt.data(b'QFI\xfb\x00\x00\x00\x03',
+              b'KDMV\x01\x00\x00\x00',
+              b'# Disk DescriptorFile\nversion=1',
+              b'conectix\x00\x00\x00\x02',
+              b'vhdxfile',
+              b'<<< Oracle VM VirtualBox Disk Image >>>\n'.ljust(0x40, b'\0') +
+              b'\x7f\x10\xda\xbe')
+    def test_check_raw_image_header_not_raw(self, header):
+        self.assertRaises(image_utils._NotRawImage,
+                          image_utils._check_raw_image_header, header)
+
+    def test_check_raw_image_header(self):
+        image_utils._check_raw_image_header(b'\xeb\x63\x90' + b'\0' * 509)
+        image_utils._check_raw_image_header(b'')
+
+    def test_can_stream_image(self):
+        self.assertTrue(image_utils.can_stream_image(self.image_meta))
+        self.assertFalse(image_utils.can_stream_image(
+            dict(self.image_meta, disk_format='qcow2')))
+        self.assertFalse(image_utils.can_stream_image(None))
+
+        self.override_config('image_stream_raw', False)
+        self.assertFalse(image_utils.can_stream_image(self.image_meta))
+
+    @mock.patch('cinder.image.local_cache.LocalImageCache.from_config')
+    def test_can_stream_image_local_cache(self, mock_from_config):
+        self.assertFalse(image_utils.can_stream_image(self.image_meta))
+
+    @mock.patch('cinder.image.image_utils._stream_raw_image')
+    @mock.patch('cinder.image.image_utils.fetch')
+    def test_fetch_to_volume_format_streamed(self, mock_fetch, mock_stream):
+        image_utils.fetch_to_volume_format(self.ctxt, self.image_service,
+                                           self.image_id, self.dest, 'raw',
+                                           None, size=1)
+        mock_stream.assert_called_once_with(
+            self.ctxt, self.image_service, self.image_id, self.image_meta,
+            self.dest, 1, True)
+        self.assertFalse(mock_fetch.called)
+
+    @mock.patch('cinder.image.image_utils.convert_image')
+    @mock.patch('cinder.image.image_utils.check_available_space')
+    @mock.patch('cinder.image.image_utils.get_qemu_data')
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.fetch')
+    @mock.patch('cinder.image.image_utils.temporary_file')
+    @mock.patch('cinder.image.image_utils._stream_raw_image',
+                side_effect=image_utils._NotRawImage('qcow2'))
+    def test_fetch_to_volume_format_not_raw(self, mock_stream, mock_temp,
+                                            mock_fetch, mock_info,
+                                            mock_get_qemu_data, mock_check,
+                                            mock_convert):
+        data = mock_info.return_value
+        data.file_format = 'qcow2'
+        data.backing_file = None
+        data.virtual_size = units.Gi
+        tmp = mock_temp.return_value.__enter__.return_value
+
+        image_utils.fetch_to_raw(self.ctxt, self.image_service,
+                                 self.image_id, self.dest, None)
+
+        # The image is downloaded and checked as any other image
+        mock_fetch.assert_called_once_with(self.ctxt, self.image_service,
+                                           self.image_id, tmp, None, None)
+        mock_convert.assert_called_once_with(tmp, self.dest, 'raw',
+                                             out_subformat=None,
+                                             run_as_root=True,
+                                             src_format='raw')
+
+
 class TestXenserverUtils(test.TestCase):
     def test_is_xenserver_format(self):
         image_meta1 = {'disk_format': 'vhd', 'container_format': 'ovf'}
@@ -1684,6 +1965,134 @@ class TestTemporaryFileContextManager(test.TestCase):
         mock_delete.assert_called_once_with(mock.sentinel.temporary_file)
 
 
+@mock.patch('cinder.image.image_utils.fileutils.delete_if_exists')
+@mock.patch('cinder.image.image_utils.fetch_verify_image')
+@mock.patch('cinder.image.image_utils.create_temporary_file')
+class TestTemporaryImages(test.TestCase):
+    def setUp(self):
+        super(TestTemporaryImages, self).setUp()
+        self.image_service = mock.Mock(temp_images=None)
+        self.image_id = fake.IMAGE_ID
+
+    def _context(self, user_id=fake.USER_ID):
+        return mock.Mock(user_id=user_id)
+
+    def test_fetch(self, mock_create, mock_fetch, mock_delete):
+        mock_create.side_effect = [mock.sentinel.tmp1, mock.sentinel.tmp2]
+        ctxt = self._context()
+        for tmp in (mock.sentinel.tmp1, mock.sentinel.tmp2):
+            with image_utils.TemporaryImages.fetch(
+                    self.image_service, ctxt, self.image_id) as tmp_img:
+                self.assertEqual(tmp, tmp_img)
+            mock_delete.assert_called_with(tmp)
+        self.assertEqual(2, mock_fetch.call_count)
+
+    def test_fetch_shared(self, mock_create, mock_fetch, mock_delete):
+        mock_create.return_value = mock.sentinel.tmp
+        ctxt1 = self._context()
+        ctxt2 = self._context(fake.USER2_ID)
+        with image_utils.TemporaryImages.shared(self.image_id, 'sum',
+                                                'backend'):
+            with image_utils.TemporaryImages.shared(self.image_id, 'sum',
+                                                    'backend'):
+                with image_utils.TemporaryImages.fetch(
+                        self.image_service, ctxt1, self.image_id, 'backend',
+                        checksum='sum') as tmp_img:
+                    self.assertEqual(mock.sentinel.tmp, tmp_img)
+                    self.assertEqual(
+                        mock.sentinel.tmp,
+                        image_utils.TemporaryImages.for_image_service(
+                            self.image_service).get(ctxt1, self.image_id))
+            mock_fetch.assert_called_once_with(
+                ctxt1, self.image_service, self.image_id, mock.sentinel.tmp)
+            self.assertFalse(mock_delete.called)
+
+            with image_utils.TemporaryImages.fetch(
+                    self.image_service, ctxt2, self.image_id, 'backend',
+                    checksum='sum') as tmp_img:
+                self.assertEqual(mock.sentinel.tmp, tmp_img)
+            # The second request is authorized but doesn't download again
+            self.image_service.show.assert_called_once_with(ctxt2,
+                                                            self.image_id)
+            self.assertEqual(1, mock_fetch.call_count)
+            self.assertFalse(mock_delete.called)
+
+        mock_delete.assert_called_once_with(mock.sentinel.tmp)
+        self.assertEqual({}, image_utils.TemporaryImages._shared_images)
+
+    def test_fetch_shared_other_checksum(self, mock_create, mock_fetch,
+                                         mock_delete):
+        mock_create.side_effect = [mock.sentinel.tmp1, mock.sentinel.tmp2]
+        ctxt = self._context()
+        with image_utils.TemporaryImages.shared(self.image_id, 'sum'):
+            with image_utils.TemporaryImages.fetch(
+                    self.image_service, ctxt, self.image_id,
+                    checksum='other') as tmp_img:
+                self.assertEqual(mock.sentinel.tmp1, tmp_img)
+            with image_utils.TemporaryImages.fetch(
+                    self.image_service, ctxt, self.image_id,
+                    checksum='sum') as tmp_img:
+                self.assertEqual(mock.sentinel.tmp2, tmp_img)
+        self.assertEqual(2, mock_fetch.call_count)
+
+    def test_fetch_shared_concurrent(self, mock_create, mock_fetch,
+                                     mock_delete):
+        mock_create.return_value = mock.sentinel.tmp
+        fetching = eventlet.event.Event()
+        fetched = eventlet.event.Event()
+
+        def fetch_verify_image(*args):
+            fetching.send()
+            fetched.wait()
+
+        mock_fetch.side_effect = fetch_verify_image
+
+        def create(ctxt):
+            with image_utils.TemporaryImages.shared(self.image_id, 'sum'):
+                with image_utils.TemporaryImages.fetch(
+                        self.image_service, ctxt, self.image_id,
+                        checksum='sum') as tmp_img:
+                    return tmp_img
+
+        first = eventlet.spawn(create, self._context())
+        fetching.wait()
+        second = eventlet.spawn(create, self._context(fake.USER2_ID))
+        eventlet.sleep(0)
+        fetched.send()
+
+        self.assertEqual(mock.sentinel.tmp, first.wait())
+        self.assertEqual(mock.sentinel.tmp, second.wait())
+        mock_fetch.assert_called_once_with(
+            mock.ANY, self.image_service, self.image_id, mock.sentinel.tmp)
+        mock_delete.assert_called_once_with(mock.sentinel.tmp)
+
+    def test_fetch_shared_failed(self, mock_create, mock_fetch, mock_delete):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        failed_tmp = os.path.join(tmp_dir, 'failed')
+        open(failed_tmp, 'w').close()
+        mock_create.side_effect = [failed_tmp, mock.sentinel.tmp2]
+        mock_fetch.side_effect = [exception.ImageUnacceptable(
+            image_id=self.image_id, reason='bad'), None]
+        ctxt = self._context()
+        with image_utils.TemporaryImages.shared(self.image_id, 'sum'):
+            with image_utils.TemporaryImages.shared(self.image_id, 'sum'):
+                self.assertRaises(exception.ImageUnacceptable,
+                                  image_utils.TemporaryImages.fetch(
+                                      self.image_service, ctxt,
+                                      self.image_id,
+                                      checksum='sum').__enter__)
+
+            self.assertFalse(os.path.exists(failed_tmp))
+
+            # The next request downloads the image again
+            with image_utils.TemporaryImages.fetch(
+                    self.image_service, ctxt, self.image_id,
+                    checksum='sum') as tmp_img:
+                self.assertEqual(mock.sentinel.tmp2, tmp_img)
+        self.assertFalse(self.image_service.show.called)
+        self.assertEqual(2, mock_fetch.call_count)
+
+
 class TestImageUtils(test.TestCase):
     def test_get_virtual_size(self):
         image_id = fake.IMAGE_ID
@@ -55,3 +55,54 @@ class TestManager(test.TestCase):
 
         self.assertEqual(set(six.text_type(r) for r in result.objects),
                          set(six.text_type(e) for e in expected))
+
+
+class TestSchedulerDependentManager(test.TestCase):
+    def setUp(self):
+        super(TestSchedulerDependentManager, self).setUp()
+        self.manager = manager.SchedulerDependentManager(
+            host='host1@lvm', service_name='volume')
+        self.update_mock = self.mock_object(self.manager.scheduler_rpcapi,
+                                            'update_service_capabilities')
+        self.mock_object(self.manager.scheduler_rpcapi,
+                         'notify_service_capabilities')
+
+    def _publish(self, capabilities):
+        self.manager.update_service_capabilities(capabilities)
+        self.manager._publish_service_capabilities(mock.sentinel.context)
+        return self.update_mock.call_args[1]
+
+    def test_publish_service_capabilities_delta(self):
+        pool1 = {'pool_name': 'pool1', 'free_capacity_gb': 10}
+        pool2 = {'pool_name': 'pool2', 'free_capacity_gb': 20}
+        generation = self.manager._capabilities_generation
+
+        kwargs = self._publish({'total_volumes': 1, 'driver_version': '1.0',
+                                'pools': [pool1, pool2]})
+        self.assertEqual([generation, 1], kwargs['seq'])
+        self.assertIsNone(kwargs['delta'])
+
+        pool3 = {'pool_name': 'pool3', 'free_capacity_gb': 30}
+        new_pool2 = {'pool_name': 'pool2', 'free_capacity_gb': 15}
+        kwargs = self._publish({'total_volumes': 2,
+                                'pools': [pool1, new_pool2, pool3]})
+        self.assertEqual([generation, 2], kwargs['seq'])
+        self.assertEqual({'updated': {'total_volumes': 2},
+                          'removed': ['driver_version'],
+                          'pools': {'pool2': new_pool2, 'pool3': pool3},
+                          'removed_pools': []},
+                         kwargs['delta'])
+
+    def test_publish_service_capabilities_resync(self):
+        capabilities = {'total_volumes': 1}
+        self._publish(capabilities)
+        self.manager.resync_service_capabilities()
+        kwargs = self._publish(capabilities)
+        self.assertEqual(2, kwargs['seq'][1])
+        self.assertIsNone(kwargs['delta'])
+
+    def test_publish_service_capabilities_unnamed_pools(self):
+        capabilities = {'pools': [{'free_capacity_gb': 10}]}
+        self._publish(capabilities)
+        kwargs = self._publish(capabilities)
+        self.assertIsNone(kwargs['delta'])
@@ -16,6 +16,7 @@
 """Tests for volume copy throttling helpers."""
 
 import mock
+from oslo_utils import units
 
 from cinder import test
 from cinder import utils
@@ -27,6 +28,63 @@ class ThrottleTestCase(test.TestCase):
     def test_NoThrottle(self):
         with throttling.Throttle().subcommand('volume1', 'volume2') as cmd:
             self.assertEqual([], cmd['prefix'])
+        self.assertIsNone(throttling.Throttle().get_rate_limiter())
+
+    @mock.patch.object(utils, 'execute')
+    def test_BlkioCgroup_rate_limiter(self, mock_exec):
+        throttle = throttling.BlkioCgroup(1024, 'fake_group')
+        self.assertIsInstance(throttle.get_rate_limiter(),
+                              throttling.TokenBucket)
+        self.assertEqual(1024, throttle.get_rate_limiter().bps_limit)
+
+    @mock.patch('time.sleep')
+    @mock.patch('oslo_utils.timeutils.now')
+    def test_TokenBucket(self, mock_now, mock_sleep):
+        mock_now.return_value = 10.0
+        bucket = throttling.TokenBucket(100)
+
+        # The initial burst is consumed without waiting
+        bucket.consume(100)
+        mock_sleep.assert_not_called()
+
+        # Going into debt waits until the debt is paid back
+        bucket.consume(50)
+        mock_sleep.assert_called_once_with(0.5)
+
+        # Refilled tokens pay back the debt first and are capped to the burst
+        mock_sleep.reset_mock()
+        mock_now.return_value = 20.0
+        bucket.consume(100)
+        mock_sleep.assert_not_called()
+        bucket.consume(25)
+        mock_sleep.assert_called_once_with(0.25)
+
+    @mock.patch('time.sleep')
+    @mock.patch.object(throttling._native_time, 'sleep')
+    @mock.patch('oslo_utils.timeutils.now', return_value=10.0)
+    def test_TokenBucket_native(self, mock_now, mock_native_sleep,
+                                mock_sleep):
+        bucket = throttling.TokenBucket(100)
+        bucket.consume(150, native=True)
+        mock_native_sleep.assert_called_once_with(0.5)
+        mock_sleep.assert_not_called()
+
+    @mock.patch('oslo_utils.timeutils.now', return_value=10.0)
+    def test_TokenBucket_native_threads(self, mock_now):
+        bucket = throttling.TokenBucket(units.Gi)
+
+        def consume():
+            for _i in range(1000):
+                bucket.consume(1, native=True)
+
+        threads = [throttling._native_threading.Thread(target=consume)
+                   for _thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every byte consumed by the threads is accounted for
+        self.assertEqual(units.Gi - 4000, bucket._tokens)
 
     @mock.patch.object(utils, 'get_blkdev_major_minor')
     def test_BlkioCgroup(self, mock_major_minor):
@@ -17,9 +17,13 @@
 
 
 import datetime
+import errno
 import io
 import mock
+import os
+import shutil
 import six
+import tempfile
 
 from castellan import key_manager
 import ddt
@@ -554,6 +558,80 @@ class ClearVolumeTestCase(test.TestCase):
                           volume_utils.clear_volume,
                           1024, "volume_path")
 
+    @mock.patch('cinder.volume.utils.copy_volume')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.volume.utils.CONF')
+    def test_clear_volume_zeroout(self, mock_conf, mock_exec, mock_copy):
+        mock_conf.volume_clear = 'zero'
+        mock_conf.volume_clear_size = 0
+        mock_conf.volume_clear_ionice = '-c3'
+        volume_utils.clear_volume(1024, 'volume_path', zeroout=True)
+        mock_exec.assert_called_once_with(
+            'ionice', '-c3', 'blkdiscard', '--zeroout', '--offset', '0',
+            '--length', six.text_type(units.Gi), 'volume_path',
+            run_as_root=True)
+        mock_copy.assert_not_called()
+
+    @mock.patch('cinder.volume.utils.copy_volume')
+    @mock.patch('cinder.utils.execute',
+                side_effect=processutils.ProcessExecutionError)
+    @mock.patch('cinder.volume.utils.CONF')
+    def test_clear_volume_zeroout_unsupported(self, mock_conf, mock_exec,
+                                              mock_copy):
+        mock_conf.volume_clear = 'zero'
+        mock_conf.volume_clear_size = 0
+        mock_conf.volume_dd_blocksize = '1M'
+        mock_conf.volume_clear_ionice = None
+        volume_utils.clear_volume(1024, 'volume_path', zeroout=True)
+        self.assertEqual(1, mock_exec.call_count)
+        mock_copy.assert_called_once_with('/dev/zero', 'volume_path', 1024,
+                                          '1M', sync=True,
+                                          execute=utils.execute, ionice=None,
+                                          throttle=None, sparse=False)
+
+    @mock.patch('cinder.volume.utils.copy_volume')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.volume.utils.CONF')
+    def test_clear_volume_zeroout_throttled(self, mock_conf, mock_exec,
+                                            mock_copy):
+        mock_conf.volume_clear = 'zero'
+        mock_conf.volume_clear_size = 0
+        mock_conf.volume_dd_blocksize = '1M'
+        mock_conf.volume_clear_ionice = None
+        fake_throttle = throttling.Throttle(['fake_throttle'])
+        volume_utils.clear_volume(1024, 'volume_path', zeroout=True,
+                                  throttle=fake_throttle)
+        mock_exec.assert_not_called()
+        mock_copy.assert_called_once_with('/dev/zero', 'volume_path', 1024,
+                                          '1M', sync=True,
+                                          execute=utils.execute, ionice=None,
+                                          throttle=fake_throttle,
+                                          sparse=False)
+
+    def test_zeroout_volume_rate_limited(self):
+        mock_exec = mock.Mock()
+        limiter = mock.Mock(bps_limit=100 * units.Mi)
+        volume_utils.zeroout_volume('volume_path', 250, execute=mock_exec,
+                                    rate_limiter=limiter)
+        self.assertEqual([mock.call(100 * units.Mi),
+                          mock.call(100 * units.Mi),
+                          mock.call(50 * units.Mi)],
+                         limiter.consume.call_args_list)
+        self.assertEqual(
+            [mock.call('blkdiscard', '--zeroout',
+                       '--offset', six.text_type(offset * units.Mi),
+                       '--length', six.text_type(length * units.Mi),
+                       'volume_path', run_as_root=True)
+             for offset, length in ((0, 100), (100, 100), (200, 50))],
+            mock_exec.call_args_list)
+
+    def test_zeroout_volume_min_chunk(self):
+        limiter = mock.Mock(bps_limit=units.Mi)
+        volume_utils.zeroout_volume('volume_path', 100, execute=mock.Mock(),
+                                    rate_limiter=limiter)
+        self.assertEqual([mock.call(64 * units.Mi), mock.call(36 * units.Mi)],
+                         limiter.consume.call_args_list)
+
 
 class CopyVolumeTestCase(test.TestCase):
     @mock.patch('cinder.volume.utils.check_for_odirect_support',
@@ -678,7 +756,8 @@ class CopyVolumeTestCase(test.TestCase):
         handle2 = io.RawIOBase()
         output = volume_utils.copy_volume(handle1, handle2, 1024, 1)
         self.assertIsNone(output)
-        mock_copy.assert_called_once_with(handle1, handle2, 1024)
+        mock_copy.assert_called_once_with(handle1, handle2, 1024,
+                                          sparse=False)
 
     @mock.patch('cinder.volume.utils._transfer_data')
     @mock.patch('cinder.volume.utils._open_volume_with_path')
@@ -687,7 +766,223 @@ class CopyVolumeTestCase(test.TestCase):
         output = volume_utils.copy_volume('/foo/bar', handle, 1024, 1)
         self.assertIsNone(output)
         mock_transfer.assert_called_once_with(mock.ANY, mock.ANY,
-                                              1073741824, mock.ANY)
+                                              1073741824, mock.ANY,
+                                              sparse=False,
+                                              progress_callback=mock.ANY)
+
+
+class _ReadOnlyIO(io.RawIOBase):
+    """Raw IO object implementing read() but not readinto()."""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(size)
+
+
+class _BytesOnlyIO(io.BytesIO):
+    """IO object refusing anything but bytes on writes, like RBD images."""
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            raise TypeError('bytes required')
+        return super(_BytesOnlyIO, self).write(data)
+
+
+@ddt.ddt
+class TransferDataTestCase(test.TestCase):
+
+    @ddt.data(io.BytesIO, _ReadOnlyIO)
+    def test_transfer_data(self, src_class):
+        data = os.urandom(10 * units.Ki + 5)
+        dest = io.BytesIO()
+        volume_utils._transfer_data(src_class(data), dest, len(data),
+                                    units.Ki)
+        self.assertEqual(data, dest.getvalue())
+
+    def test_transfer_data_length(self):
+        data = os.urandom(4 * units.Ki)
+        dest = io.BytesIO()
+        volume_utils._transfer_data(io.BytesIO(data), dest, 3 * units.Ki + 1,
+                                    units.Ki)
+        self.assertEqual(data[:3 * units.Ki + 1], dest.getvalue())
+
+    def test_transfer_data_source_eof(self):
+        data = os.urandom(2 * units.Ki + 1)
+        dest = io.BytesIO()
+        volume_utils._transfer_data(io.BytesIO(data), dest, 8 * units.Ki,
+                                    units.Ki)
+        self.assertEqual(data, dest.getvalue())
+
+    def test_transfer_data_bytes_only_dest(self):
+        data = os.urandom(3 * units.Ki)
+        dest = _BytesOnlyIO()
+        volume_utils._transfer_data(io.BytesIO(data), dest, len(data),
+                                    units.Ki)
+        self.assertEqual(data, dest.getvalue())
+
+    @ddt.data(True, False)
+    def test_transfer_data_sparse(self, sparse):
+        chunk = os.urandom(units.Ki)
+        zeros = bytes(bytearray(units.Ki))
+        data = zeros + chunk + zeros + zeros
+        dest = io.BytesIO()
+        with mock.patch.object(dest, 'write', wraps=dest.write) as mock_write:
+            volume_utils._transfer_data(io.BytesIO(data), dest, len(data),
+                                        units.Ki, sparse=sparse)
+        self.assertEqual(data, dest.getvalue())
+        # Only the data chunk and the last byte are written when sparse
+        self.assertEqual(2 if sparse else 4, mock_write.call_count)
+
+    def test_transfer_data_read_error(self):
+        src = mock.Mock()
+        src.readinto.side_effect = IOError('read failed')
+        dest = io.BytesIO()
+        self.assertRaises(IOError, volume_utils._transfer_data, src, dest,
+                          4 * units.Ki, units.Ki)
+        self.assertEqual(b'', dest.getvalue())
+
+    def test_transfer_data_write_error(self):
+        src = io.BytesIO(os.urandom(8 * units.Ki))
+        dest = mock.Mock()
+        dest.write.side_effect = IOError('write failed')
+        self.assertRaises(IOError, volume_utils._transfer_data, src, dest,
+                          8 * units.Ki, units.Ki)
+        dest.write.assert_called_once_with(mock.ANY)
+        # The reader stopped reading ahead once the writes failed
+        self.assertLessEqual(src.tell(), 3 * units.Ki)
+
+    @mock.patch('cinder.volume.utils.TRANSFER_PROGRESS_INTERVAL', 0)
+    def test_transfer_data_progress(self):
+        data = os.urandom(4 * units.Ki)
+        dest = io.BytesIO()
+        progress = mock.Mock()
+        volume_utils._transfer_data(io.BytesIO(data), dest, len(data),
+                                    units.Ki, progress_callback=progress)
+        self.assertEqual(data, dest.getvalue())
+        self.assertEqual(mock.call(len(data)), progress.call_args)
+        copied = [args[0] for args, _kwargs in progress.call_args_list]
+        self.assertEqual(sorted(copied), copied)
+
+
+@ddt.ddt
+class InProcessCopyVolumeTestCase(test.TestCase):
+
+    def setUp(self):
+        super(InProcessCopyVolumeTestCase, self).setUp()
+        self.override_config('volume_copy_method', 'native')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.src = os.path.join(self.tmpdir, 'src')
+        self.dest = os.path.join(self.tmpdir, 'dest')
+
+    def _write_src(self, *chunks):
+        """Write the source, None chunks of 1 MiB being left as holes."""
+        with open(self.src, 'wb') as f:
+            for chunk in chunks:
+                if chunk is None:
+                    f.seek(units.Mi, os.SEEK_CUR)
+                else:
+                    f.write(chunk)
+            f.truncate()
+        with open(self.src, 'rb') as f:
+            return f.read()
+
+    def _read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    @ddt.data(True, False)
+    def test_copy_volume(self, sync):
+        data = self._write_src(os.urandom(units.Mi), None,
+                               os.urandom(units.Mi))
+        with open(self.dest, 'wb') as f:
+            f.write(b'x' * 4 * units.Mi)
+        volume_utils.copy_volume(self.src, self.dest, 3, '1M', sync=sync)
+        self.assertEqual(data, self._read_dest())
+
+    @ddt.data(*[errno.EINVAL, errno.EXDEV])
+    def test_copy_volume_kernel_copy_unsupported(self, error):
+        data = self._write_src(os.urandom(units.Mi), os.urandom(units.Mi))
+        with mock.patch('os.sendfile', create=True,
+                        side_effect=OSError(error, 'unsupported')), \
+                mock.patch('os.copy_file_range', create=True,
+                           side_effect=OSError(error, 'unsupported')):
+            volume_utils.copy_volume(self.src, self.dest, 2, '1M')
+        self.assertEqual(data, self._read_dest())
+
+    def test_copy_volume_kernel_copy_error(self):
+        self._write_src(os.urandom(units.Mi))
+        with mock.patch('os.sendfile', create=True,
+                        side_effect=OSError(errno.EIO, 'I/O error')), \
+                mock.patch('os.copy_file_range', create=True,
+                           side_effect=OSError(errno.EIO, 'I/O error')):
+            self.assertRaises(OSError, volume_utils.copy_volume,
+                              self.src, self.dest, 1, '1M')
+
+    def test_copy_volume_sparse(self):
+        chunk = os.urandom(units.Mi)
+        zeros = bytes(bytearray(units.Mi))
+        data = self._write_src(chunk, None, zeros, chunk, zeros)
+        throttle = mock.Mock()
+        volume_utils.copy_volume(self.src, self.dest, 5, '1M',
+                                 throttle=throttle, sparse=True)
+        self.assertEqual(data, self._read_dest())
+        # Only the two data chunks were written
+        rate_limiter = throttle.get_rate_limiter.return_value
+        rate_limiter.consume.assert_has_calls(
+            [mock.call(units.Mi, native=True)] * 2)
+        self.assertEqual(2, rate_limiter.consume.call_count)
+
+    def test_copy_volume_sparse_holes_skipped(self):
+        data = self._write_src(None, None, os.urandom(units.Mi))
+        seeks = []
+        real_lseek = os.lseek
+
+        def lseek(fd, offset, whence):
+            if whence == volume_utils._SEEK_DATA:
+                seeks.append(offset)
+            return real_lseek(fd, offset, whence)
+
+        with mock.patch('os.lseek', side_effect=lseek):
+            volume_utils.copy_volume(self.src, self.dest, 3, '1M',
+                                     sparse=True)
+        self.assertEqual(data, self._read_dest())
+        # Holes are skipped without being read where SEEK_DATA reports them
+        self.assertIn(0, seeks)
+
+    def test_copy_volume_source_shorter(self):
+        data = self._write_src(os.urandom(units.Mi + 100))
+        volume_utils.copy_volume(self.src, self.dest, 4, '1M')
+        self.assertEqual(data, self._read_dest())
+
+    def test_copy_volume_from_dev_zero(self):
+        with open(self.dest, 'wb') as f:
+            f.write(b'x' * 2 * units.Mi)
+        volume_utils.copy_volume('/dev/zero', self.dest, 2, '1M', sync=True)
+        self.assertEqual(bytes(bytearray(2 * units.Mi)), self._read_dest())
+
+    def test_copy_volume_rate_limited(self):
+        self._write_src(os.urandom(units.Mi), os.urandom(units.Mi))
+        throttle = mock.Mock()
+        volume_utils.copy_volume(self.src, self.dest, 2, '1M',
+                                 throttle=throttle)
+        calls = throttle.get_rate_limiter.return_value.consume.call_args_list
+        self.assertEqual(2 * units.Mi, sum(args[0] for args, _kw in calls))
+        # The copy runs in a tpool thread, which must not sleep with eventlet
+        self.assertTrue(all(kwargs == {'native': True}
+                            for _args, kwargs in calls))
+        throttle.subcommand.assert_not_called()
+
+    @mock.patch('cinder.volume.utils._copy_volume_with_path')
+    @mock.patch('cinder.volume.utils._copy_volume_in_process')
+    def test_copy_volume_ionice_uses_dd(self, mock_in_process, mock_dd):
+        volume_utils.copy_volume(self.src, self.dest, 2, '1M', ionice='-c3')
+        mock_in_process.assert_not_called()
+        mock_dd.assert_called_once_with(
+            [], self.src, self.dest, 2, '1M', sync=False,
+            execute=utils.execute, ionice='-c3', sparse=False)
 
 
 @ddt.ddt
@@ -958,6 +1253,71 @@ class VolumeUtilsTestCase(test.TestCase):
                           entries, {'name': 'vol02'}, 3, None,
                           ['size', 'reference'], ['desc', 'asc'])
 
+    @ddt.data(None, {'name': 'vol025'})
+    def test_paginate_entries_list_small_page(self, marker):
+        # Many more entries than needed for the page, selected with a heap
+        entries = [{'reference': {'name': 'vol%03d' % i}, 'size': i % 7}
+                   for i in range(100)]
+        res = volume_utils.paginate_entries_list(entries, marker, 4, 2,
+                                                 ['size', 'reference'],
+                                                 ['desc', 'asc'])
+        expected = sorted(entries, key=lambda e: (-e['size'],
+                                                  e['reference']['name']))
+        start = expected.index(entries[25]) + 1 if marker else 0
+        self.assertEqual(expected[start + 2:start + 6], res)
+
+    def test_paginate_entries_list_keeps_order_of_equal_entries(self):
+        entries = [{'reference': {'name': 'vol%02d' % i}, 'size': 1}
+                   for i in (3, 1, 2)]
+        res = volume_utils.paginate_entries_list(entries, None, 3, 0,
+                                                 ['size'], ['desc'])
+        self.assertEqual(entries, res)
+
+    def _get_manageable_entry(self, name):
+        self.built.append(name)
+        if name not in self.missing:
+            return {'reference': {'name': name}, 'size': self.sizes[name]}
+
+    def _paginate_manageable(self, *args):
+        self.built = []
+        self.missing = ('vol03',)
+        self.sizes = {'vol01': 3, 'vol02': 3, 'vol03': 1, 'vol04': 2,
+                      'vol05': 1, 'vol06': 3, 'vol07': 1}
+        names = ['vol03', 'vol01', 'vol02', 'vol04', 'vol06', 'vol07',
+                 'vol05']
+        return volume_utils.paginate_manageable_entries(
+            names, self._get_manageable_entry, *args)
+
+    @ddt.data({"name": "vol01"}, '{"name": "vol01"}')
+    def test_paginate_manageable_entries_by_reference(self, marker):
+        res = self._paginate_manageable(marker, 2, 1, ['reference'], ['asc'])
+        self.assertEqual([{'reference': {'name': 'vol04'}, 'size': 2},
+                          {'reference': {'name': 'vol05'}, 'size': 1}], res)
+        # Only the marker and the entries up to the page are built
+        self.assertEqual(['vol01', 'vol02', 'vol03', 'vol04', 'vol05'],
+                         sorted(self.built))
+
+    def test_paginate_manageable_entries_by_reference_desc(self):
+        res = self._paginate_manageable(None, 3, 3, ['reference'], ['desc'])
+        self.assertEqual([{'reference': {'name': 'vol04'}, 'size': 2},
+                          {'reference': {'name': 'vol02'}, 'size': 3},
+                          {'reference': {'name': 'vol01'}, 'size': 3}], res)
+
+    def test_paginate_manageable_entries_by_size(self):
+        res = self._paginate_manageable({'name': 'vol02'}, 3, 1,
+                                        ['size', 'reference'],
+                                        ['desc', 'asc'])
+        self.assertEqual([{'reference': {'name': 'vol04'}, 'size': 2},
+                          {'reference': {'name': 'vol05'}, 'size': 1},
+                          {'reference': {'name': 'vol07'}, 'size': 1}], res)
+        self.assertEqual(7, len(self.built))
+
+    @ddt.data({'name': 'vol03'}, {'name': 'vol08'}, {'other': 'vol01'})
+    def test_paginate_manageable_entries_marker_not_found(self, marker):
+        self.assertRaises(exception.InvalidInput,
+                          self._paginate_manageable,
+                          marker, 3, None, ['reference'], ['asc'])
+
     def test_convert_config_string_to_dict(self):
         test_string = "{'key-1'='val-1' 'key-2'='val-2' 'key-3'='val-3'}"
         expected_dict = {'key-1': 'val-1', 'key-2': 'val-2', 'key-3': 'val-3'}
@@ -17,6 +17,8 @@ import socket
 import mock
 from oslo_concurrency import processutils
 from oslo_config import cfg
+from oslo_utils import units
+import six
 
 from cinder.brick.local_dev import lvm as brick_lvm
 from cinder import db
@@ -29,6 +31,7 @@ from cinder.tests.unit import utils as tests_utils
 from cinder.tests.unit.volume import test_driver
 from cinder.volume import configuration as conf
 from cinder.volume.drivers import lvm
+from cinder.volume import throttling
 import cinder.volume.utils
 from cinder.volume import utils as volutils
 
@@ -96,6 +99,156 @@ class LVMVolumeDriverTestCase(test_driver.BaseDriverTestCase):
                          'size': 123}
         lvm_driver._delete_volume(fake_snapshot, is_snapshot=True)
 
+    @mock.patch.object(os.path, 'exists', return_value=True)
+    @mock.patch.object(volutils, 'clear_volume')
+    @mock.patch.object(fake_driver.FakeLoggingVolumeDriver, 'create_export')
+    def test_delete_volume_clear(self, _mock_create_export, mock_clear,
+                                 _mock_exists):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        self.configuration.volume_clear = 'zero'
+        self.configuration.volume_clear_size = 0
+        self.configuration.lvm_type = 'default'
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+        volume = dict(self.FAKE_VOLUME, size=2)
+
+        with mock.patch.object(vg_obj, 'delete') as mock_delete:
+            lvm_driver._delete_volume(volume)
+
+        mock_clear.assert_called_once_with(
+            2048, lvm_driver.local_path(volume), volume_clear='zero',
+            volume_clear_size=0, zeroout=True, rate_limiter=None)
+        mock_delete.assert_called_once_with('test1')
+
+    @mock.patch.object(os.path, 'exists', return_value=True)
+    @mock.patch('cinder.utils.execute')
+    def test_delete_volume_clear_copy_throttled(self, mock_exec,
+                                                _mock_exists):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        self.configuration.volume_clear = 'zero'
+        self.configuration.volume_clear_size = 0
+        self.configuration.lvm_type = 'default'
+        self.flags(volume_copy_bps_limit=512 * units.Mi)
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+        lvm_driver.set_throttle()
+        self.addCleanup(throttling.Throttle.set_default, None)
+        volume = dict(self.FAKE_VOLUME, size=1)
+
+        with mock.patch.object(vg_obj, 'delete'):
+            lvm_driver._delete_volume(volume)
+
+        # The volume is zeroed with blkdiscard, in chunks limited by the
+        # rate limiter of the blkio cgroup throttle.
+        path = lvm_driver.local_path(volume)
+        mock_exec.assert_has_calls(
+            [mock.call('blkdiscard', '--zeroout', '--offset',
+                       six.text_type(offset * units.Mi), '--length',
+                       six.text_type(512 * units.Mi), path,
+                       run_as_root=True)
+             for offset in (0, 512)])
+
+    @ddt.data((12.5, 0, 130, 0), (None, 0, 1024, 0), (100.0, 0, 1024, 0),
+              (12.5, 100, 130, 100), (12.5, 1024, 130, 130))
+    @ddt.unpack
+    @mock.patch.object(os.path, 'exists', return_value=True)
+    @mock.patch.object(volutils, 'clear_volume')
+    @mock.patch.object(fake_driver.FakeLoggingVolumeDriver, 'create_export')
+    def test_delete_snapshot_clear_cow_usage(self, percent, clear_size,
+                                             expected, expected_clear_size,
+                                             _mock_create_export,
+                                             mock_clear, _mock_exists):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        self.configuration.volume_clear = 'zero'
+        self.configuration.volume_clear_size = clear_size
+        self.configuration.lvm_type = 'default'
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+        snapshot = {'name': 'snapshot-1', 'id': '1', 'volume_size': 1}
+
+        with mock.patch.object(vg_obj, 'lv_get_data_percent',
+                               return_value=percent) as mock_percent:
+            lvm_driver._delete_volume(snapshot, is_snapshot=True)
+
+        mock_percent.assert_called_once_with('_snapshot-1')
+        mock_clear.assert_called_once_with(
+            expected, lvm_driver.local_path(snapshot) + '-cow',
+            volume_clear='zero', volume_clear_size=expected_clear_size,
+            zeroout=True, rate_limiter=None)
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch.object(volutils, 'clear_volume')
+    @mock.patch.object(fake_driver.FakeLoggingVolumeDriver, 'create_export')
+    def test_delete_volume_clear_in_background(self, _mock_create_export,
+                                               mock_clear, mock_spawn):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        self.configuration.volume_clear = 'zero'
+        self.configuration.volume_clear_size = 0
+        self.configuration.lvm_type = 'default'
+        self.configuration.lvm_clear_workers = 2
+        self.configuration.lvm_clear_bps_limit = 100 * units.Mi
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+        volume = dict(self.FAKE_VOLUME, size=2)
+
+        with mock.patch.object(vg_obj, 'rename_volume') as mock_rename, \
+                mock.patch.object(vg_obj, 'delete') as mock_delete:
+            lvm_driver._delete_volume(volume)
+
+            mock_rename.assert_called_once_with('test1', 'wipe-test1')
+            mock_delete.assert_not_called()
+            mock_clear.assert_not_called()
+            mock_spawn.assert_called_once_with(lvm_driver._wipe_and_delete,
+                                               'wipe-test1', 2048)
+
+            lvm_driver._wipe_and_delete('wipe-test1', 2048)
+
+        mock_clear.assert_called_once_with(
+            2048, lvm_driver.local_path({'name': 'wipe-test1'}),
+            volume_clear='zero', volume_clear_size=0, zeroout=True,
+            rate_limiter=lvm_driver._clear_rate_limiter)
+        self.assertEqual(100 * units.Mi,
+                         lvm_driver._clear_rate_limiter.bps_limit)
+        mock_delete.assert_called_once_with('wipe-test1')
+
+    @mock.patch.object(volutils, 'clear_volume',
+                       side_effect=processutils.ProcessExecutionError)
+    @mock.patch.object(fake_driver.FakeLoggingVolumeDriver, 'create_export')
+    def test_wipe_and_delete_failure(self, _mock_create_export, mock_clear):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        self.configuration.volume_clear = 'zero'
+        self.configuration.volume_clear_size = 0
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+
+        with mock.patch.object(vg_obj, 'delete') as mock_delete:
+            lvm_driver._wipe_and_delete('wipe-test1', 2048)
+
+        mock_clear.assert_called_once()
+        mock_delete.assert_not_called()
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch.object(fake_driver.FakeLoggingVolumeDriver, 'create_export')
+    def test_resume_queued_clears(self, _mock_create_export, mock_spawn):
+        vg_obj = fake_lvm.FakeBrickLVM('cinder-volumes', False, None,
+                                       'default')
+        lvm_driver = lvm.LVMVolumeDriver(configuration=self.configuration,
+                                         vg_obj=vg_obj, db=db)
+        lvs = [{'vg': 'cinder-volumes', 'name': 'volume-1', 'size': '1.00'},
+               {'vg': 'cinder-volumes', 'name': 'wipe-volume-2',
+                'size': '2.00'}]
+
+        with mock.patch.object(vg_obj, 'get_volumes', return_value=lvs):
+            lvm_driver._resume_queued_clears()
+
+        mock_spawn.assert_called_once_with(lvm_driver._wipe_and_delete,
+                                           'wipe-volume-2', 2048)
+
     @mock.patch.object(volutils, 'get_all_volume_groups',
                        return_value=[{'name': 'cinder-volumes'}])
     @mock.patch('cinder.brick.local_dev.lvm.LVM.get_lvm_version',
@@ -170,6 +170,9 @@ class RBDTestCase(test.TestCase):
         self.cfg.rbd_store_chunk_size = 4
         self.cfg.rados_connection_retries = 3
         self.cfg.rados_connection_interval = 5
+        self.cfg.rados_connection_pool_size = 0
+        self.cfg.rados_connection_max_idle = 60
+        self.cfg.rbd_provisioned_capacity_refresh_interval = 0
 
         mock_exec = mock.Mock()
         mock_exec.return_value = ('', '')
@@ -1229,6 +1232,106 @@ class RBDTestCase(test.TestCase):
             actual = self.driver.get_volume_stats(True)
             self.assertDictEqual(expected, actual)
 
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('cinder.volume.drivers.rbd.RBDDriver._get_usage_info')
+    def test_get_provisioned_capacity_tracked(self, usage_mock, spawn_mock):
+        self.cfg.rbd_provisioned_capacity_refresh_interval = 3600
+        usage_mock.return_value = 10
+
+        self.assertEqual(10, self.driver._get_provisioned_capacity())
+        self.driver._update_provisioned_capacity('volume-1', 5)
+        self.driver._update_provisioned_capacity('volume-1', -2)
+        self.assertEqual(13, self.driver._get_provisioned_capacity())
+        usage_mock.assert_called_once_with()
+        spawn_mock.assert_not_called()
+
+        # Once the interval expires it is recalculated in the background
+        self.mock_object(self.driver._provisioned_capacity_watch, 'expired',
+                         return_value=True)
+        self.assertEqual(13, self.driver._get_provisioned_capacity())
+        self.assertEqual(13, self.driver._get_provisioned_capacity())
+        spawn_mock.assert_called_once_with(
+            self.driver._refresh_provisioned_capacity, 3600)
+
+        usage_mock.return_value = 20
+        self.driver._refresh_provisioned_capacity(3600)
+        self.assertFalse(self.driver._provisioned_capacity_refreshing)
+        self.assertFalse(self.driver._provisioned_capacity_watch.expired())
+        self.assertEqual(20, self.driver._get_provisioned_capacity())
+
+    @mock.patch('cinder.volume.drivers.rbd.RBDVolumeProxy')
+    @mock.patch('cinder.volume.drivers.rbd.RADOSClient')
+    @mock.patch('cinder.volume.drivers.rbd.RBDDriver.RBDProxy')
+    def test_refresh_provisioned_capacity_concurrent_changes(
+            self, rbdproxy_mock, client_mock, volproxy_mock):
+        self.driver._provisioned_capacity = 10
+        rbdproxy_mock.return_value.list.return_value = [
+            'volume-1', 'volume-2', 'volume-3']
+        sizes = {'volume-1': 1, 'volume-2': 2, 'volume-3': 4}
+
+        def _size(name):
+            if name == 'volume-2':
+                # volume-1 was already read, volume-3 is read afterwards,
+                # and volume-4 is created after the listing.
+                self.driver._update_provisioned_capacity('volume-1', 3)
+                sizes['volume-3'] += 5
+                self.driver._update_provisioned_capacity('volume-3', 5)
+                self.driver._update_provisioned_capacity('volume-4', 6)
+            return sizes[name] * units.Gi
+
+        def _volume_proxy(driver, name, **kwargs):
+            proxy = mock.MagicMock()
+            proxy.__enter__.return_value.size.side_effect = (
+                lambda: _size(name))
+            return proxy
+        volproxy_mock.side_effect = _volume_proxy
+
+        self.driver._refresh_provisioned_capacity(3600)
+        # The scan found 1 + 2 + 9 GiB, and missed the extension of volume-1
+        # and the creation of volume-4.
+        self.assertEqual(21, self.driver._provisioned_capacity)
+        self.assertIsNone(self.driver._provisioned_capacity_delta)
+        self.assertIsNone(self.driver._provisioned_capacity_unscanned)
+
+        # Later changes are only applied to the total
+        self.driver._update_provisioned_capacity('volume-1', 2)
+        self.assertEqual(23, self.driver._provisioned_capacity)
+        self.assertIsNone(self.driver._provisioned_capacity_delta)
+
+    @mock.patch('cinder.volume.drivers.rbd.RBDDriver._get_usage_info')
+    def test_refresh_provisioned_capacity_failed_over(self, usage_mock):
+        self.driver._provisioned_capacity = 10
+
+        def _get_usage_info(track_changes=False):
+            # The total of the new cluster is calculated on the next update
+            self.driver._provisioned_capacity = None
+            return 20
+        usage_mock.side_effect = _get_usage_info
+
+        self.driver._refresh_provisioned_capacity(3600)
+        self.assertIsNone(self.driver._provisioned_capacity)
+
+    @mock.patch('cinder.volume.drivers.rbd.RBDDriver._get_usage_info')
+    def test_get_provisioned_capacity_untracked(self, usage_mock):
+        usage_mock.return_value = 10
+        self.driver._update_provisioned_capacity('volume-1', 5)
+        self.assertEqual(10, self.driver._get_provisioned_capacity())
+        self.assertEqual(10, self.driver._get_provisioned_capacity())
+        self.assertEqual(2, usage_mock.call_count)
+
+    @common_mocks
+    def test_create_volume_provisioned_capacity(self):
+        self.driver._provisioned_capacity = 10
+        client = self.mock_client.return_value
+        client.__enter__.return_value = client
+        with mock.patch.object(self.driver, '_enable_replication_if_needed',
+                               return_value={}):
+            self.driver.create_volume(self.volume_a)
+        self.assertEqual(20, self.driver._provisioned_capacity)
+
+        self.driver.extend_volume(self.volume_a, 15)
+        self.assertEqual(25, self.driver._provisioned_capacity)
+
     @ddt.data(
         # Normal case, no quota and dynamic total
         {'free_capacity': 27.0, 'total_capacity': 28.44},
@@ -1637,7 +1740,7 @@ class RBDTestCase(test.TestCase):
                 'vol_pool', None, None)
 
         mock_driver._disconnect_from_rados.assert_called_once_with(
-            'fake_cl', 'fake_io')
+            'fake_cl', 'fake_io', error=None)
 
     def test_rbd_volume_proxy_external_conn_error(self):
         mock_driver = mock.Mock(name='driver')
@@ -1724,6 +1827,46 @@ class RBDTestCase(test.TestCase):
         self.assertEqual(
             3, self.mock_rados.Rados.return_value.shutdown.call_count)
 
+    @mock.patch.object(driver.RBDDriver, '_do_disconnect_from_rados')
+    @mock.patch.object(driver.RBDDriver, '_do_connect_to_rados')
+    def test_connect_to_rados_pooled(self, mock_connect, mock_disconnect):
+        self.cfg.rados_connection_pool_size = 1
+        self.driver = driver.RBDDriver(configuration=self.cfg)
+        self.driver.rados = mock.Mock(Error=MockException)
+        conn = FakeRadosConnection()
+        mock_connect.return_value = (conn, conn.ioctx)
+
+        client = driver.RADOSClient(self.driver, 'volumes')
+        with client:
+            pass
+        with driver.RADOSClient(self.driver, 'volumes') as client2:
+            self.assertEqual(client.ioctx, client2.ioctx)
+        mock_connect.assert_called_once_with('volumes', None, None)
+        mock_disconnect.assert_not_called()
+
+        # A RADOS error closes the connection instead of pooling it
+        def _fail():
+            with driver.RADOSClient(self.driver, 'volumes'):
+                raise MockException()
+
+        self.assertRaises(MockException, _fail)
+        mock_disconnect.assert_called_once_with(conn, conn.ioctx)
+
+    @mock.patch.object(driver.RBDDriver, '_get_provisioned_capacity',
+                       return_value=0)
+    @mock.patch.object(driver.RBDDriver, '_get_pool_stats',
+                       return_value=('unknown', 'unknown'))
+    @mock.patch.object(driver.RBDDriver, '_get_fsid', return_value='fsid')
+    def test_update_volume_stats_evicts_idle(self, mock_fsid, mock_stats,
+                                             mock_provisioned):
+        self.cfg.rados_connection_pool_size = 1
+        self.driver = driver.RBDDriver(configuration=self.cfg)
+        self.driver.rados = mock.Mock(Error=MockException)
+        with mock.patch.object(self.driver._rados_pool,
+                               'evict_idle') as mock_evict:
+            self.driver._update_volume_stats()
+        mock_evict.assert_called_once_with()
+
     @common_mocks
     def test_failover_host_no_replication(self):
         self.driver._is_replication_enabled = False
@@ -2085,6 +2228,92 @@ class RBDTestCase(test.TestCase):
                 '/imgfile', self.volume_c.name)
 
 
+class FakeRadosConnection(object):
+    def __init__(self):
+        self.state = 'connected'
+        self.ioctx = mock.Mock(state='open')
+
+
+class RADOSConnectionPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(RADOSConnectionPoolTestCase, self).setUp()
+        self.connect = mock.Mock(side_effect=self._connect)
+        self.disconnect = mock.Mock()
+        self.pool = driver.RADOSConnectionPool(self.connect, self.disconnect,
+                                               size=2, max_idle=60)
+        self.now = self.mock_object(driver.timeutils, 'now', return_value=0)
+
+    def _connect(self, pool):
+        client = FakeRadosConnection()
+        return client, client.ioctx
+
+    def test_get_reuses_connection(self):
+        conn = self.pool.get('volumes', 'volumes')
+        self.pool.put(*conn)
+        self.assertEqual(conn, self.pool.get('volumes', 'volumes'))
+        self.connect.assert_called_once_with('volumes')
+        self.disconnect.assert_not_called()
+
+    def test_get_by_key(self):
+        conn = self.pool.get('volumes', 'volumes')
+        self.pool.put(*conn)
+        other = self.pool.get('images', 'images')
+        self.assertNotEqual(conn, other)
+        self.connect.assert_has_calls([mock.call('volumes'),
+                                       mock.call('images')])
+
+    def test_get_evicts_idle(self):
+        conn = self.pool.get('volumes', 'volumes')
+        self.pool.put(*conn)
+        self.now.return_value = 61
+        self.assertNotEqual(conn, self.pool.get('volumes', 'volumes'))
+        self.disconnect.assert_called_once_with(*conn)
+
+    def test_evict_idle(self):
+        conns = [self.pool.get('volumes', 'volumes') for __ in range(2)]
+        self.pool.put(*conns[0])
+        self.now.return_value = 30
+        self.pool.put(*conns[1])
+
+        self.now.return_value = 61
+        self.pool.evict_idle()
+        self.disconnect.assert_called_once_with(*conns[0])
+        self.assertEqual(conns[1], self.pool.get('volumes', 'volumes'))
+
+        self.pool.put(*conns[1])
+        self.now.return_value = 200
+        self.pool.evict_idle()
+        self.disconnect.assert_called_with(*conns[1])
+        self.assertEqual({}, self.pool._idle)
+
+    def test_get_unhealthy(self):
+        conn = self.pool.get('volumes', 'volumes')
+        self.pool.put(*conn)
+        conn[0].state = 'shutdown'
+        self.assertNotEqual(conn, self.pool.get('volumes', 'volumes'))
+        self.disconnect.assert_called_once_with(*conn)
+
+    def test_put_error(self):
+        conn = self.pool.get('volumes', 'volumes')
+        self.pool.put(conn[0], conn[1], error=Exception())
+        self.disconnect.assert_called_once_with(*conn)
+        self.assertNotEqual(conn, self.pool.get('volumes', 'volumes'))
+
+    def test_put_full(self):
+        conns = [self.pool.get('volumes', 'volumes') for __ in range(3)]
+        for conn in conns:
+            self.pool.put(*conn)
+        self.disconnect.assert_called_once_with(*conns[2])
+
+    def test_clear(self):
+        conns = [self.pool.get(pool, pool) for pool in ('volumes', 'images')]
+        for conn in conns:
+            self.pool.put(*conn)
+        self.pool.clear()
+        self.disconnect.assert_has_calls([mock.call(*conn) for conn in conns],
+                                         any_order=True)
+
+
 class ManagedRBDTestCase(test_driver.BaseDriverTestCase):
     driver_name = "cinder.volume.drivers.rbd.RBDDriver"
 
@@ -2239,7 +2468,7 @@ class ManagedRBDTestCase(test_driver.BaseDriverTestCase):
                     mock_clone.return_value = {}
                     image_loc = ('rbd://fee/fi/fo/fum', None)
 
-                    volume = {'name': 'vol1'}
+                    volume = {'name': 'vol1', 'size': 1}
                     actual = driver.clone_image(mock.Mock(),
                                                 volume,
                                                 image_loc,
@@ -2269,7 +2498,7 @@ class ManagedRBDTestCase(test_driver.BaseDriverTestCase):
             image_loc = ('rbd://bee/bi/bo/bum',
                          [{'url': 'rbd://bee/bi/bo/bum'},
                           {'url': 'rbd://fee/fi/fo/fum'}])
-            volume = {'name': 'vol1'}
+            volume = {'name': 'vol1', 'size': 1}
             image_meta = mock.sentinel.image_meta
             image_service = mock.sentinel.image_service
 
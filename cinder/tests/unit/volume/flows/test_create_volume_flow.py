@@ -1070,6 +1070,27 @@ class CreateVolumeFlowManagerTestCase(test.TestCase):
             fake_driver.create_volume_from_backup.assert_called_once_with(
                 volume_obj, backup_obj)
 
+    @ddt.data(True, False)
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.TemporaryImages.fetch')
+    def test_fetch_image_virtual_size(self, stream_raw, mock_fetch,
+                                      mock_qemu_info):
+        self.flags(image_stream_raw=stream_raw)
+        fake_manager = create_volume_manager.CreateVolumeFromSpecTask(
+            mock.MagicMock(), mock.MagicMock(), mock.MagicMock())
+        image_service = fake_image.FakeImageService()
+        image_meta = {'disk_format': 'raw', 'size': 1024,
+                      'checksum': 'sum'}
+        mock_qemu_info.return_value.virtual_size = 1024
+
+        with fake_manager._fetch_image_virtual_size(
+                self.ctxt, image_service, fakes.IMAGE_ID, image_meta,
+                'backend') as virtual_size:
+            self.assertEqual(1024, virtual_size)
+
+        # Raw images streamed to the volume aren't downloaded first
+        self.assertEqual(not stream_raw, mock_fetch.called)
+
 
 class CreateVolumeFlowManagerGlanceCinderBackendCase(test.TestCase):
 
@@ -280,3 +280,12 @@ class VolumeInitHostTestCase(base.BaseVolumeTestCase):
         self.volume.init_host(service_id=self.service_id)
         mock_add_threadpool.assert_called_once_with(mock_migrate_fixed_key,
                                                     mock_get_my_volumes())
+
+    @mock.patch('cinder.volume.manager.VolumeManager._get_my_volumes')
+    def test_init_host_resume_image_cache_evictions(self,
+                                                    mock_get_my_volumes):
+        self.volume.image_volume_cache = mock.Mock()
+
+        self.volume.init_host(service_id=self.service_id)
+        resume = self.volume.image_volume_cache.resume_evictions
+        resume.assert_called_once_with(mock.ANY, mock_get_my_volumes())
@@ -27,6 +27,7 @@ import eventlet
 import mock
 from oslo_concurrency import processutils
 from oslo_config import cfg
+import oslo_messaging as messaging
 from oslo_utils import imageutils
 import six
 from taskflow.engines.action_engine import engine
@@ -613,6 +614,78 @@ class VolumeTestCase(base.BaseVolumeTestCase):
                                    volume_type=db_vol_type)
         self.assertEqual(db_vol_type.get('id'), volume['volume_type_id'])
 
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volumes')
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volume')
+    def test_create_volumes(self, mock_create_volume, mock_create_volumes):
+        """Test creating volumes scheduled in a single pass."""
+        volume_api = cinder.volume.api.API()
+
+        volumes = volume_api.create_volumes(self.context, 2, 1, 'name',
+                                            'description',
+                                            scheduler_hints={'hint': 'x'})
+
+        self.assertEqual(2, len(volumes))
+        mock_create_volume.assert_not_called()
+        mock_create_volumes.assert_called_once_with(
+            self.context, volumes, mock.ANY, [{'scheduler_hints':
+                                               {'hint': 'x'}}] * 2)
+        request_spec_list = mock_create_volumes.call_args[0][2]
+        self.assertEqual([volume.id for volume in volumes],
+                         [spec.volume_id for spec in request_spec_list])
+        for volume in volumes:
+            self.assertEqual('creating', volume.status)
+            self.assertEqual(1, volume.size)
+
+    def test_create_volumes_invalid_count(self):
+        volume_api = cinder.volume.api.API()
+        self.assertRaises(exception.InvalidInput, volume_api.create_volumes,
+                          self.context, 0, 1, 'name', 'description')
+
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volumes')
+    def test_create_volumes_failure(self, mock_create_volumes):
+        """Volumes created before a failure are set to error."""
+        volume_api = cinder.volume.api.API()
+        create = volume_api.create
+        created = []
+
+        def fake_create(*args, **kwargs):
+            if created:
+                raise exception.VolumeSizeExceedsAvailableQuota(
+                    requested=1, consumed=1, quota=1)
+            created.append(create(*args, **kwargs))
+            return created[-1]
+
+        self.mock_object(volume_api, 'create', side_effect=fake_create)
+
+        self.assertRaises(exception.VolumeSizeExceedsAvailableQuota,
+                          volume_api.create_volumes,
+                          self.context, 2, 1, 'name', 'description')
+        mock_create_volumes.assert_not_called()
+        volume = objects.Volume.get_by_id(self.context, created[0].id)
+        self.assertEqual('error', volume.status)
+
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volumes',
+                side_effect=messaging.MessagingTimeout)
+    def test_create_volumes_scheduler_failure(self, mock_create_volumes):
+        """Volumes are set to error when the batch can't be scheduled."""
+        volume_api = cinder.volume.api.API()
+        create = volume_api.create
+        created = []
+
+        def fake_create(*args, **kwargs):
+            created.append(create(*args, **kwargs))
+            return created[-1]
+
+        self.mock_object(volume_api, 'create', side_effect=fake_create)
+
+        self.assertRaises(messaging.MessagingTimeout,
+                          volume_api.create_volumes,
+                          self.context, 2, 1, 'name', 'description')
+        self.assertEqual(2, len(created))
+        for created_volume in created:
+            volume = objects.Volume.get_by_id(self.context, created_volume.id)
+            self.assertEqual('error', volume.status)
+
     def test_create_volume_with_multiattach_volume_type(self):
         """Test volume creation with multiattach volume type."""
         elevated = context.get_admin_context()
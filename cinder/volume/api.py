@@ -204,7 +204,7 @@ class API(base.Base):
                source_replica=None, consistencygroup=None,
                cgsnapshot=None, multiattach=False, source_cg=None,
                group=None, group_snapshot=None, source_group=None,
-               backup=None):
+               backup=None, batch=None):
 
         if image_id:
             context.authorize(vol_policy.CREATE_FROM_IMAGE_POLICY)
@@ -328,7 +328,8 @@ class API(base.Base):
                                                  availability_zones,
                                                  create_what,
                                                  sched_rpcapi,
-                                                 volume_rpcapi)
+                                                 volume_rpcapi,
+                                                 batch)
         except Exception:
             msg = _('Failed to create api volume flow.')
             LOG.exception(msg)
@@ -360,6 +361,50 @@ class API(base.Base):
                     self.list_availability_zones(enable_cache=True,
                                                  refresh_cache=True)
 
+    def create_volumes(self, context, count, size, name, description,
+                       volume_type=None, metadata=None,
+                       availability_zone=None, scheduler_hints=None,
+                       multiattach=False):
+        """Create identical empty volumes, scheduled in a single pass.
+
+        Each volume goes through the same checks, quota reservation and
+        database entry creation as create, and then the batch is cast to the
+        scheduler, which places all of them at once. Volumes that cannot be
+        placed are set to error. The placements are sent in a
+        scheduler.create_volumes notification.
+        """
+        if not strutils.is_int_like(count) or int(count) <= 0:
+            msg = _('Invalid volume count provided for create request: %s '
+                    '(count argument must be an integer greater than '
+                    'zero).') % count
+            raise exception.InvalidInput(reason=msg)
+
+        volumes = []
+        batch = []
+        try:
+            for _i in range(int(count)):
+                volumes.append(self.create(
+                    context, size, name, description,
+                    volume_type=volume_type, metadata=metadata,
+                    availability_zone=availability_zone,
+                    scheduler_hints=scheduler_hints,
+                    multiattach=multiattach, batch=batch))
+
+            request_spec_list = [request_spec for request_spec, _fp in batch]
+            filter_properties_list = [fp for _rs, fp in batch]
+            self.scheduler_rpcapi.create_volumes(
+                context, volumes, request_spec_list, filter_properties_list)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for volume in volumes:
+                    if not volume.host:
+                        volume.update({'status': 'error'})
+                        volume.save()
+
+        LOG.info("Requested the scheduling of %d volumes in a batch.",
+                 len(volumes))
+        return volumes
+
     def revert_to_snapshot(self, context, volume, snapshot):
         """revert a volume to a snapshot"""
         context.authorize(vol_action_policy.REVERT_POLICY,
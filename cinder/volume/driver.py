@@ -130,6 +130,16 @@ volume_opts = [
                default=0,
                help='The upper limit of bandwidth of volume copy. '
                     '0 => unlimited'),
+    cfg.StrOpt('volume_copy_method',
+               default='dd',
+               choices=['dd', 'native'],
+               help='How volumes are copied between paths. dd runs a dd '
+                    'command for every copy. native copies in the volume '
+                    'service process, with copy_file_range or sendfile '
+                    'when the kernel supports them for the paths and with '
+                    'O_DIRECT reads and writes otherwise, and paces the '
+                    'copies to volume_copy_bps_limit. Copies with '
+                    'volume_clear_ionice set always use dd.'),
     cfg.StrOpt('iscsi_write_cache',
                default='on',
                choices=['on', 'off'],
@@ -143,6 +153,15 @@ volume_opts = [
                     'Only used for tgtadm to specify backing device flags '
                     'using bsoflags option. The specified string is passed '
                     'as is to the underlying tool.'),
+    cfg.IntOpt('target_persist_delay',
+               default=0,
+               min=0,
+               help='Seconds to wait after a change of the LIO targets '
+                    'before saving their configuration, so that the '
+                    'changes made meanwhile are saved together. Target '
+                    'removals and initiator changes wait for the save that '
+                    'includes them. 0 saves after every change. Only used '
+                    'when target_helper is set to lioadm.'),
     cfg.StrOpt('target_protocol',
                deprecated_name='iscsi_protocol',
                default='iscsi',
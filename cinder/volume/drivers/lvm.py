@@ -19,6 +19,8 @@ import math
 import os
 import socket
 
+import eventlet
+from eventlet import semaphore
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -35,6 +37,7 @@ from cinder import interface
 from cinder import utils
 from cinder.volume import configuration
 from cinder.volume import driver
+from cinder.volume import throttling
 from cinder.volume import utils as volutils
 
 LOG = logging.getLogger(__name__)
@@ -77,12 +80,33 @@ volume_opts = [
     cfg.BoolOpt('lvm_suppress_fd_warnings',
                 default=False,
                 help='Suppress leaked file descriptor warnings in LVM '
-                     'commands.')
+                     'commands.'),
+    cfg.IntOpt('lvm_clear_workers',
+               default=0,
+               min=0,
+               help='Number of deleted volumes wiped concurrently in the '
+                    'background. Deleted volumes are renamed and are wiped '
+                    'and removed after the delete completes, at most this '
+                    'many at a time. 0 wipes volumes synchronously while '
+                    'they are deleted. Snapshots are always wiped '
+                    'synchronously.'),
+    cfg.IntOpt('lvm_clear_bps_limit',
+               default=0,
+               min=0,
+               help='Bandwidth in bytes per second shared by the wipes of '
+                    'deleted volumes and snapshots when they are zeroed '
+                    'with blkdiscard. 0 means that they are only limited '
+                    'by volume_copy_bps_limit, if it is set. Wipes falling '
+                    'back to dd are throttled by volume_copy_bps_limit '
+                    'instead.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts, group=configuration.SHARED_CONF_GROUP)
 
+# Prefix of the LVs of deleted volumes waiting to be wiped and removed.
+WIPE_LV_PREFIX = 'wipe-'
+
 
 @interface.volumedriver
 class LVMVolumeDriver(driver.VolumeDriver):
@@ -126,6 +150,13 @@ class LVMVolumeDriver(driver.VolumeDriver):
             self.configuration.max_over_subscription_ratio = \
                 self.configuration.lvm_max_over_subscription_ratio
 
+        self._clear_workers = semaphore.Semaphore(
+            max(1, self.configuration.lvm_clear_workers or 0))
+        self._clear_rate_limiter = None
+        if self.configuration.lvm_clear_bps_limit:
+            self._clear_rate_limiter = throttling.TokenBucket(
+                self.configuration.lvm_clear_bps_limit)
+
     def _sizestr(self, size_in_g):
         return '%sg' % size_in_g
 
@@ -134,18 +165,34 @@ class LVMVolumeDriver(driver.VolumeDriver):
 
     def _delete_volume(self, volume, is_snapshot=False):
         """Deletes a logical volume."""
+        name = volume['name']
+        if is_snapshot:
+            name = self._escape_snapshot(volume['name'])
+
         if self.configuration.volume_clear != 'none' and \
                 self.configuration.lvm_type != 'thin':
+            if not is_snapshot and self.configuration.lvm_clear_workers:
+                self._queue_clear_volume(volume)
+                return
             self._clear_volume(volume, is_snapshot)
 
-        name = volume['name']
-        if is_snapshot:
-            name = self._escape_snapshot(volume['name'])
         self.vg.delete(name)
 
+    def _get_clear_size(self, volume, is_snapshot=False):
+        size_in_g = (volume.get('volume_size') if is_snapshot
+                     else volume.get('size'))
+        if size_in_g is None:
+            msg = (_("Size for volume: %s not found, cannot secure delete.")
+                   % volume['id'])
+            LOG.error(msg)
+            raise exception.InvalidParameterValue(msg)
+
+        # clear_volume expects sizes in MiB, we store integer GiB
+        # be sure to convert before passing in
+        return size_in_g * units.Ki
+
     def _clear_volume(self, volume, is_snapshot=False):
         # zero out old volumes to prevent data leaking between users
-        # TODO(ja): reclaiming space should be done lazy and low priority
         if is_snapshot:
             # if the volume to be cleared is a snapshot of another volume
             # we need to clear out the volume using the -cow instead of the
@@ -156,31 +203,76 @@ class LVMVolumeDriver(driver.VolumeDriver):
         else:
             dev_path = self.local_path(volume)
 
-        # TODO(jdg): Maybe we could optimize this for snaps by looking at
-        # the cow table and only overwriting what's necessary?
-        # for now we're still skipping on snaps due to hang issue
         if not os.path.exists(dev_path):
             msg = (_('Volume device file path %s does not exist.')
                    % dev_path)
             LOG.error(msg)
             raise exception.VolumeBackendAPIException(data=msg)
 
-        size_in_g = (volume.get('volume_size') if is_snapshot
-                     else volume.get('size'))
-        if size_in_g is None:
-            msg = (_("Size for volume: %s not found, cannot secure delete.")
-                   % volume['id'])
-            LOG.error(msg)
-            raise exception.InvalidParameterValue(msg)
+        vol_sz_in_meg = self._get_clear_size(volume, is_snapshot)
+        if is_snapshot:
+            vol_sz_in_meg = self._get_snapshot_cow_usage(volume,
+                                                         vol_sz_in_meg)
 
-        # clear_volume expects sizes in MiB, we store integer GiB
-        # be sure to convert before passing in
-        vol_sz_in_meg = size_in_g * units.Ki
+        self._wipe(dev_path, vol_sz_in_meg)
+
+    def _get_snapshot_cow_usage(self, snapshot, size_in_m):
+        """Size in MiB of the start of a snapshot COW store in use.
 
+        The COW store of a snapshot is filled sequentially from its start,
+        so the exceptions it holds are all within its used share. The
+        reported percentage is rounded, so a margin is kept on top of it.
+        """
+        percent = self.vg.lv_get_data_percent(
+            self._escape_snapshot(snapshot['name']))
+        if percent is None:
+            return size_in_m
+        used_in_m = int(math.ceil(size_in_m * (percent + 0.01) / 100)) + 1
+        return min(size_in_m, used_in_m)
+
+    def _wipe(self, dev_path, size_in_m):
+        volume_clear_size = self.configuration.volume_clear_size
+        if volume_clear_size:
+            volume_clear_size = min(volume_clear_size, size_in_m)
         volutils.clear_volume(
-            vol_sz_in_meg, dev_path,
+            size_in_m, dev_path,
             volume_clear=self.configuration.volume_clear,
-            volume_clear_size=self.configuration.volume_clear_size)
+            volume_clear_size=volume_clear_size,
+            zeroout=True,
+            rate_limiter=self._clear_rate_limiter)
+
+    def _queue_clear_volume(self, volume):
+        """Hand a deleted volume over to be wiped in the background.
+
+        The LV is renamed out of the way right away, so the delete can
+        complete, and is removed once it has been wiped.
+        """
+        size_in_m = self._get_clear_size(volume)
+        wipe_name = WIPE_LV_PREFIX + volume['name']
+        self.vg.rename_volume(volume['name'], wipe_name)
+        LOG.info('Volume %(name)s will be wiped and removed in the '
+                 'background as %(wipe_name)s.',
+                 {'name': volume['name'], 'wipe_name': wipe_name})
+        eventlet.spawn_n(self._wipe_and_delete, wipe_name, size_in_m)
+
+    def _wipe_and_delete(self, name, size_in_m):
+        with self._clear_workers:
+            try:
+                self._wipe(self.local_path({'name': name}), size_in_m)
+                self.vg.delete(name)
+            except Exception:
+                LOG.exception('Failed to wipe and remove the LV %s of a '
+                              'deleted volume, it will be retried when the '
+                              'service restarts.', name)
+                return
+        LOG.info('Wiped and removed the LV %s of a deleted volume.', name)
+
+    def _resume_queued_clears(self):
+        for lv in self.vg.get_volumes():
+            if lv['name'].startswith(WIPE_LV_PREFIX):
+                size_in_m = int(math.ceil(float(lv['size']))) * units.Ki
+                eventlet.spawn_n(self._wipe_and_delete, lv['name'],
+                                 size_in_m)
 
     def _escape_snapshot(self, snapshot_name):
         # Linux LVM reserves name that starts with snapshot, so that
@@ -366,6 +458,9 @@ class LVMVolumeDriver(driver.VolumeDriver):
             # Enable sparse copy since lvm_type is 'thin'
             self._sparse_copy_volume = True
 
+        # Deleted volumes may have been left to be wiped by a previous run.
+        self._resume_queued_clears()
+
     def create_volume(self, volume):
         """Creates a logical volume."""
         mirror_count = 0
@@ -480,8 +575,6 @@ class LVMVolumeDriver(driver.VolumeDriver):
             LOG.info('Successfully deleted snapshot: %s', snapshot['id'])
             return True
 
-        # TODO(yamahata): zeroing out the whole snapshot triggers COW.
-        # it's quite slow.
         self._delete_volume(snapshot, is_snapshot=True)
 
     def revert_to_snapshot(self, context, volume, snapshot):
@@ -677,23 +770,23 @@ class LVMVolumeDriver(driver.VolumeDriver):
     def _get_manageable_resource_info(self, cinder_resources, resource_type,
                                       marker, limit, offset, sort_keys,
                                       sort_dirs):
-        entries = []
-        lvs = self.vg.get_volumes()
-        cinder_ids = [resource['id'] for resource in cinder_resources]
+        lvs = {lv['name']: lv for lv in self.vg.get_volumes()
+               if not lv['name'].startswith(WIPE_LV_PREFIX)}
+        cinder_ids = {resource['id'] for resource in cinder_resources}
 
-        for lv in lvs:
-            is_snap = self.vg.lv_is_snapshot(lv['name'])
+        def get_lv_info(name):
+            is_snap = self.vg.lv_is_snapshot(name)
             if ((resource_type == 'volume' and is_snap) or
                     (resource_type == 'snapshot' and not is_snap)):
-                continue
+                return None
 
             if resource_type == 'volume':
-                potential_id = volutils.extract_id_from_volume_name(lv['name'])
+                potential_id = volutils.extract_id_from_volume_name(name)
             else:
-                unescape = self._unescape_snapshot(lv['name'])
+                unescape = self._unescape_snapshot(name)
                 potential_id = volutils.extract_id_from_snapshot_name(unescape)
-            lv_info = {'reference': {'source-name': lv['name']},
-                       'size': int(math.ceil(float(lv['size']))),
+            lv_info = {'reference': {'source-name': name},
+                       'size': int(math.ceil(float(lvs[name]['size']))),
                        'cinder_id': None,
                        'extra_info': None}
 
@@ -701,7 +794,7 @@ class LVMVolumeDriver(driver.VolumeDriver):
                 lv_info['safe_to_manage'] = False
                 lv_info['reason_not_safe'] = 'already managed'
                 lv_info['cinder_id'] = potential_id
-            elif self.vg.lv_is_open(lv['name']):
+            elif self.vg.lv_is_open(name):
                 lv_info['safe_to_manage'] = False
                 lv_info['reason_not_safe'] = '%s in use' % resource_type
             else:
@@ -709,13 +802,14 @@ class LVMVolumeDriver(driver.VolumeDriver):
                 lv_info['reason_not_safe'] = None
 
             if resource_type == 'snapshot':
-                origin = self.vg.lv_get_origin(lv['name'])
+                origin = self.vg.lv_get_origin(name)
                 lv_info['source_reference'] = {'source-name': origin}
 
-            entries.append(lv_info)
+            return lv_info
 
-        return volutils.paginate_entries_list(entries, marker, limit, offset,
-                                              sort_keys, sort_dirs)
+        return volutils.paginate_manageable_entries(
+            list(lvs), get_lv_info, marker, limit, offset, sort_keys,
+            sort_dirs)
 
     def get_manageable_volumes(self, cinder_volumes, marker, limit, offset,
                                sort_keys, sort_dirs):
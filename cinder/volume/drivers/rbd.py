@@ -15,12 +15,15 @@
 
 from __future__ import absolute_import
 import binascii
+import collections
 import json
 import math
 import os
 import tempfile
+import threading
 
 from castellan import key_manager
+import eventlet
 from eventlet import tpool
 from os_brick import encryptors
 from os_brick.initiator import linuxrbd
@@ -28,6 +31,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import fileutils
+from oslo_utils import timeutils
 from oslo_utils import units
 import six
 from six.moves import urllib
@@ -98,6 +102,22 @@ RBD_OPTS = [
                     'ceph cluster to do a demotion/promotion of volumes. '
                     'If value < 0, no timeout is set and default librados '
                     'value is used.'),
+    cfg.IntOpt('rados_connection_pool_size', default=4, min=0,
+               help='Maximum number of idle connections to the ceph cluster '
+                    'kept open for reuse for each RADOS pool and cluster. '
+                    'Set to 0 to connect to the cluster for every '
+                    'operation.'),
+    cfg.IntOpt('rados_connection_max_idle', default=60, min=0,
+               help='Time in seconds after which an idle pooled connection '
+                    'to the ceph cluster is closed.'),
+    cfg.IntOpt('rbd_provisioned_capacity_refresh_interval', default=3600,
+               min=0,
+               help='Interval in seconds between recalculations of the '
+                    'provisioned capacity from the size of all the images '
+                    'in the pool. In between, the provisioned capacity is '
+                    'updated with the volumes created, extended and deleted '
+                    'by this backend. Set to 0 to recalculate it on every '
+                    'stats refresh.'),
     cfg.BoolOpt('report_dynamic_total_capacity', default=True,
                 help='Set to True for driver to report total capacity as a '
                      'dynamic value -used + current free- and to False to '
@@ -111,6 +131,100 @@ CONF.register_opts(RBD_OPTS, group=configuration.SHARED_CONF_GROUP)
 EXTRA_SPECS_REPL_ENABLED = "replication_enabled"
 
 
+class RADOSConnectionPool(object):
+    """Pool of connections to ceph clusters for reuse between operations.
+
+    Connections are (client, ioctx) tuples and are pooled by RADOS pool and
+    cluster configuration.  Connections that have been idle for too long or
+    that are no longer connected are closed instead of being reused, and
+    connections returned after a RADOS error are always closed.
+    """
+    def __init__(self, connect, disconnect, size, max_idle):
+        self._connect = connect
+        self._disconnect = disconnect
+        self.size = size
+        self.max_idle = max_idle
+        # {key: deque([(client, ioctx, released_at), ...])} most recent last
+        self._idle = collections.defaultdict(collections.deque)
+        # {id(ioctx): key} for the connections in use
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_healthy(client, ioctx):
+        return (getattr(client, 'state', 'connected') == 'connected' and
+                getattr(ioctx, 'state', 'open') == 'open')
+
+    def _evict_idle(self, now):
+        """Remove and return the connections idle for too long."""
+        expired = []
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0][2] > self.max_idle:
+                expired.append(idle.popleft()[:2])
+            if not idle:
+                del self._idle[key]
+        return expired
+
+    def _close(self, connections):
+        for client, ioctx in connections:
+            self._disconnect(client, ioctx)
+
+    def get(self, key, *args):
+        """Borrow a connection, connecting with args if none is idle."""
+        now = timeutils.now()
+        conn = None
+        with self._lock:
+            expired = self._evict_idle(now)
+            idle = self._idle.get(key)
+            while idle:
+                client, ioctx, __ = idle.pop()
+                if self._is_healthy(client, ioctx):
+                    conn = (client, ioctx)
+                    break
+                expired.append((client, ioctx))
+        self._close(expired)
+
+        if conn is None:
+            conn = self._connect(*args)
+        with self._lock:
+            self._in_use[id(conn[1])] = key
+        return conn
+
+    def put(self, client, ioctx, error=None):
+        """Return a borrowed connection to the pool."""
+        with self._lock:
+            key = self._in_use.pop(id(ioctx), None)
+            if (key is not None and error is None and
+                    self._is_healthy(client, ioctx)):
+                idle = self._idle[key]
+                if len(idle) < self.size:
+                    idle.append((client, ioctx, timeutils.now()))
+                    return
+        if error is not None:
+            LOG.debug('Closing connection to ceph cluster after error: %s',
+                      error)
+        self._disconnect(client, ioctx)
+
+    def evict_idle(self):
+        """Close the connections idle for too long.
+
+        Idle connections are otherwise only evicted when one is borrowed,
+        so this is called periodically to close them when the pool is not
+        used.
+        """
+        with self._lock:
+            expired = self._evict_idle(timeutils.now())
+        self._close(expired)
+
+    def clear(self):
+        """Close all the idle connections."""
+        with self._lock:
+            connections = [conn[:2] for idle in self._idle.values()
+                           for conn in idle]
+            self._idle.clear()
+        self._close(connections)
+
+
 class RBDVolumeProxy(object):
     """Context manager for dealing with an existing rbd volume.
 
@@ -156,7 +270,8 @@ class RBDVolumeProxy(object):
             self.volume.close()
         finally:
             if self._close_conn:
-                self.driver._disconnect_from_rados(self.client, self.ioctx)
+                self.driver._disconnect_from_rados(self.client, self.ioctx,
+                                                   error=value)
 
     def __getattr__(self, attrib):
         return getattr(self.volume, attrib)
@@ -172,7 +287,8 @@ class RADOSClient(object):
         return self
 
     def __exit__(self, type_, value, traceback):
-        self.driver._disconnect_from_rados(self.cluster, self.ioctx)
+        self.driver._disconnect_from_rados(self.cluster, self.ioctx,
+                                           error=value)
 
     @property
     def features(self):
@@ -217,6 +333,19 @@ class RBDDriver(driver.CloneableImageVD,
         self._is_replication_enabled = False
         self._replication_targets = []
         self._target_names = []
+        self._rados_pool = None
+        if self.configuration.rados_connection_pool_size:
+            self._rados_pool = RADOSConnectionPool(
+                self._do_connect_to_rados, self._do_disconnect_from_rados,
+                self.configuration.rados_connection_pool_size,
+                self.configuration.rados_connection_max_idle)
+        self._provisioned_capacity = None
+        self._provisioned_capacity_watch = None
+        self._provisioned_capacity_refreshing = False
+        # Images not scanned yet and changes of the provisioned capacity that
+        # the scan won't see, while it is refreshed
+        self._provisioned_capacity_unscanned = None
+        self._provisioned_capacity_delta = None
 
     def _get_target_config(self, target_id):
         """Get a replication target from known replication targets."""
@@ -305,6 +434,26 @@ class RBDDriver(driver.CloneableImageVD,
         return args
 
     def _connect_to_rados(self, pool=None, remote=None, timeout=None):
+        """Return a (client, ioctx) connection, from the pool if possible."""
+        if self._rados_pool is None:
+            return self._do_connect_to_rados(pool, remote, timeout)
+        key = (pool, self._get_config_tuple(remote), timeout)
+        return self._rados_pool.get(key, pool, remote, timeout)
+
+    def _disconnect_from_rados(self, client, ioctx, error=None):
+        """Release a connection returned by _connect_to_rados.
+
+        Pooled connections are kept open for reuse unless the operation
+        failed with a RADOS error, which may have left them unusable.
+        """
+        if self._rados_pool is None:
+            self._do_disconnect_from_rados(client, ioctx)
+        else:
+            if not (self.rados and isinstance(error, self.rados.Error)):
+                error = None
+            self._rados_pool.put(client, ioctx, error)
+
+    def _do_connect_to_rados(self, pool=None, remote=None, timeout=None):
         @utils.retry(exception.VolumeBackendAPIException,
                      self.configuration.rados_connection_interval,
                      self.configuration.rados_connection_retries)
@@ -346,7 +495,7 @@ class RBDDriver(driver.CloneableImageVD,
 
         return _do_conn(pool, remote, timeout)
 
-    def _disconnect_from_rados(self, client, ioctx):
+    def _do_disconnect_from_rados(self, client, ioctx):
         # closing an ioctx cannot raise an exception
         ioctx.close()
         client.shutdown()
@@ -382,7 +531,7 @@ class RBDDriver(driver.CloneableImageVD,
             ports.append(port)
         return hosts, ports
 
-    def _get_usage_info(self):
+    def _get_usage_info(self, track_changes=False):
         """Calculate provisioned volume space in GiB.
 
         Stats report should send provisioned size of volumes (snapshot must not
@@ -391,10 +540,18 @@ class RBDDriver(driver.CloneableImageVD,
         We must include all volumes, not only Cinder created volumes, because
         Cinder created volumes are reported by the Cinder core code as
         allocated_capacity_gb.
+
+        With track_changes, the images whose size is not read yet are kept in
+        _provisioned_capacity_unscanned once they are listed, so the changes
+        made to the other ones during the scan are recorded to be applied on
+        its result.
         """
         total_provisioned = 0
         with RADOSClient(self) as client:
-            for t in self.RBDProxy().list(client.ioctx):
+            names = self.RBDProxy().list(client.ioctx)
+            if track_changes:
+                self._provisioned_capacity_unscanned = set(names)
+            for t in names:
                 with RBDVolumeProxy(self, t, read_only=True,
                                     client=client.cluster,
                                     ioctx=client.ioctx) as v:
@@ -404,10 +561,63 @@ class RBDDriver(driver.CloneableImageVD,
                         LOG.debug("Image %s is not found.", t)
                     else:
                         total_provisioned += size
+                if track_changes:
+                    self._provisioned_capacity_unscanned.discard(t)
 
         total_provisioned = math.ceil(float(total_provisioned) / units.Gi)
         return total_provisioned
 
+    def _get_provisioned_capacity(self):
+        """Get the provisioned volume space in GiB.
+
+        Adding up the size of every image in the pool is slow for pools with
+        many images, so unless rbd_provisioned_capacity_refresh_interval is 0
+        it is done only the first time.  Afterwards the provisioned capacity
+        is updated with the volumes we create, extend and delete, and it is
+        recalculated in the background once per interval to take other
+        changes into account.
+        """
+        interval = self.configuration.rbd_provisioned_capacity_refresh_interval
+        if not interval:
+            return self._get_usage_info()
+
+        if self._provisioned_capacity is None:
+            self._provisioned_capacity = self._get_usage_info()
+            self._provisioned_capacity_watch = timeutils.StopWatch(
+                interval).start()
+        elif (self._provisioned_capacity_watch.expired() and
+                not self._provisioned_capacity_refreshing):
+            self._provisioned_capacity_refreshing = True
+            eventlet.spawn_n(self._refresh_provisioned_capacity, interval)
+        return self._provisioned_capacity
+
+    def _refresh_provisioned_capacity(self, interval):
+        self._provisioned_capacity_delta = 0
+        try:
+            total = self._get_usage_info(track_changes=True)
+            if self._provisioned_capacity is not None:
+                self._provisioned_capacity = (
+                    total + self._provisioned_capacity_delta)
+        except Exception:
+            LOG.exception('Error refreshing the provisioned capacity.')
+        finally:
+            self._provisioned_capacity_unscanned = None
+            self._provisioned_capacity_delta = None
+            self._provisioned_capacity_watch = timeutils.StopWatch(
+                interval).start()
+            self._provisioned_capacity_refreshing = False
+
+    def _update_provisioned_capacity(self, volume_name, size_gb):
+        if self._provisioned_capacity is not None:
+            self._provisioned_capacity += size_gb
+        # While the pool is scanned, the changes of images that were listed
+        # but not read yet will be seen by the scan. The changes of images
+        # already read, or created after the listing, are applied again on
+        # its result.
+        if (self._provisioned_capacity_unscanned is not None and
+                volume_name not in self._provisioned_capacity_unscanned):
+            self._provisioned_capacity_delta += size_gb
+
     def _get_pool_stats(self):
         """Gets pool free and total capacity in GiB.
 
@@ -459,6 +669,11 @@ class RBDDriver(driver.CloneableImageVD,
         return free_capacity, total_capacity
 
     def _update_volume_stats(self):
+        if self._rados_pool is not None:
+            # Stats are updated periodically, even when no operation uses
+            # the pool.
+            self._rados_pool.evict_idle()
+
         location_info = '%s:%s:%s:%s:%s' % (
             self.configuration.rbd_cluster_name,
             self.configuration.rbd_ceph_conf,
@@ -501,7 +716,7 @@ class RBDDriver(driver.CloneableImageVD,
             stats['free_capacity_gb'] = free_capacity
             stats['total_capacity_gb'] = total_capacity
 
-            total_gbi = self._get_usage_info()
+            total_gbi = self._get_provisioned_capacity()
             stats['provisioned_capacity_gb'] = total_gbi
         except self.rados.Error:
             # just log and return unknown capacities
@@ -570,6 +785,7 @@ class RBDDriver(driver.CloneableImageVD,
             with RBDVolumeProxy(self, src_name, read_only=True) as vol:
                 vol.copy(vol.ioctx, dest_name)
                 self._extend_if_required(volume, src_vref)
+            self._update_provisioned_capacity(volume.name, volume.size)
             return
 
         # Otherwise do COW clone.
@@ -654,6 +870,7 @@ class RBDDriver(driver.CloneableImageVD,
 
             self._extend_if_required(volume, src_vref)
 
+        self._update_provisioned_capacity(volume.name, volume.size)
         LOG.debug("clone created successfully")
         return volume_update
 
@@ -767,7 +984,10 @@ class RBDDriver(driver.CloneableImageVD,
         """Creates a logical volume."""
 
         if volume.encryption_key_id:
-            return self._create_encrypted_volume(volume, volume.obj_context)
+            volume_update = self._create_encrypted_volume(volume,
+                                                          volume.obj_context)
+            self._update_provisioned_capacity(volume.name, volume.size)
+            return volume_update
 
         size = int(volume.size) * units.Gi
 
@@ -792,6 +1012,7 @@ class RBDDriver(driver.CloneableImageVD,
                 err_msg = (_('Failed to enable image replication'))
                 raise exception.ReplicationError(reason=err_msg,
                                                  volume_id=volume.id)
+        self._update_provisioned_capacity(volume.name, volume.size)
         return volume_update
 
     def _flatten(self, pool, volume_name):
@@ -844,6 +1065,7 @@ class RBDDriver(driver.CloneableImageVD,
             self._flatten(self.configuration.rbd_pool, volume.name)
         if int(volume.size):
             self._resize(volume)
+        self._update_provisioned_capacity(volume.name, volume.size)
         return volume_update
 
     def _delete_backup_snaps(self, rbd_image):
@@ -991,6 +1213,8 @@ class RBDDriver(driver.CloneableImageVD,
                              "operation to proceed.", volume_name)
                     return
 
+                self._update_provisioned_capacity(volume_name, -volume.size)
+
                 # If it is a clone, walk back up the parent chain deleting
                 # references.
                 if parent:
@@ -1196,6 +1420,8 @@ class RBDDriver(driver.CloneableImageVD,
                    for volume, is_demoted in zip(volumes, demotion_results)]
         self._active_backend_id = secondary_id
         self._active_config = remote
+        # Recalculate the provisioned capacity for the new cluster
+        self._provisioned_capacity = None
         LOG.info('RBD driver failover completed.')
         return secondary_id, updates, []
 
@@ -1322,6 +1548,8 @@ class RBDDriver(driver.CloneableImageVD,
                     volume_update = self._clone(volume, pool, image, snapshot)
                     volume_update['provider_location'] = None
                     self._resize(volume)
+                    self._update_provisioned_capacity(volume['name'],
+                                                      volume['size'])
                     return volume_update, True
         return ({}, False)
 
@@ -1400,6 +1628,7 @@ class RBDDriver(driver.CloneableImageVD,
             args.extend(self._ceph_args())
             self._try_execute(*args)
         self._resize(volume)
+        self._update_provisioned_capacity(volume.name, volume.size)
         # We may need to re-enable replication because we have deleted the
         # original image and created a new one using the command line import.
         try:
@@ -1436,6 +1665,8 @@ class RBDDriver(driver.CloneableImageVD,
             LOG.error(msg)
             raise exception.VolumeBackendAPIException(data=msg)
 
+        self._update_provisioned_capacity(volume.name,
+                                          int(new_size) - old_size)
         LOG.debug("Extend volume from %(old_size)s GB to %(new_size)s GB.",
                   {'old_size': old_size, 'new_size': new_size})
 
@@ -1514,13 +1745,14 @@ class RBDDriver(driver.CloneableImageVD,
 
     def get_manageable_volumes(self, cinder_volumes, marker, limit, offset,
                                sort_keys, sort_dirs):
-        manageable_volumes = []
-        cinder_ids = [resource['id'] for resource in cinder_volumes]
+        cinder_ids = {resource['id'] for resource in cinder_volumes}
 
         with RADOSClient(self) as client:
-            for image_name in self.RBDProxy().list(client.ioctx):
+            def get_image_info(image_name):
                 image_id = volume_utils.extract_id_from_volume_name(image_name)
-                with RBDVolumeProxy(self, image_name, read_only=True) as image:
+                with RBDVolumeProxy(self, image_name, read_only=True,
+                                    client=client.cluster,
+                                    ioctx=client.ioctx) as image:
                     try:
                         image_info = {
                             'reference': {'source-name': image_name},
@@ -1542,12 +1774,13 @@ class RBDDriver(driver.CloneableImageVD,
                         else:
                             image_info['safe_to_manage'] = True
                             image_info['reason_not_safe'] = None
-                        manageable_volumes.append(image_info)
+                        return image_info
                     except self.rbd.ImageNotFound:
                         LOG.debug("Image %s is not found.", image_name)
 
-        return volume_utils.paginate_entries_list(
-            manageable_volumes, marker, limit, offset, sort_keys, sort_dirs)
+            return volume_utils.paginate_manageable_entries(
+                self.RBDProxy().list(client.ioctx), get_image_info, marker,
+                limit, offset, sort_keys, sort_dirs)
 
     def unmanage(self, volume):
         pass
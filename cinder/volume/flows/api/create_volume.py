@@ -724,11 +724,14 @@ class VolumeCastTask(flow_utils.CinderTask):
     This will signal a transition of the api workflow to another child and/or
     related workflow on another component.
 
+    When a batch list is provided the request is appended to it instead of
+    being cast, so the batch can be scheduled in a single pass.
+
     Reversion strategy: rollback source volume status and error out newly
     created volume.
     """
 
-    def __init__(self, scheduler_rpcapi, volume_rpcapi, db):
+    def __init__(self, scheduler_rpcapi, volume_rpcapi, db, batch=None):
         requires = ['image_id', 'scheduler_hints', 'snapshot_id',
                     'source_volid', 'volume_id', 'volume', 'volume_type',
                     'volume_properties', 'consistencygroup_id',
@@ -738,6 +741,7 @@ class VolumeCastTask(flow_utils.CinderTask):
         self.volume_rpcapi = volume_rpcapi
         self.scheduler_rpcapi = scheduler_rpcapi
         self.db = db
+        self.batch = batch
 
     def _cast_create_volume(self, context, request_spec, filter_properties):
         source_volid = request_spec['source_volid']
@@ -796,6 +800,9 @@ class VolumeCastTask(flow_utils.CinderTask):
         filter_properties = {}
         if scheduler_hints:
             filter_properties['scheduler_hints'] = scheduler_hints
+        if self.batch is not None:
+            self.batch.append((request_spec, filter_properties))
+            return
         self._cast_create_volume(context, request_spec, filter_properties)
 
     def revert(self, context, result, flow_failures, volume, **kwargs):
@@ -813,7 +820,7 @@ class VolumeCastTask(flow_utils.CinderTask):
 
 
 def get_flow(db_api, image_service_api, availability_zones, create_what,
-             scheduler_rpcapi=None, volume_rpcapi=None):
+             scheduler_rpcapi=None, volume_rpcapi=None, batch=None):
     """Constructs and returns the api entrypoint flow.
 
     This flow will do the following:
@@ -823,7 +830,8 @@ def get_flow(db_api, image_service_api, availability_zones, create_what,
     3. Reserves the quota (reverts quota on any failures).
     4. Creates the database entry.
     5. Commits the quota.
-    6. Casts to volume manager or scheduler for further processing.
+    6. Casts to volume manager or scheduler for further processing, or adds
+       the request to the batch when one is provided.
     """
 
     flow_name = ACTION.replace(":", "_") + "_api"
@@ -842,7 +850,8 @@ def get_flow(db_api, image_service_api, availability_zones, create_what,
     if scheduler_rpcapi and volume_rpcapi:
         # This will cast it out to either the scheduler or volume manager via
         # the rpc apis provided.
-        api_flow.add(VolumeCastTask(scheduler_rpcapi, volume_rpcapi, db_api))
+        api_flow.add(VolumeCastTask(scheduler_rpcapi, volume_rpcapi, db_api,
+                                    batch))
 
     # Now load (but do not run) the flow using the provided initial data.
     return taskflow.engines.load(api_flow, store=create_what)
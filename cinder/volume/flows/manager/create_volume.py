@@ -10,6 +10,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import os
 import traceback
 
@@ -31,6 +32,7 @@ from cinder import flow_utils
 from cinder.i18n import _
 from cinder.image import glance
 from cinder.image import image_utils
+from cinder.image import local_cache
 from cinder.message import api as message_api
 from cinder.message import message_field
 from cinder import objects
@@ -717,6 +719,32 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
                         '%(exception)s', {'exception': e})
         return None, False
 
+    @contextlib.contextmanager
+    def _fetch_image_virtual_size(self, context, image_service, image_id,
+                                  image_meta, backend_name):
+        """Fetch the image to download to the volume, yield its size.
+
+        The images converted to raw in the local cache of the node and the
+        raw images streamed to the volume aren't fetched.
+        """
+        checksum = image_meta.get('checksum')
+        if image_utils.can_stream_image(image_meta):
+            # The virtual size of raw images is their size
+            yield image_meta['size']
+            return
+
+        cache = local_cache.LocalImageCache.from_config()
+        cached_size = cache.get_size(image_id, checksum) if (
+            cache and checksum) else None
+        if cached_size is not None:
+            yield cached_size
+            return
+
+        with image_utils.TemporaryImages.fetch(
+                image_service, context, image_id, backend_name,
+                checksum=checksum) as tmp_image:
+            yield image_utils.qemu_img_info(tmp_image).virtual_size
+
     @coordination.synchronized('{image_id}')
     def _create_from_image_cache_or_download(self, context, volume,
                                              image_location, image_id,
@@ -730,9 +758,11 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
                 os.path.exists(CONF.image_conversion_dir)):
             os.makedirs(CONF.image_conversion_dir)
         try:
-            image_utils.check_available_space(
-                CONF.image_conversion_dir,
-                image_meta['size'], image_id)
+            # Raw images streamed to the volume don't need the space
+            if not image_utils.can_stream_image(image_meta):
+                image_utils.check_available_space(
+                    CONF.image_conversion_dir,
+                    image_meta['size'], image_id)
         except exception.ImageTooBig as err:
             with excutils.save_and_reraise_exception():
                 self.message.create(
@@ -774,16 +804,14 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
         try:
             if not cloned:
                 try:
-                    with image_utils.TemporaryImages.fetch(
-                            image_service, context, image_id,
-                            backend_name) as tmp_image:
+                    with self._fetch_image_virtual_size(
+                            context, image_service, image_id, image_meta,
+                            backend_name) as image_virtual_size:
                         # Try to create the volume as the minimal size,
                         # then we can extend once the image has been
                         # downloaded.
-                        data = image_utils.qemu_img_info(tmp_image)
-
                         virtual_size = image_utils.check_virtual_size(
-                            data.virtual_size, volume.size, image_id)
+                            image_virtual_size, volume.size, image_id)
 
                         if should_create_cache_entry:
                             if virtual_size and virtual_size != original_size:
@@ -870,15 +898,20 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
                                                             image_location,
                                                             image_meta)
 
-        # Try and use the image cache, and download if not cached.
+        # Try and use the image cache, and download if not cached.  The
+        # requests for the same image waiting meanwhile share the download.
         if not cloned:
-            model_update = self._create_from_image_cache_or_download(
-                context,
-                volume,
-                image_location,
-                image_id,
-                image_meta,
-                image_service)
+            backend_name = volume_utils.extract_host(
+                volume.service_topic_queue)
+            with image_utils.TemporaryImages.shared(
+                    image_id, image_meta.get('checksum'), backend_name):
+                model_update = self._create_from_image_cache_or_download(
+                    context,
+                    volume,
+                    image_location,
+                    image_id,
+                    image_meta,
+                    image_service)
 
         self._handle_bootable_volume_glance_meta(context, volume,
                                                  image_id=image_id,
@@ -476,6 +476,11 @@ class VolumeManager(manager.CleanableManager,
         backend_name = vol_utils.extract_host(self.service_topic_queue)
         image_utils.cleanup_temporary_file(backend_name)
 
+        # Finish deleting the image-volumes evicted from the cache before
+        # the service stopped.
+        if self.image_volume_cache:
+            self.image_volume_cache.resume_evictions(ctxt, volumes)
+
         # Migrate any ConfKeyManager keys based on fixed_key to the currently
         # configured key manager.
         self._add_to_threadpool(key_migration.migrate_fixed_key, volumes)
@@ -851,7 +856,7 @@ class VolumeManager(manager.CleanableManager,
                 QUOTAS.commit(context, reservations, project_id=project_id)
 
             self._update_allocated_capacity(volume, decrement=True)
-            self.publish_service_capabilities(context)
+            self._report_service_capabilities(context)
 
         msg = "Deleted volume successfully."
         if unmanage_only:
@@ -1349,6 +1354,7 @@ class VolumeManager(manager.CleanableManager,
         in the volume described by the volume_ref.
         """
         image_volume = None
+        reserved = False
         try:
             if not self.image_volume_cache.ensure_space(ctx, volume_ref):
                 LOG.warning('Unable to ensure space for image-volume in'
@@ -1357,6 +1363,7 @@ class VolumeManager(manager.CleanableManager,
                             {'image': image_id,
                              'service': volume_ref.service_topic_queue})
                 return
+            reserved = True
 
             image_volume = self._clone_image_volume(ctx,
                                                     volume_ref,
@@ -1378,6 +1385,9 @@ class VolumeManager(manager.CleanableManager,
                         ' Error: %(exception)s', {'exception': e})
             if image_volume:
                 self.delete_volume(ctx, image_volume)
+        finally:
+            if reserved:
+                self.image_volume_cache.release_space(volume_ref)
 
     def _clone_image_volume(self, ctx, volume, image_meta):
         volume_type_id = volume.get('volume_type_id')
@@ -2500,11 +2510,16 @@ class VolumeManager(manager.CleanableManager,
         return volume_stats
 
     @periodic_task.periodic_task
-    def publish_service_capabilities(self, context):
-        """Collect driver status and then publish."""
+    def _report_service_capabilities(self, context):
+        """Collect driver status and then publish what changed."""
         self._report_driver_status(context)
         self._publish_service_capabilities(context)
 
+    def publish_service_capabilities(self, context):
+        """Collect driver status and then publish all of it."""
+        self.resync_service_capabilities()
+        self._report_service_capabilities(context)
+
     def _notify_about_volume_usage(self,
                                    context,
                                    volume,
@@ -2776,7 +2791,7 @@ class VolumeManager(manager.CleanableManager,
         self._notify_about_volume_usage(
             context, volume, "retype",
             extra_usage_info={'volume_type': new_type_id})
-        self.publish_service_capabilities(context)
+        self._report_service_capabilities(context)
         LOG.info("Retype volume completed successfully.",
                  resource=volume)
 
@@ -3400,7 +3415,7 @@ class VolumeManager(manager.CleanableManager,
         group.destroy()
         self._notify_about_group_usage(
             context, group, "delete.end")
-        self.publish_service_capabilities(context)
+        self._report_service_capabilities(context)
         LOG.info("Delete group "
                  "completed successfully.",
                  resource={'type': 'group',
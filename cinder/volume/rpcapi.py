@@ -234,8 +234,11 @@ class VolumeAPI(rpc.RPCAPI):
         cctxt = self._get_cctxt(volume.service_topic_queue)
         cctxt.cast(ctxt, 'remove_export', volume_id=volume['id'])
 
-    def publish_service_capabilities(self, ctxt):
-        cctxt = self._get_cctxt(fanout=True)
+    def publish_service_capabilities(self, ctxt, host=None):
+        if host:
+            cctxt = self._get_cctxt(host)
+        else:
+            cctxt = self._get_cctxt(fanout=True)
         cctxt.cast(ctxt, 'publish_service_capabilities')
 
     def accept_transfer(self, ctxt, volume, new_user, new_project):
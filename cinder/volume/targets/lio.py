@@ -10,6 +10,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
+from eventlet import event
 from oslo_concurrency import processutils as putils
 from oslo_log import log as logging
 
@@ -29,6 +31,19 @@ class LioAdm(iscsi.ISCSITarget):
         # FIXME(jdg): modify executor to use the cinder-rtstool
         self.iscsi_target_prefix =\
             self.configuration.safe_get('target_prefix')
+        self._persist_delay = (
+            self.configuration.safe_get('target_persist_delay') or 0)
+
+        # In-memory view of the targets, loaded from cinder-rtstool on the
+        # first lookup and then kept up to date by our own changes.
+        self._targets = None
+        # Changes made to the targets and changes known to be saved, a
+        # save being scheduled at most once per persist delay. The event is
+        # sent once the scheduled save is done.
+        self._config_generation = 0
+        self._saved_generation = 0
+        self._persist_thread = None
+        self._persist_done = None
 
         self._verify_rtstool()
 
@@ -51,21 +66,20 @@ class LioAdm(iscsi.ISCSITarget):
         return utils.execute(*args, **kwargs)
 
     def _get_target(self, iqn):
-        (out, err) = self._execute('cinder-rtstool',
-                                   'get-targets',
-                                   run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
-            if iqn in line:
-                return line
+        for target in self._get_targets():
+            if iqn in target:
+                return target
 
         return None
 
     def _get_targets(self):
-        (out, err) = self._execute('cinder-rtstool',
-                                   'get-targets',
-                                   run_as_root=True)
-        return out
+        if self._targets is None:
+            (out, err) = self._execute('cinder-rtstool',
+                                       'get-targets',
+                                       run_as_root=True)
+            self._targets = set(line.strip() for line in out.split('\n')
+                                if line.strip())
+        return self._targets
 
     def _get_iscsi_target(self, context, vol_id):
         return 0
@@ -75,18 +89,55 @@ class LioAdm(iscsi.ISCSITarget):
         iscsi_target = 0  # NOTE: Not used by lio.
         return iscsi_target, lun
 
-    def _persist_configuration(self, vol_id):
+    def _persist_configuration(self, vol_id, wait=False):
+        """Save the LIO configuration after a change for the volume.
+
+        With a persist delay the save is deferred, so that all the changes
+        made meanwhile are saved at once. Since a save writes the whole
+        current configuration, it never reorders changes. Changes of the
+        access to targets wait for the save that includes them with wait, so
+        that a restore after a crash can't bring back a removed target or
+        initiator, nor lose the initiators of attached hosts, while
+        ensure_export recreates the targets added since the last save.
+        """
+        self._config_generation += 1
+        if not self._persist_delay:
+            self._save_configuration(vol_id)
+            return
+
+        if self._persist_thread is None:
+            self._persist_done = event.Event()
+            self._persist_thread = eventlet.spawn_after(
+                self._persist_delay, self._save_pending_configuration)
+        if wait:
+            # The scheduled save starts after this change, so it includes it
+            self._persist_done.wait()
+
+    def _save_pending_configuration(self):
+        done = self._persist_done
+        self._persist_thread = None
+        self._persist_done = None
+        if self._saved_generation < self._config_generation:
+            self._save_configuration(None)
+        done.send()
+
+    def _save_configuration(self, vol_id):
+        # The save includes every change made before it starts
+        generation = self._config_generation
         try:
             self._execute('cinder-rtstool', 'save', run_as_root=True)
 
         # On persistence failure we don't raise an exception, as target has
-        # been successfully created.
+        # been successfully created.  The next change saves it again.
         except putils.ProcessExecutionError:
             LOG.warning("Failed to save iscsi LIO configuration when "
                         "modifying volume id: %(vol_id)s.",
                         {'vol_id': vol_id})
+            return
+        self._saved_generation = max(self._saved_generation, generation)
 
     def _restore_configuration(self):
+        self._targets = None
         try:
             self._execute('cinder-rtstool', 'restore', run_as_root=True)
 
@@ -131,6 +182,11 @@ class LioAdm(iscsi.ISCSITarget):
             raise exception.ISCSITargetCreateFailed(volume_id=vol_id)
 
         iqn = '%s%s' % (self.iscsi_target_prefix, vol_id)
+        if self._targets is not None:
+            # cinder-rtstool create fails when the target can't be created,
+            # so the view is updated without loading all the targets again.
+            self._targets.add(iqn)
+        # Otherwise loading the view checks that the target was created
         tid = self._get_target(iqn)
         if tid is None:
             LOG.error("Failed to create iscsi target for volume id:%s.",
@@ -157,8 +213,11 @@ class LioAdm(iscsi.ISCSITarget):
                           vol_id)
             raise exception.ISCSITargetRemoveFailed(volume_id=vol_id)
 
+        if self._targets is not None:
+            self._targets.discard(iqn)
+
         # We make changes persistent
-        self._persist_configuration(vol_id)
+        self._persist_configuration(vol_id, wait=True)
 
     def initialize_connection(self, volume, connector):
         volume_iqn = volume['provider_location'].split(' ')[1]
@@ -181,7 +240,7 @@ class LioAdm(iscsi.ISCSITarget):
                 volume_id=volume['id'])
 
         # We make changes persistent
-        self._persist_configuration(volume['id'])
+        self._persist_configuration(volume['id'], wait=True)
 
         return super(LioAdm, self).initialize_connection(volume, connector)
 
@@ -206,7 +265,7 @@ class LioAdm(iscsi.ISCSITarget):
             raise exception.ISCSITargetDetachFailed(volume_id=volume['id'])
 
         # We make changes persistent
-        self._persist_configuration(volume['id'])
+        self._persist_configuration(volume['id'], wait=True)
 
     def ensure_export(self, context, volume, volume_path):
         """Recreate exports for logical volumes."""
@@ -215,6 +274,16 @@ class LioAdm(iscsi.ISCSITarget):
         if not self._get_targets():
             LOG.info('Restoring iSCSI target from configuration file')
             self._restore_configuration()
+            if not self._persist_delay:
+                return
+
+        # With a persist delay the saved configuration may miss the targets
+        # created just before the service stopped.
+        iqn = '%s%s' % (self.iscsi_target_prefix, volume['name'])
+        if self._persist_delay and self._get_target(iqn) is None:
+            LOG.info('Recreating missing iSCSI target for volume %s.',
+                     volume['id'])
+            super(LioAdm, self).ensure_export(context, volume, volume_path)
             return
 
         LOG.info("Skipping ensure_export. Found existing iSCSI target.")
@@ -44,37 +44,38 @@ class TgtAdm(iscsi.ISCSITarget):
                 </target>
                   """)
 
-    def _get_target(self, iqn):
+    @staticmethod
+    def _parse_targets(out):
+        """Parse the targets shown by tgtadm into {iqn: (tid, luns)}."""
+        targets = {}
+        luns = None
+        for line in out.split('\n'):
+            if line.startswith('Target '):
+                # Target 1: iqn.2010-10.org.openstack:volume-...
+                tid, _sep, iqn = line[len('Target '):].partition(': ')
+                luns = set()
+                targets[iqn.strip()] = (tid, luns)
+            elif luns is not None and line.strip().startswith('LUN: '):
+                luns.add(line.strip()[len('LUN: '):])
+        return targets
+
+    def _get_targets(self):
         (out, err) = utils.execute('tgt-admin', '--show', run_as_root=True)
-        lines = out.split('\n')
-        for line in lines:
-            if iqn in line:
-                parsed = line.split()
-                tid = parsed[1]
-                return tid[:-1]
+        return self._parse_targets(out)
 
-        return None
-
-    def _verify_backing_lun(self, iqn, tid):
-        backing_lun = True
-        capture = False
-        target_info = []
-
-        (out, err) = utils.execute('tgt-admin', '--show', run_as_root=True)
-        lines = out.split('\n')
-
-        for line in lines:
-            if iqn in line and "Target %s" % tid in line:
-                capture = True
-            if capture:
-                target_info.append(line)
-            if iqn not in line and 'Target ' in line:
-                capture = False
+    def _get_target(self, iqn, targets=None):
+        if targets is None:
+            targets = self._get_targets()
+        if iqn in targets:
+            return targets[iqn][0]
 
-        if '        LUN: 1' not in target_info:
-            backing_lun = False
+        return None
 
-        return backing_lun
+    def _verify_backing_lun(self, iqn, tid, targets=None):
+        if targets is None:
+            targets = self._get_targets()
+        target = targets.get(iqn)
+        return bool(target) and target[0] == tid and '1' in target[1]
 
     def _recreate_backing_lun(self, iqn, tid, name, path):
         LOG.warning('Attempting recreate of backing lun...')
@@ -215,9 +216,10 @@ class TgtAdm(iscsi.ISCSITarget):
                                    'target',
                                    run_as_root=True)
         LOG.debug("Targets after update: %s", out)
+        targets = self._parse_targets(out)
 
         iqn = '%s%s' % (self.iscsi_target_prefix, vol_id)
-        tid = self._get_target(iqn)
+        tid = self._get_target(iqn, targets=targets)
         if tid is None:
             LOG.warning("Failed to create iscsi target for Volume "
                         "ID: %(vol_id)s. It could be caused by problem "
@@ -233,7 +235,7 @@ class TgtAdm(iscsi.ISCSITarget):
         # or something related, so we're going to add some code
         # here that verifies the backing lun (lun 1) was created
         # and we'll try and recreate it if it's not there
-        if not self._verify_backing_lun(iqn, tid):
+        if not self._verify_backing_lun(iqn, tid, targets=targets):
             try:
                 self._recreate_backing_lun(iqn, tid, name, path)
             except putils.ProcessExecutionError:
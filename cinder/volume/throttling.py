@@ -17,9 +17,12 @@
 
 
 import contextlib
+import time
 
+import eventlet
 from oslo_concurrency import processutils
 from oslo_log import log as logging
+from oslo_utils import timeutils
 
 from cinder import exception
 from cinder import utils
@@ -27,6 +30,9 @@ from cinder import utils
 
 LOG = logging.getLogger(__name__)
 
+_native_threading = eventlet.patcher.original('threading')
+_native_time = eventlet.patcher.original('time')
+
 
 class Throttle(object):
     """Base class for throttling disk I/O bandwidth"""
@@ -44,6 +50,10 @@ class Throttle(object):
     def __init__(self, prefix=None):
         self.prefix = prefix or []
 
+    def get_rate_limiter(self):
+        """TokenBucket limiting copies made without a sub-command, if any."""
+        return None
+
     @contextlib.contextmanager
     def subcommand(self, srcpath, dstpath):
         """Sub-command that reads from srcpath and writes to dstpath.
@@ -63,6 +73,7 @@ class BlkioCgroup(Throttle):
         self.cgroup = cgroup_name
         self.srcdevs = {}
         self.dstdevs = {}
+        self._rate_limiter = TokenBucket(bps_limit)
 
         try:
             utils.execute('cgcreate', '-g', 'blkio:%s' % self.cgroup,
@@ -114,6 +125,9 @@ class BlkioCgroup(Throttle):
                 del self.dstdevs[dstdev]
             self._set_limits('write', self.dstdevs)
 
+    def get_rate_limiter(self):
+        return self._rate_limiter
+
     @contextlib.contextmanager
     def subcommand(self, srcpath, dstpath):
         srcdev = self._get_device_number(srcpath)
@@ -128,3 +142,39 @@ class BlkioCgroup(Throttle):
             yield {'prefix': ['cgexec', '-g', 'blkio:%s' % self.cgroup]}
         finally:
             self._dec_device(srcdev, dstdev)
+
+
+class TokenBucket(object):
+    """Pace the bytes written by in-process workers to a bandwidth budget.
+
+    Unlike the Throttle subclasses, which wrap a sub-command, the bucket is
+    shared by the callers themselves: each one consumes the bytes it is
+    about to write and sleeps while the bucket is in debt, so concurrent
+    callers share the rate between them.
+
+    Callers may be greenthreads or the native threads of tpool, so the
+    state of the bucket is guarded by a native lock, and callers running
+    in native threads pass native=True to sleep without eventlet.
+    """
+
+    def __init__(self, bps_limit, burst=None):
+        self.bps_limit = bps_limit
+        self.burst = burst or bps_limit
+        self._tokens = self.burst
+        self._last = timeutils.now()
+        self._lock = _native_threading.Lock()
+
+    def consume(self, nbytes, native=False):
+        with self._lock:
+            now = timeutils.now()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._last) * self.bps_limit)
+            self._last = now
+            self._tokens -= nbytes
+            delay = -self._tokens / float(self.bps_limit)
+        if delay > 0:
+            if native:
+                _native_time.sleep(delay)
+            else:
+                time.sleep(delay)
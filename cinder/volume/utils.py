@@ -16,19 +16,25 @@
 
 
 import ast
-import functools
+import contextlib
+import errno
+import heapq
+import io
 import json
-import math
+import mmap
 import operator
+import os
 from os import urandom
 import re
-import time
+import stat
+import sys
 import uuid
 
 from castellan.common.credentials import keystone_password
 from castellan.common import exception as castellan_exception
 from castellan import key_manager as castellan_key_manager
 import eventlet
+from eventlet import event
 from eventlet import tpool
 from keystoneauth1 import loading as ks_loading
 from oslo_concurrency import processutils
@@ -53,11 +59,35 @@ from cinder.volume import group_types
 from cinder.volume import throttling
 from cinder.volume import volume_types
 
+if os.name == 'nt':
+    fcntl = None
+else:
+    import fcntl
+
 
 CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
 
+# Volume copies between file objects run in native threads, which must not
+# use their monkey patched counterparts.
+_native_queue = eventlet.patcher.original(six.moves.queue.__name__)
+_native_threading = eventlet.patcher.original('threading')
+
+# Linux value, for Python versions that don't define it.
+_SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+
+# Errors of copy_file_range and sendfile for paths they can't copy between.
+_KERNEL_COPY_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                            errno.EOPNOTSUPP, errno.EBADF)
+
+# Seconds between progress callbacks of a copy between file objects.
+TRANSFER_PROGRESS_INTERVAL = 5
+
+# Smallest range zeroed by a blkdiscard call of a rate limited zeroout, so
+# that low bandwidth budgets don't turn into a fork per few MiB.
+ZEROOUT_MIN_CHUNK_IN_M = 64
+
 
 def null_safe_str(s):
     return str(s) if s else ''
@@ -488,6 +518,196 @@ def _copy_volume_with_path(prefix, srcstr, deststr, size_in_m, blocksize,
              {'size_in_m': size_in_m, 'mbps': mbps})
 
 
+@contextlib.contextmanager
+def _volume_path_access(path, mode):
+    """Give the service access to a volume path for the duration."""
+    if os.path.exists(path) and not os.access(path, mode):
+        with utils.temporary_chown(path):
+            yield
+    else:
+        yield
+
+
+def _open_direct(path, flags):
+    """Open a path with O_DIRECT, falling back to buffered I/O.
+
+    :returns: File descriptor and whether it uses O_DIRECT
+    """
+    try:
+        return os.open(path, flags | os.O_DIRECT), True
+    except OSError as err:
+        if err.errno != errno.EINVAL:
+            raise
+    return os.open(path, flags), False
+
+
+def _clear_direct(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+
+
+def _kernel_copy(src_fd, dest_fd, offset, length, chunk_size, rate_limiter):
+    """Copy with copy_file_range or sendfile, without going to user space.
+
+    :returns: Offset up to which the data was copied, which is the start
+              offset when the kernel can't copy between these files.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    for kernel_copy in (copy_file_range, sendfile):
+        if kernel_copy is None:
+            continue
+        os.lseek(dest_fd, offset, os.SEEK_SET)
+        try:
+            while offset < length:
+                count = min(chunk_size, length - offset)
+                if rate_limiter:
+                    rate_limiter.consume(count, native=True)
+                if kernel_copy is copy_file_range:
+                    copied = copy_file_range(src_fd, dest_fd, count,
+                                             offset, offset)
+                else:
+                    copied = sendfile(dest_fd, src_fd, offset, count)
+                if not copied:
+                    break
+                offset += copied
+            return offset
+        except OSError as err:
+            if err.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+    return offset
+
+
+def _buffered_copy(src_fd, dest_fd, offset, length, chunk_size, sparse,
+                   src_direct, dest_direct, rate_limiter):
+    """Copy through a page aligned buffer, as required by O_DIRECT.
+
+    With sparse, the holes of the source found with SEEK_DATA and the
+    chunks of zeros are skipped instead of being written.
+
+    :returns: Offset up to which the data was copied
+    """
+    buf = mmap.mmap(-1, chunk_size)
+    view = memoryview(buf)
+    src_file = io.FileIO(src_fd, 'r', closefd=False)
+    dest_file = io.FileIO(dest_fd, 'w', closefd=False)
+    zeros = bytes(bytearray(chunk_size)) if sparse else None
+
+    try:
+        while offset < length:
+            if sparse:
+                try:
+                    data_offset = os.lseek(src_fd, offset, _SEEK_DATA)
+                except OSError as err:
+                    # ENXIO means there is only a hole left, other errors
+                    # that the source doesn't report holes.
+                    data_offset = (length if err.errno == errno.ENXIO
+                                   else offset)
+                # Keep the offsets page aligned for O_DIRECT
+                data_offset -= data_offset % mmap.PAGESIZE
+                if data_offset > offset:
+                    offset = min(data_offset, length)
+                    continue
+
+            wanted = min(chunk_size, length - offset)
+            if src_direct and wanted % mmap.PAGESIZE:
+                _clear_direct(src_fd)
+                src_direct = False
+            os.lseek(src_fd, offset, os.SEEK_SET)
+            count = 0
+            while count < wanted:
+                read = src_file.readinto(view[count:wanted])
+                if not read:
+                    break
+                count += read
+            if not count:
+                break
+
+            if not (sparse and buf[:count] == zeros[:count]):
+                if dest_direct and count % mmap.PAGESIZE:
+                    _clear_direct(dest_fd)
+                    dest_direct = False
+                if rate_limiter:
+                    rate_limiter.consume(count, native=True)
+                os.lseek(dest_fd, offset, os.SEEK_SET)
+                written = 0
+                while written < count:
+                    written += dest_file.write(view[written:count])
+            offset += count
+            if count < wanted:
+                break
+    finally:
+        view.release()
+        buf.close()
+    return offset
+
+
+def _copy_volume_in_process(srcstr, deststr, size_in_m, blocksize,
+                            sync=False, sparse=False, rate_limiter=None):
+    """Copy between volume paths in the service instead of with dd.
+
+    The copy runs in a single tpool thread. It is done by the kernel with
+    copy_file_range or sendfile when it supports them for the two paths,
+    and through an O_DIRECT buffer otherwise or when the copy is sparse.
+    The rate_limiter is consumed by every chunk before it is written, from
+    the tpool thread.
+    """
+    chunk_size = int(strutils.string_to_bytes(
+        '%sB' % _check_blocksize(blocksize)))
+    # O_DIRECT needs page aligned offsets and lengths
+    chunk_size = max(mmap.PAGESIZE,
+                     chunk_size - chunk_size % mmap.PAGESIZE)
+    size_in_bytes = size_in_m * units.Mi
+
+    dest_flags = os.O_WRONLY
+    try:
+        dest_is_file = not stat.S_ISBLK(os.stat(deststr).st_mode)
+    except OSError:
+        dest_is_file = True
+        dest_flags |= os.O_CREAT
+    if dest_is_file:
+        # Like dd, overwrite files instead of writing over their content
+        dest_flags |= os.O_TRUNC
+
+    def copy(src_fd, src_direct, dest_fd, dest_direct):
+        offset = 0
+        if not sparse:
+            offset = _kernel_copy(src_fd, dest_fd, offset, size_in_bytes,
+                                  chunk_size, rate_limiter)
+        if offset < size_in_bytes:
+            offset = _buffered_copy(src_fd, dest_fd, offset, size_in_bytes,
+                                    chunk_size, sparse, src_direct,
+                                    dest_direct, rate_limiter)
+        if dest_is_file and os.fstat(dest_fd).st_size < offset:
+            # Extend the file over a skipped tail of zeros
+            os.ftruncate(dest_fd, offset)
+        if sync:
+            os.fdatasync(dest_fd)
+
+    start_time = timeutils.utcnow()
+    with _volume_path_access(srcstr, os.R_OK), \
+            _volume_path_access(deststr, os.W_OK):
+        src_fd, src_direct = _open_direct(srcstr, os.O_RDONLY)
+        try:
+            dest_fd, dest_direct = _open_direct(deststr, dest_flags)
+            try:
+                tpool.execute(copy, src_fd, src_direct, dest_fd, dest_direct)
+            finally:
+                os.close(dest_fd)
+        finally:
+            os.close(src_fd)
+    duration = max(1, timeutils.delta_seconds(start_time, timeutils.utcnow()))
+
+    LOG.debug("Volume copy details: src %(src)s, dest %(dest)s, "
+              "size %(sz).2f MB, duration %(duration).2f sec",
+              {"src": srcstr,
+               "dest": deststr,
+               "sz": size_in_m,
+               "duration": duration})
+    LOG.info("Volume copy %(size_in_m).2f MB at %(mbps).2f MB/s",
+             {'size_in_m': size_in_m, 'mbps': size_in_m / duration})
+
+
 def _open_volume_with_path(path, mode):
     try:
         with utils.temporary_chown(path):
@@ -497,38 +717,174 @@ def _open_volume_with_path(path, mode):
         LOG.error("Failed to open volume from %(path)s.", {'path': path})
 
 
-def _transfer_data(src, dest, length, chunk_size):
-    """Transfer data between files (Python IO objects)."""
+class _BulkCopy(object):
+    """Copy between two file objects (Python IO objects) in native threads.
+
+    The native thread running ``run`` writes the data while a second native
+    thread reads ahead into the other one of two reusable buffers, so that
+    reading a chunk overlaps with writing the previous one. Neither of them
+    goes through eventlet, they only exchange the buffers through native
+    queues.
 
-    chunks = int(math.ceil(length / chunk_size))
-    remaining_length = length
+    With sparse, chunks that are all zeros are skipped by seeking the
+    destination instead of being written, when the destination is seekable.
+    This must only be used when the destination is known to read as zeros,
+    like a newly created thin volume.
+    """
 
-    LOG.debug("%(chunks)s chunks of %(bytes)s bytes to be transferred.",
-              {'chunks': chunks, 'bytes': chunk_size})
+    def __init__(self, src, dest, length, chunk_size, sparse=False):
+        self.src = src
+        self.dest = dest
+        self.length = length
+        self.chunk_size = chunk_size
+        self.sparse = sparse
+        self.copied = 0
+        self._readinto = True
+        self._write_views = True
+        self._free = _native_queue.Queue()
+        self._filled = _native_queue.Queue()
+        for _buf in range(2):
+            self._free.put(bytearray(chunk_size))
+
+    def _read(self, view):
+        """Fill a buffer view from the source, up to EOF."""
+        done = 0
+        while done < len(view):
+            if self._readinto:
+                try:
+                    count = self.src.readinto(view[done:])
+                except NotImplementedError:
+                    # RawIOBase subclasses may only implement read()
+                    self._readinto = False
+                    continue
+            else:
+                data = self.src.read(len(view) - done)
+                count = len(data)
+                view[done:done + count] = data
+            if not count:
+                break
+            done += count
+        return done
 
-    for chunk in range(0, chunks):
-        before = time.time()
-        data = tpool.execute(src.read, min(chunk_size, remaining_length))
+    def _read_all(self):
+        remaining = self.length
+        try:
+            while remaining > 0:
+                buf = self._free.get()
+                if buf is None:
+                    # The writer has given up
+                    return
+                wanted = min(self.chunk_size, remaining)
+                count = self._read(memoryview(buf)[:wanted])
+                if count:
+                    self._filled.put((buf, count, None))
+                if count < wanted:
+                    break
+                remaining -= count
+            self._filled.put((None, 0, None))
+        except Exception:
+            self._filled.put((None, 0, sys.exc_info()))
+
+    def _write(self, view):
+        if not self._write_views:
+            view = view.tobytes()
+        while len(view):
+            try:
+                written = self.dest.write(view)
+            except TypeError:
+                if not self._write_views:
+                    raise
+                # Some file objects, like RBD images, only take bytes
+                self._write_views = False
+                view = view.tobytes()
+                continue
+            if written is None:
+                # Python 2 file objects write everything and return None
+                break
+            view = view[written:]
 
-        # If we have reached end of source, discard any extraneous bytes from
-        # destination volume if trim is enabled and stop writing.
-        if data == b'':
-            break
+    def _is_dest_seekable(self):
+        try:
+            return self.dest.seekable()
+        except (AttributeError, IOError, ValueError):
+            return False
+
+    def _write_all(self):
+        zeros = None
+        if self.sparse and self._is_dest_seekable():
+            zeros = bytes(bytearray(self.chunk_size))
+        skipped = False
+
+        while True:
+            buf, count, exc_info = self._filled.get()
+            if exc_info:
+                six.reraise(*exc_info)
+            if buf is None:
+                break
+            # startswith compares with memcmp, unlike memoryview equality
+            if zeros is not None and buf.startswith(zeros[:count]):
+                self.dest.seek(count, io.SEEK_CUR)
+                skipped = True
+            else:
+                self._write(memoryview(buf)[:count])
+                skipped = False
+            self.copied += count
+            self._free.put(buf)
+
+        if skipped:
+            # Write the last byte so that the skipped tail of a file is
+            # allocated as a hole instead of being missing.
+            self.dest.seek(-1, io.SEEK_CUR)
+            self._write(memoryview(b'\0'))
+        self.dest.flush()
+
+    def run(self):
+        reader = _native_threading.Thread(target=self._read_all)
+        reader.daemon = True
+        reader.start()
+        try:
+            self._write_all()
+        finally:
+            # Release a reader waiting for a buffer if the writes failed
+            self._free.put(None)
+            reader.join()
 
-        tpool.execute(dest.write, data)
-        remaining_length -= len(data)
-        delta = (time.time() - before)
-        rate = (chunk_size / delta) / units.Ki
-        LOG.debug("Transferred chunk %(chunk)s of %(chunks)s (%(rate)dK/s).",
-                  {'chunk': chunk + 1, 'chunks': chunks, 'rate': rate})
 
-        # yield to any other pending operations
-        eventlet.sleep(0)
+def _transfer_data(src, dest, length, chunk_size, sparse=False,
+                   progress_callback=None):
+    """Transfer data between files (Python IO objects).
 
-    tpool.execute(dest.flush)
+    The whole copy is handed over to a single tpool thread (see _BulkCopy)
+    instead of dispatching every read and write to tpool.
 
+    :param progress_callback: Called from the calling greenthread with the
+                              number of bytes copied, every
+                              TRANSFER_PROGRESS_INTERVAL seconds and once
+                              the copy is complete.
+    """
 
-def _copy_volume_with_file(src, dest, size_in_m):
+    LOG.debug("%(length)s bytes to be transferred in chunks of %(bytes)s "
+              "bytes.", {'length': length, 'bytes': chunk_size})
+
+    copier = _BulkCopy(src, dest, length, chunk_size, sparse=sparse)
+    if progress_callback is None:
+        tpool.execute(copier.run)
+        return
+
+    done = event.Event()
+    copy_thread = eventlet.spawn(tpool.execute, copier.run)
+    copy_thread.link(lambda _thread: done.send())
+    while True:
+        with eventlet.Timeout(TRANSFER_PROGRESS_INTERVAL, False):
+            done.wait()
+        if done.ready():
+            break
+        progress_callback(copier.copied)
+    copy_thread.wait()
+    progress_callback(copier.copied)
+
+
+def _copy_volume_with_file(src, dest, size_in_m, sparse=False):
     src_handle = src
     if isinstance(src, six.string_types):
         src_handle = _open_volume_with_path(src, 'rb')
@@ -547,7 +903,12 @@ def _copy_volume_with_file(src, dest, size_in_m):
 
     start_time = timeutils.utcnow()
 
-    _transfer_data(src_handle, dest_handle, size_in_m * units.Mi, units.Mi * 4)
+    def log_progress(copied):
+        LOG.debug("Transferred %(copied)s of %(length)s bytes.",
+                  {'copied': copied, 'length': size_in_m * units.Mi})
+
+    _transfer_data(src_handle, dest_handle, size_in_m * units.Mi, units.Mi * 4,
+                   sparse=sparse, progress_callback=log_progress)
 
     duration = max(1, timeutils.delta_seconds(start_time, timeutils.utcnow()))
 
@@ -576,25 +937,73 @@ def copy_volume(src, dest, size_in_m, blocksize, sync=False,
     of type RawIOBase or any derivative that supports file operations such as
     read and write.  In this case, the handles are treated as file handles
     instead of file paths and, at present moment, throttling is unavailable.
+
+    Copies between paths run dd, unless volume_copy_method is native, in
+    which case they are made by the service itself, paced by the rate
+    limiter of the throttle instead of its sub-command prefix.
     """
 
     if (isinstance(src, six.string_types) and
             isinstance(dest, six.string_types)):
         if not throttle:
             throttle = throttling.Throttle.get_default()
+        if (CONF.volume_copy_method == 'native' and not ionice and
+                execute is utils.execute):
+            _copy_volume_in_process(src, dest, size_in_m, blocksize,
+                                    sync=sync, sparse=sparse,
+                                    rate_limiter=throttle.get_rate_limiter())
+            return
         with throttle.subcommand(src, dest) as throttle_cmd:
             _copy_volume_with_path(throttle_cmd['prefix'], src, dest,
                                    size_in_m, blocksize, sync=sync,
                                    execute=execute, ionice=ionice,
                                    sparse=sparse)
     else:
-        _copy_volume_with_file(src, dest, size_in_m)
+        _copy_volume_with_file(src, dest, size_in_m, sparse=sparse)
+
+
+def zeroout_volume(volume_path, size_in_m, execute=utils.execute,
+                   ionice=None, rate_limiter=None):
+    """Zero the start of a block device with the BLKZEROOUT ioctl.
+
+    blkdiscard --zeroout has the kernel zero the range itself, offloading
+    it to the device with WRITE ZEROES or WRITE SAME when supported, instead
+    of copying /dev/zero through user space like dd does.
+
+    With a rate_limiter the range is zeroed in chunks of about a second of
+    its bandwidth, each one consumed from the limiter before it is zeroed.
+    """
+    chunk_in_m = size_in_m
+    if rate_limiter:
+        chunk_in_m = max(ZEROOUT_MIN_CHUNK_IN_M,
+                         rate_limiter.bps_limit // units.Mi)
+
+    offset_in_m = 0
+    while offset_in_m < size_in_m:
+        length_in_m = min(chunk_in_m, size_in_m - offset_in_m)
+        if rate_limiter:
+            rate_limiter.consume(length_in_m * units.Mi)
+        cmd = ['blkdiscard', '--zeroout',
+               '--offset', six.text_type(offset_in_m * units.Mi),
+               '--length', six.text_type(length_in_m * units.Mi),
+               volume_path]
+        if ionice:
+            cmd = ['ionice', ionice] + cmd
+        execute(*cmd, run_as_root=True)
+        offset_in_m += length_in_m
 
 
 def clear_volume(volume_size, volume_path, volume_clear=None,
                  volume_clear_size=None, volume_clear_ionice=None,
-                 throttle=None):
-    """Unprovision old volumes to prevent data leaking between users."""
+                 throttle=None, zeroout=False, rate_limiter=None):
+    """Unprovision old volumes to prevent data leaking between users.
+
+    With zeroout the volume is zeroed with blkdiscard --zeroout, falling
+    back to dd when the device or the host doesn't support it. dd is used
+    when the copies are throttled by a prefix command, which can't apply to
+    blkdiscard. The rate limiter of the default throttle, such as the one
+    of a blkio cgroup, limits blkdiscard when no rate_limiter is given.
+    """
     if volume_clear is None:
         volume_clear = CONF.volume_clear
 
@@ -609,19 +1018,36 @@ def clear_volume(volume_size, volume_path, volume_clear=None,
 
     LOG.info("Performing secure delete on volume: %s", volume_path)
 
-    # We pass sparse=False explicitly here so that zero blocks are not
-    # skipped in order to clear the volume.
-    if volume_clear == 'zero':
-        return copy_volume('/dev/zero', volume_path, volume_clear_size,
-                           CONF.volume_dd_blocksize,
-                           sync=True, execute=utils.execute,
-                           ionice=volume_clear_ionice,
-                           throttle=throttle, sparse=False)
-    else:
+    if volume_clear != 'zero':
         raise exception.InvalidConfigurationValue(
             option='volume_clear',
             value=volume_clear)
 
+    if zeroout and throttle is None:
+        # blkdiscard can't run with the prefix of a throttle, but it
+        # consumes the rate limiter of the default one, like the copies made
+        # without dd.
+        default_throttle = throttling.Throttle.get_default()
+        default_limiter = default_throttle.get_rate_limiter()
+        if default_limiter is not None or not default_throttle.prefix:
+            try:
+                return zeroout_volume(
+                    volume_path, volume_clear_size, execute=utils.execute,
+                    ionice=volume_clear_ionice,
+                    rate_limiter=rate_limiter or default_limiter)
+            except processutils.ProcessExecutionError as err:
+                LOG.info("Unable to zero out volume %(path)s with "
+                         "blkdiscard, falling back to dd: %(err)s",
+                         {'path': volume_path, 'err': err})
+
+    # We pass sparse=False explicitly here so that zero blocks are not
+    # skipped in order to clear the volume.
+    return copy_volume('/dev/zero', volume_path, volume_clear_size,
+                       CONF.volume_dd_blocksize,
+                       sync=True, execute=utils.execute,
+                       ionice=volume_clear_ionice,
+                       throttle=throttle, sparse=False)
+
 
 def supports_thin_provisioning():
     return brick_lvm.LVM.supports_thin_provisioning(
@@ -807,6 +1233,25 @@ def extract_id_from_snapshot_name(snap_name):
     return match.group('uuid') if match else None
 
 
+class _Descending(object):
+    """Sort key wrapper that reverses the order of a value."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+
+# Selecting the first entries with a heap is only faster than sorting them
+# all when the page is small compared to the number of entries.
+_PAGINATE_HEAP_RATIO = 8
+
+
 def paginate_entries_list(entries, marker, limit, offset, sort_keys,
                           sort_dirs):
     """Paginate a list of entries.
@@ -819,48 +1264,98 @@ def paginate_entries_list(entries, marker, limit, offset, sort_keys,
     :sort_keys: A list of keys in the dictionaries to sort by
     :sort_dirs: A list of sort directions, where each is either 'asc' or 'dec'
     """
-    comparers = [(operator.itemgetter(key.strip()), multiplier)
-                 for (key, multiplier) in zip(sort_keys, sort_dirs)]
-
-    def comparer(left, right):
-        for fn, d in comparers:
-            left_val = fn(left)
-            right_val = fn(right)
-            if isinstance(left_val, dict):
-                left_val = sorted(left_val.values())[0]
-            if isinstance(right_val, dict):
-                right_val = sorted(right_val.values())[0]
-            if left_val == right_val:
-                continue
-            if d == 'asc':
-                return -1 if left_val < right_val else 1
-            else:
-                return -1 if left_val > right_val else 1
-        else:
-            return 0
-    sorted_entries = sorted(entries, key=functools.cmp_to_key(comparer))
+    getters = [(operator.itemgetter(key.strip()), direction == 'asc')
+               for (key, direction) in zip(sort_keys, sort_dirs)]
+
+    def sort_key(entry):
+        key = []
+        for getter, ascending in getters:
+            value = getter(entry)
+            if isinstance(value, dict):
+                value = min(value.values())
+            key.append(value if ascending else _Descending(value))
+        return tuple(key)
+
+    # Entries with the same sort key keep their relative order
+    decorated = [(sort_key(entry), i) for i, entry in enumerate(entries)]
 
-    start_index = 0
     if offset is None:
         offset = 0
     if marker:
-        if not isinstance(marker, dict):
-            try:
-                marker = json.loads(marker)
-            except ValueError:
-                msg = _('marker %s can not be analysed, please use json like '
-                        'format') % marker
-                raise exception.InvalidInput(reason=msg)
-        start_index = -1
-        for i, entry in enumerate(sorted_entries):
-            if entry['reference'] == marker:
-                start_index = i + 1
-                break
-        if start_index < 0:
+        marker = _load_marker(marker)
+        marker_keys = [decorated[i] for i, entry in enumerate(entries)
+                       if entry['reference'] == marker]
+        if not marker_keys:
+            msg = _('marker not found: %s') % marker
+            raise exception.InvalidInput(reason=msg)
+        marker_key = min(marker_keys)
+        decorated = [key for key in decorated if marker_key < key]
+
+    needed = offset + limit
+    if needed * _PAGINATE_HEAP_RATIO < len(decorated):
+        page = heapq.nsmallest(needed, decorated)
+    else:
+        page = sorted(decorated)
+    return [entries[i] for __, i in page[offset:needed]]
+
+
+def _load_marker(marker):
+    if isinstance(marker, dict):
+        return marker
+    try:
+        return json.loads(marker)
+    except ValueError:
+        msg = _('marker %s can not be analysed, please use json like '
+                'format') % marker
+        raise exception.InvalidInput(reason=msg)
+
+
+def paginate_manageable_entries(names, get_entry, marker, limit, offset,
+                                sort_keys, sort_dirs, workers=8):
+    """Paginate the entries of manageable resources.
+
+    Entries are only built for the resources that may be returned, which
+    when sorting by reference alone are just the ones in the requested page.
+
+    :param names: names of the resources, the value of their reference
+    :param get_entry: function returning the entry for a resource name, or
+                      None if the resource must not be listed
+    :param workers: maximum number of entries built concurrently
+    Other parameters are the same as in paginate_entries_list.
+    """
+    pool = eventlet.GreenPool(workers)
+
+    def get_entries(names):
+        return [entry for entry in pool.imap(get_entry, names)
+                if entry is not None]
+
+    if limit is None or [key.strip() for key in sort_keys] != ['reference']:
+        return paginate_entries_list(get_entries(names), marker, limit,
+                                     offset, sort_keys, sort_dirs)
+
+    # Names are unique, so entries in the page are the ones with the first
+    # names after the marker that have an entry.
+    if sort_dirs[0] == 'asc':
+        select, after = heapq.nsmallest, operator.gt
+    else:
+        select, after = heapq.nlargest, operator.lt
+    if marker:
+        marker = _load_marker(marker)
+        marker_name = sorted(marker.values())[0] if marker else None
+        marker_entry = (get_entry(marker_name) if marker_name in set(names)
+                        else None)
+        if not marker_entry or marker_entry['reference'] != marker:
             msg = _('marker not found: %s') % marker
             raise exception.InvalidInput(reason=msg)
-    range_end = start_index + limit
-    return sorted_entries[start_index + offset:range_end + offset]
+        names = [name for name in names if after(name, marker_name)]
+
+    needed = (offset or 0) + limit
+    entries = []
+    while names and len(entries) < needed:
+        batch = select(needed - len(entries), names)
+        entries.extend(get_entries(batch))
+        names = [name for name in names if after(name, batch[-1])]
+    return entries[offset or 0:needed]
 
 
 def convert_config_string_to_dict(config_string):
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the sha256 loop of incremental chunked backups.
+
+Compares the CPU time spent hashing and diffing chunks against the parent
+backup with the hex string list implementation used before sha256 file
+version 2.0.0, and extrapolates the result to 1 TB of backed up data.
+
+Usage: python tools/benchmarks/backup_sha256.py [--chunks N] [--changed P]
+                                                [--repeat R]
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import os
+import random
+import time
+
+from cinder.backup import chunkeddriver
+
+CHUNK_SIZE = 32 * 1024 * 1024
+BLOCK_SIZE = 32 * 1024
+
+
+def hex_list_loop(chunks, parent_shalist):
+    """The pre 2.0.0 implementation, returning the changed segments."""
+    segments = []
+    shaindex = 0
+    for data in chunks:
+        shalist = []
+        off = 0
+        datalen = len(data)
+        while off < datalen:
+            chunk_end = min(off + BLOCK_SIZE, datalen)
+            shalist.append(hashlib.sha256(data[off:chunk_end]).hexdigest())
+            off += BLOCK_SIZE
+        extent_off = -1
+        for idx, sha in enumerate(shalist):
+            if sha != parent_shalist[shaindex]:
+                if extent_off == -1:
+                    extent_off = idx * BLOCK_SIZE
+            elif extent_off != -1:
+                segments.append(data[extent_off:idx * BLOCK_SIZE])
+                extent_off = -1
+            shaindex += 1
+        if extent_off != -1:
+            segments.append(data[extent_off:datalen])
+    return segments
+
+
+def digest_loop(chunks, parent_digests):
+    """The current implementation, returning the changed segments."""
+    segments = []
+    sha256s = bytearray()
+    for data in chunks:
+        shas = chunkeddriver._sha256_digests(data, BLOCK_SIZE)
+        shaoff = len(sha256s)
+        sha256s += shas
+        view = memoryview(data)
+        for start, end in chunkeddriver._changed_extents(
+                shas, parent_digests[shaoff:shaoff + len(shas)],
+                BLOCK_SIZE, len(data)):
+            segments.append(view[start:end])
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--chunks', type=int, default=16,
+                        help='number of %d MiB chunks' % (CHUNK_SIZE >> 20))
+    parser.add_argument('--changed', type=float, default=0.05,
+                        help='fraction of blocks changed since the parent')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each implementation, the best one is '
+                             'reported')
+    args = parser.parse_args()
+
+    chunks = [os.urandom(CHUNK_SIZE) for _i in range(args.chunks)]
+    parent_digests = bytearray()
+    for data in chunks:
+        digests = bytearray(chunkeddriver._sha256_digests(data, BLOCK_SIZE))
+        for pos in range(0, len(digests), chunkeddriver.SHA256_DIGEST_SIZE):
+            if random.random() < args.changed:
+                digests[pos] ^= 0xff
+        parent_digests += digests
+    parent_digests = bytes(parent_digests)
+    parent_shalist = [
+        binascii.hexlify(parent_digests[pos:pos + 32]).decode('ascii')
+        for pos in range(0, len(parent_digests), 32)]
+
+    total = args.chunks * CHUNK_SIZE
+    results = {}
+    for name, func, parent in (('hex list', hex_list_loop, parent_shalist),
+                               ('digests', digest_loop, parent_digests)):
+        elapsed = None
+        for _i in range(args.repeat):
+            start = time.process_time()
+            segments = func(chunks, parent)
+            run = time.process_time() - start
+            elapsed = run if elapsed is None else min(elapsed, run)
+        results[name] = elapsed
+        print('%-9s %8.3f s CPU, %6d segments, %8.1f s CPU per TB' %
+              (name, elapsed, len(segments),
+               elapsed * (1024 ** 4) / total))
+    print('CPU saved per TB: %.1f s' %
+          ((results['hex list'] - results['digests']) * (1024 ** 4) / total))
+
+    hex_size = len(json.dumps({'sha256s': parent_shalist}, indent=2))
+    digests_size = len(json.dumps(
+        {'sha256s': base64.b64encode(parent_digests).decode('ascii')},
+        indent=2))
+    print('sha256 file size per TB: %.1f MiB with hex list, %.1f MiB with '
+          'digests' % (hex_size * 1024 ** 4 / total / 2 ** 20,
+                       digests_size * 1024 ** 4 / total / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the pagination of manageable volume and snapshot listings.
+
+Paginates entries like the ones drivers return from get_manageable_volumes
+with the comparison function based implementation that sorted all the
+entries and with the current sort key based one, for the first page and for
+a page in the middle of the listing.
+
+Usage: python tools/benchmarks/paginate_entries.py [--entries N]
+                                                   [--limit L]
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import operator
+import random
+import time
+
+from cinder.volume import utils as volume_utils
+
+
+def cmp_paginate_entries_list(entries, marker, limit, offset, sort_keys,
+                              sort_dirs):
+    """The comparison function based implementation."""
+    comparers = [(operator.itemgetter(key.strip()), multiplier)
+                 for (key, multiplier) in zip(sort_keys, sort_dirs)]
+
+    def comparer(left, right):
+        for fn, d in comparers:
+            left_val = fn(left)
+            right_val = fn(right)
+            if isinstance(left_val, dict):
+                left_val = sorted(left_val.values())[0]
+            if isinstance(right_val, dict):
+                right_val = sorted(right_val.values())[0]
+            if left_val == right_val:
+                continue
+            if d == 'asc':
+                return -1 if left_val < right_val else 1
+            else:
+                return -1 if left_val > right_val else 1
+        else:
+            return 0
+    sorted_entries = sorted(entries, key=functools.cmp_to_key(comparer))
+
+    start_index = 0
+    if offset is None:
+        offset = 0
+    if marker:
+        start_index = -1
+        for i, entry in enumerate(sorted_entries):
+            if entry['reference'] == marker:
+                start_index = i + 1
+                break
+    range_end = start_index + limit
+    return sorted_entries[start_index + offset:range_end + offset]
+
+
+def manageable_entry(index):
+    name = 'volume-%08x' % random.getrandbits(32)
+    return {'reference': {'source-name': name},
+            'size': random.randint(1, 100),
+            'cinder_id': None,
+            'safe_to_manage': True,
+            'reason_not_safe': None,
+            'extra_info': None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='number of entries to paginate')
+    parser.add_argument('--limit', type=int, default=1000,
+                        help='number of entries per page')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times each pagination is timed')
+    args = parser.parse_args()
+
+    entries = [manageable_entry(i) for i in range(args.entries)]
+    middle = sorted(entries, key=lambda e: e['reference']['source-name'])
+    marker = middle[len(middle) // 2]['reference']
+
+    for sort_keys, sort_dirs in ((['reference'], ['asc']),
+                                 (['size', 'reference'], ['desc', 'asc'])):
+        for page, page_marker in (('first', None), ('middle', marker)):
+            results = {}
+            for name, func in (('cmp', cmp_paginate_entries_list),
+                               ('key', volume_utils.paginate_entries_list)):
+                start = time.process_time()
+                for _repeat in range(args.repeat):
+                    res = func(entries, page_marker, args.limit, 0,
+                               sort_keys, sort_dirs)
+                results[name] = ((time.process_time() - start) /
+                                 args.repeat, res)
+            assert results['cmp'][1] == results['key'][1]
+            print('%-18s %-6s page: cmp %8.1f ms, key %8.1f ms, %5.1fx' %
+                  (','.join(sort_keys), page,
+                   results['cmp'][0] * 1e3, results['key'][0] * 1e3,
+                   results['cmp'][0] / results['key'][0]))
+
+
+if __name__ == '__main__':
+    main()
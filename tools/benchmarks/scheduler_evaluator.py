@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the evaluation of driver filter and goodness functions.
+
+Evaluates realistic filter and goodness functions for every pool of a
+scheduling request, as the driver filter and goodness weigher do, with the
+pyparsing based implementation that parsed the expression on every call, with
+the parsed tree interpreter and with the compiled functions.
+
+Usage: python tools/benchmarks/scheduler_evaluator.py [--pools N]
+                                                      [--requests R]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+from cinder.scheduler.evaluator import evaluator
+
+EXPRESSIONS = [
+    # Goodness functions
+    "100 * (1 - stats.allocated_capacity_gb / stats.total_capacity_gb)",
+    "capabilities.total_volumes < 50 ? 100 : "
+    "max(0, 100 - capabilities.total_volumes)",
+    "min(100, max(0, stats.free_capacity_gb / volume.size))",
+    "stats.free_capacity_gb > volume.size * 10 && "
+    "capabilities.total_volumes < 100 ? 90 : 10",
+    # Filter functions
+    "volume.size < 500 and stats.free_capacity_gb > volume.size",
+    "capabilities.total_volumes < 1000 || extra.replicated == 1",
+]
+
+
+def pool_variables(index):
+    total = random.randint(1000, 100000)
+    return {
+        'stats': {'host': 'host%d@backend#pool' % index,
+                  'total_capacity_gb': total,
+                  'free_capacity_gb': random.randint(0, total),
+                  'allocated_capacity_gb': random.randint(0, total)},
+        'capabilities': {'total_volumes': random.randint(0, 2000)},
+        'extra': {'replicated': random.randint(0, 1)},
+        'volume': {'size': random.randint(1, 1000)},
+        'qos': {},
+    }
+
+
+def reparse(pools, requests):
+    for _request in range(requests):
+        for expression in EXPRESSIONS:
+            for variables in pools:
+                evaluator.parse(expression).eval(variables)
+
+
+def interpret(pools, requests):
+    trees = [evaluator.parse(expression) for expression in EXPRESSIONS]
+    for _request in range(requests):
+        for tree in trees:
+            for variables in pools:
+                tree.eval(variables)
+
+
+def compiled(pools, requests):
+    for _request in range(requests):
+        for expression in EXPRESSIONS:
+            for variables in pools:
+                evaluator.compile_expression(expression)(variables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pools', type=int, default=400,
+                        help='number of pools evaluated per request')
+    parser.add_argument('--requests', type=int, default=10,
+                        help='number of scheduling requests')
+    args = parser.parse_args()
+
+    pools = [pool_variables(index) for index in range(args.pools)]
+    results = {}
+    # Parsing is so slow that a single request is enough to measure it.
+    for name, func, requests in (('reparse', reparse, 1),
+                                 ('interpret', interpret, args.requests),
+                                 ('compiled', compiled, args.requests)):
+        start = time.process_time()
+        func(pools, requests)
+        elapsed = (time.process_time() - start) / requests
+        results[name] = elapsed
+        print('%-9s %9.2f ms CPU per request, %8.2f us per evaluation' %
+              (name, elapsed * 1e3,
+               elapsed * 1e6 / len(EXPRESSIONS) / args.pools))
+    print('compiled speedup: %.1fx over reparse, %.1fx over interpret' %
+          (results['reparse'] / results['compiled'],
+           results['interpret'] / results['compiled']))
+
+
+if __name__ == '__main__':
+    main()
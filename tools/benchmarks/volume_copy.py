@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark volume copies between file objects.
+
+Copies between file objects, as copy_volume does for the volume handles of
+connectors like RBD, with the loop that dispatched every read and write to
+tpool and with the current copy running in native threads. Every read and
+write of the file objects waits for the given latency, standing for the
+round trips of a remote volume, and the source can be made mostly zeros to
+measure sparse copies.
+
+Usage: python tools/benchmarks/volume_copy.py [--size-mb N] [--latency-ms L]
+                                              [--zero-ratio R]
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import math
+import os
+import random
+import time
+
+import eventlet
+from eventlet import tpool
+from oslo_utils import units
+
+from cinder.volume import utils as volume_utils
+
+CHUNK_SIZE = 4 * units.Mi
+
+
+class LatencyIO(io.RawIOBase):
+    """Seekable in-memory raw file object with a latency per call."""
+
+    def __init__(self, size, latency, data=None):
+        self.buf = data if data is not None else bytearray(size)
+        self.pos = 0
+        self.latency = latency
+        self.writes = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.buf)
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        time.sleep(self.latency)
+        count = min(len(b), len(self.buf) - self.pos)
+        b[:count] = self.buf[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+    def write(self, b):
+        time.sleep(self.latency)
+        count = len(b)
+        self.buf[self.pos:self.pos + count] = b
+        self.pos += count
+        self.writes += 1
+        return count
+
+
+def source_data(size, zero_ratio):
+    data = bytearray(size)
+    for offset in range(0, size, CHUNK_SIZE):
+        if random.random() >= zero_ratio:
+            data[offset:offset + CHUNK_SIZE] = os.urandom(CHUNK_SIZE)
+    return data
+
+
+def legacy_transfer(src, dest, length, chunk_size):
+    """The loop dispatching each read and write to tpool."""
+    chunks = int(math.ceil(length / chunk_size))
+    remaining_length = length
+    for _chunk in range(0, chunks):
+        data = tpool.execute(src.read, min(chunk_size, remaining_length))
+        if data == b'':
+            break
+        tpool.execute(dest.write, data)
+        remaining_length -= len(data)
+        eventlet.sleep(0)
+    tpool.execute(dest.flush)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=1024,
+                        help='size of the copied volume in MiB')
+    parser.add_argument('--latency-ms', type=float, default=5,
+                        help='latency of every read and write in ms')
+    parser.add_argument('--zero-ratio', type=float, default=0.5,
+                        help='share of the 4 MiB chunks of the source that '
+                             'are zeros')
+    args = parser.parse_args()
+
+    size = args.size_mb * units.Mi
+    latency = args.latency_ms / 1000.0
+    data = source_data(size, args.zero_ratio)
+
+    copies = (
+        ('legacy', legacy_transfer),
+        ('native', volume_utils._transfer_data),
+        ('sparse', lambda *a: volume_utils._transfer_data(*a, sparse=True)),
+    )
+    results = {}
+    for name, transfer in copies:
+        src = LatencyIO(size, latency, data)
+        dest = LatencyIO(size, latency)
+        start = time.time()
+        transfer(src, dest, size, CHUNK_SIZE)
+        elapsed = time.time() - start
+        assert dest.buf == data, '%s copy is corrupted' % name
+        results[name] = elapsed
+        print('%-7s %8.1f ms, %7.1f MiB/s, %5d writes' %
+              (name, elapsed * 1e3, args.size_mb / elapsed, dest.writes))
+    print('native speedup: %.1fx, sparse speedup: %.1fx' %
+          (results['legacy'] / results['native'],
+           results['legacy'] / results['sparse']))
+
+
+if __name__ == '__main__':
+    main()